@@ -4,7 +4,8 @@ import os
 from os.path import exists, splitext, dirname, isdir, basename, join
 from adjust_sources import Sources
 from logger import Logger
-from utils import getoutput,  get_apt_force,  get_package_version,  \
+from configfiles import get_info
+from utils import getoutput,  get_apt_force,  get_package_versions,  \
                   get_apt_cache_locked_program,  has_string_in_file,  \
                   get_debian_version,  can_copy, get_swap_device
 
@@ -45,9 +46,11 @@ gtk_deprecated_properties = ['child-displacement',
                              'shadow-type']
 
 ver = get_debian_version()
+# Versions of all packages in one pass
+prog_versions = get_package_versions(set(prog[0] for prog in fix_progs))
 for prog in fix_progs:
     if ver >= prog[3] or prog[3] == 0:
-        if get_package_version(prog[0]) != '':
+        if prog_versions[prog[0]]['installed'] != '':
             if prog[2] == 'purge' or prog[2] == 'install':
                 if get_apt_cache_locked_program() == '':
                     os.system("apt-get %s %s %s" % (prog[2], force, prog[1]))
@@ -135,17 +138,17 @@ try:
         os.system("echo 'RESUME=none' > %s" % resume)
     
     # Restore LSB information
-    codename = getoutput("grep CODENAME /usr/share/solydxk/info")[0].strip()
-    if not has_string_in_file(codename, "/etc/lsb-release"):
+    codename = "CODENAME=%s" % get_info('CODENAME')
+    if get_info('CODENAME') and not has_string_in_file(codename, "/etc/lsb-release"):
         with open("/etc/lsb-release", "w") as f:
-            f.writelines(getoutput("grep DISTRIB_ID /usr/share/solydxk/info")[0].strip() + "\n")
-            f.writelines("DISTRIB_" + getoutput("grep \"RELEASE=\" /usr/share/solydxk/info")[0].strip() + "\n")
+            f.writelines("DISTRIB_ID=%s\n" % get_info('DISTRIB_ID'))
+            f.writelines("DISTRIB_RELEASE=%s\n" % get_info('RELEASE'))
             f.writelines("DISTRIB_" + codename + "\n")
-            f.writelines("DISTRIB_" + getoutput("grep DESCRIPTION /usr/share/solydxk/info")[0].strip() + "\n")
+            f.writelines("DISTRIB_DESCRIPTION=\"%s\"\n" % get_info('DESCRIPTION'))
         log.write("/etc/lsb-release overwritten",  'lsb-release')
 
     # Restore /etc/issue and /etc/issue.net
-    issue = getoutput("grep DESCRIPTION /usr/share/solydxk/info")[0].replace("DESCRIPTION=", "").replace("\"", "")
+    issue = get_info('DESCRIPTION')
     if not has_string_in_file(issue, "/etc/issue"):
         with open("/etc/issue", "w") as f:
             f.writelines(issue + " \\n \\l\n")
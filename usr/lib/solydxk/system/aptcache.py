@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# One python-apt cache for the whole process
+# ====================================================================
+# from aptcache import apt_cache
+# apt_cache.has_package('firefox-esr-l10n-nl')
+# apt_cache.get_versions(['openssl', 'plymouth'])
+#     -> {'openssl': {'installed': ..., 'candidate': ..., 'origins': [...]}, ...}
+#
+# The cache is opened on first use and opened again only when the
+# package lists (apt-get update) or the dpkg status (install, remove)
+# changed since it was opened.
+# ====================================================================
+
+import os
+import threading
+
+# Files and directories that change after apt-get update, install or remove
+APT_INPUTS = ['/var/lib/apt/lists', '/var/lib/dpkg/status', '/etc/apt/preferences.d']
+
+
+class AptCache():
+    def __init__(self):
+        self._cache = None
+        self._names = set()
+        self._signature = None
+        self._lock = threading.RLock()
+        # False when python-apt cannot be loaded
+        self.available = True
+
+    def _get_signature(self):
+        sig = []
+        for path in APT_INPUTS:
+            try:
+                st = os.stat(path)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return sig
+
+    # Return the apt.Cache object or None when python-apt is not available
+    def get_cache(self):
+        with self._lock:
+            if not self.available:
+                return None
+            signature = self._get_signature()
+            if self._cache is not None and signature == self._signature:
+                return self._cache
+            try:
+                if self._cache is None:
+                    # python-apt is slow to import: only load it when needed
+                    import apt
+                    self._cache = apt.Cache()
+                else:
+                    self._cache.open()
+                # Set of package names for fast existence checks
+                self._names = set(self._cache.keys())
+                self._signature = signature
+            except Exception as detail:
+                print(("Could not open the apt cache: %s" % detail))
+                self.available = False
+                self._cache = None
+                self._names = set()
+            return self._cache
+
+    # Open the cache again on the next call (e.g. after changing sources.list)
+    def invalidate(self):
+        with self._lock:
+            self._signature = None
+
+    def has_package(self, name):
+        with self._lock:
+            self.get_cache()
+            return name in self._names
+
+    # Return {name: {'installed', 'candidate', 'origins'}} for all names in one pass
+    # Versions are '(none)' when there is no such version and empty for unknown packages
+    # origins: "site archive/component" of every available version (e.g. "deb.debian.org buster-backports/main")
+    # None is returned when python-apt is not available
+    def get_versions(self, names):
+        with self._lock:
+            cache = self.get_cache()
+            if cache is None:
+                return None
+            versions = {}
+            for name in names:
+                if name not in self._names:
+                    versions[name] = {'installed': '', 'candidate': '', 'origins': []}
+                    continue
+                pck = cache[name]
+                origins = []
+                for version in pck.versions:
+                    for origin in version.origins:
+                        # The dpkg status file is not an origin
+                        if origin.archive == 'now':
+                            continue
+                        origin_str = "%s %s/%s" % (origin.site, origin.archive, origin.component)
+                        if origin_str not in origins:
+                            origins.append(origin_str)
+                versions[name] = {'installed': pck.installed.version if pck.installed is not None else '(none)',
+                                  'candidate': pck.candidate.version if pck.candidate is not None else '(none)',
+                                  'origins': origins}
+            return versions
+
+
+# Shared instance
+apt_cache = AptCache()
@@ -0,0 +1,117 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Index of block device identities from a single blkid probe
+# ====================================================================
+# from blockindex import block_index
+# block_index.get('/dev/sda1')      -> {'UUID': ..., 'LABEL': ..., 'TYPE': ...}
+# block_index.get_value('/dev/sda1', 'TYPE')
+# block_index.find('UUID', '1234-ABCD') -> '/dev/sda1'
+#
+# The index is built from "blkid -o export" and rebuilt when the udev
+# links in /dev/disk or /dev/mapper change, or when the 'devices' tag
+# of the result cache is invalidated (e.g. after mkfs or luksFormat).
+# ====================================================================
+
+import os
+import re
+from cache import cached
+
+# Directories that change when devices or file systems are added, removed or relabeled
+WATCH_DIRS = ['/dev/disk/by-uuid', '/dev/disk/by-label', '/dev/disk/by-partuuid', '/dev/mapper']
+
+
+# Parse "blkid -o export" output: {device: {key: value}}
+def parse_blkid_export(lines):
+    devices = {}
+    values = {}
+    for line in lines + ['']:
+        line = line.strip()
+        if not line:
+            device = values.pop('DEVNAME', '')
+            if device:
+                devices[device] = values
+            values = {}
+            continue
+        key, sep, value = line.partition('=')
+        if sep:
+            # blkid escapes spaces and shell characters with a backslash
+            values[key] = re.sub(r'\\(.)', r'\1', value)
+    return devices
+
+
+# Signature of the watched directories: changes when udev adds or removes links
+def get_signature():
+    sig = []
+    for path in WATCH_DIRS:
+        try:
+            sig.append(os.stat(path).st_mtime_ns)
+        except OSError:
+            sig.append(None)
+    return tuple(sig)
+
+
+# One blkid run per signature; the 'devices' tag removes all probes
+@cached(tags=['devices'])
+def probe_devices(signature):
+    # utils imports this module: import run_process on first use
+    from utils import run_process
+    # Do not use the blkid cache file: it can be outdated
+    result = run_process(['blkid', '-c', '/dev/null', '-o', 'export'])
+    return parse_blkid_export(result.lines)
+
+
+# Probe a single device that is not in the index
+@cached(ttl=60, tags=['devices'])
+def probe_device(device):
+    from utils import run_process
+    result = run_process(['blkid', '-c', '/dev/null', '-o', 'export', device])
+    return parse_blkid_export(result.lines).get(device, {})
+
+
+class BlockDeviceIndex():
+    def __init__(self):
+        self.signature = None
+        self.devices = {}
+        self.reverse = {}
+
+    def _update(self):
+        signature = get_signature()
+        devices = probe_devices(signature)
+        if devices is self.devices:
+            return
+        self.signature = signature
+        self.devices = devices
+        # Reverse maps: {key: {value: device}}
+        self.reverse = {}
+        for device, values in devices.items():
+            for key, value in values.items():
+                self.reverse.setdefault(key, {}).setdefault(value, device)
+
+    # Return the blkid values of a device
+    # Devices missing from the index (e.g. symbolic links) are probed separately
+    def get(self, device):
+        self._update()
+        values = self.devices.get(device)
+        if values is None:
+            values = self.devices.get(os.path.realpath(device))
+        if values is None:
+            values = probe_device(device)
+        return values
+
+    def get_value(self, device, key):
+        return self.get(device).get(key, '')
+
+    # Return the device with the given value (e.g. UUID) or an empty string
+    def find(self, key, value):
+        self._update()
+        return self.reverse.get(key, {}).get(value, '')
+
+    # {device: values} of all probed devices
+    def get_devices(self):
+        self._update()
+        return dict(self.devices)
+
+
+# Shared instance
+block_index = BlockDeviceIndex()
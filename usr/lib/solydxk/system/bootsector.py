@@ -0,0 +1,56 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Detect boot loaders in the first sector of a device
+# ====================================================================
+# from bootsector import get_bootloader, get_bootloaders
+# get_bootloader('/dev/sda')                -> 'grub'
+# get_bootloaders(['/dev/sda', '/dev/sdb1']) -> {'/dev/sda': 'grub', '/dev/sdb1': ''}
+#
+# The sector is read with a single os.pread. Results are not cached:
+# the pattern scan costs less than reading the sector.
+# ====================================================================
+
+import os
+
+SECTOR_SIZE = 512
+
+# Boot loader: byte patterns in the (upper cased) boot sector
+SIGNATURES = [('grub', [b'GRUB']),
+              ('syslinux', [b'SYSLINUX', b'ISOLINUX', b'EXTLINUX']),
+              ('lilo', [b'LILO']),
+              ('windows', [b'BOOTMGR', b'NTLDR'])]
+
+# Return the first sector of a device or None when it cannot be read
+def read_boot_sector(device, size=SECTOR_SIZE):
+    try:
+        fd = os.open(device, os.O_RDONLY)
+    except OSError:
+        return None
+    try:
+        return os.pread(fd, size, 0)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+
+# Return the name of the boot loader in the sector or an empty string
+def detect_bootloader(sector):
+    sector = sector.upper()
+    for bootloader, patterns in SIGNATURES:
+        if any(pattern in sector for pattern in patterns):
+            return bootloader
+    return ''
+
+
+def get_bootloader(device):
+    sector = read_boot_sector(device)
+    if not sector:
+        return ''
+    return detect_bootloader(sector)
+
+
+# Return {device: boot loader} for a list of devices
+def get_bootloaders(devices):
+    return {device: get_bootloader(device) for device in devices}
@@ -0,0 +1,103 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Result cache for repeated system probes
+# ====================================================================
+# from cache import cached, invalidate
+#
+# @cached(ttl=60, tags=['devices'])
+# def get_uuid(partition_path):
+#     ...
+#
+# invalidate('devices')     # e.g. after formatting a partition
+# invalidate()              # everything
+#
+# ttl: seconds a result is valid (None: until invalidated)
+# tags: names used to invalidate groups of results
+#
+# Commands that change the system invalidate their tags automatically:
+# utils calls invalidate_for_command() after running a command.
+# ====================================================================
+
+import re
+import time
+import threading
+from functools import wraps
+
+# Commands (regular expression) and the tags they invalidate
+# apt runs that only simulate (--assume-no, -s, --simulate) change nothing
+COMMAND_RULES = [
+    (r'^(?!.*\s(--assume-no|-s|--simulate)(\s|$))'
+     r'.*\b(apt-get|apt|aptitude)\s.*\b(install|remove|purge|upgrade|dist-upgrade|full-upgrade|autoremove|update)\b', 'packages'),
+    (r'\bdpkg\s.*(-i\b|--install|-r\b|--remove|-P\b|--purge|--set-selections|--configure)', 'packages'),
+    (r'\b(mkfs(\.\w+)?|mkswap|luksFormat|e2label|fatlabel|ntfslabel|exfatlabel|btrfs\s+filesystem\s+label|wipefs|parted|sgdisk)\b', 'devices'),
+]
+
+
+class ResultCache():
+    def __init__(self):
+        # key: [value, expire time or None, tags]
+        self.entries = {}
+        # function name: [hits, misses]
+        self.stats = {}
+        self.rules = [(re.compile(regexp), tag) for regexp, tag in COMMAND_RULES]
+        self._lock = threading.Lock()
+
+    # Decorator
+    def cached(self, ttl=None, tags=[]):
+        def decorator(func):
+            name = func.__name__
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                key = (name, args, tuple(sorted(kwargs.items())))
+                with self._lock:
+                    stats = self.stats.setdefault(name, [0, 0])
+                    entry = self.entries.get(key)
+                    if entry is not None and (entry[1] is None or entry[1] > time.time()):
+                        stats[0] += 1
+                        return entry[0]
+                    stats[1] += 1
+                # Call the function outside the lock: it may take a while
+                value = func(*args, **kwargs)
+                expires = None if ttl is None else time.time() + ttl
+                with self._lock:
+                    self.entries[key] = [value, expires, tags]
+                return value
+
+            # Remove the results of this function only
+            wrapper.invalidate = lambda: self.invalidate_function(name)
+            return wrapper
+        return decorator
+
+    # Remove all results with the given tag (all results when tag is None)
+    def invalidate(self, tag=None):
+        with self._lock:
+            if tag is None:
+                self.entries.clear()
+            else:
+                for key in [k for k, v in self.entries.items() if tag in v[2]]:
+                    del self.entries[key]
+
+    def invalidate_function(self, name):
+        with self._lock:
+            for key in [k for k in self.entries if k[0] == name]:
+                del self.entries[key]
+
+    # Invalidate the tags of the rules that match the command
+    def invalidate_for_command(self, command):
+        for regexp, tag in self.rules:
+            if regexp.search(command):
+                self.invalidate(tag)
+
+    # Return {function name: {'hits': n, 'misses': n}}
+    def get_stats(self):
+        with self._lock:
+            return {name: {'hits': s[0], 'misses': s[1]} for name, s in self.stats.items()}
+
+
+# Shared instance
+cache = ResultCache()
+cached = cache.cached
+invalidate = cache.invalidate
+invalidate_for_command = cache.invalidate_for_command
@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+
+# Find packages that can be removed: autoremove, deborphan and old kernels
+# Used by the GUI and the command line interface
+
+import re
+from utils import run_process, get_process_output, compare_package_versions, \
+                  get_apt_force, get_kernel_release
+
+
+# Return the names of all packages dpkg knows
+def get_package_names():
+    return [pck for pck in get_process_output(['dpkg-query', '-f', '${binary:Package}\n', '-W']) if pck]
+
+
+def get_autoremove_packages():
+    ret = []
+    # Use LANG=C to ensure the output of autoremove is always en_US
+    # apt-get returns 1 when it aborts (--assume-no): read the output anyway
+    result = run_process(['sudo', 'apt-get', 'autoremove', '--assume-no'], env={'LANG': 'C'})
+    # The packages are listed on indented lines
+    lst = [line for line in result.stdout.splitlines() if line.startswith(' ')]
+
+    # Loop through each line and fill the package lists
+    for line in lst:
+        packages = line.split()
+        for package in packages:
+            package = package.strip().replace('*', '')
+            if package and package not in ret:
+                ret.append(package)
+    return ret
+
+
+def get_deborphan_packages():
+    return [pck for pck in get_process_output(['deborphan']) if pck]
+
+
+def get_old_kernel_packages():
+    kernel_packages = []
+    # Check booted kernel version
+    regexp = '[0-9][0-9\.\-]+[0-9]'
+    matchObj = re.search(regexp, get_kernel_release())
+    cur_version = matchObj.group(0) if matchObj else ''
+    #cur_version = getoutput("ls -al / | grep -e '\svmlinuz\s' | egrep -o '%s'" % regexp)[0]
+    # Get kernel packages not with cur_version
+    all_packages = get_package_names()
+    packages = [pck for pck in all_packages
+                if re.search('linux-image-[0-9]|linux-headers-[0-9]', pck)
+                and cur_version not in pck
+                and not re.search('[a-z]-486|[a-z]-686|[a-z]-586', pck)]
+    # Check version number of found kernel packages
+    for pck in packages:
+        matchObj = re.search(regexp, pck)
+        if matchObj:
+            if compare_package_versions(matchObj.group(0), cur_version) == 'smaller':
+                # Add to the kernel_packages list
+                kernel_packages.append(pck)
+
+    if kernel_packages:
+        # Add kbuild packages
+        del_string = '.0'
+        try:
+            kbuild_version = cur_version[:cur_version.index('-')]
+        except:
+            kbuild_version = cur_version
+        while kbuild_version.endswith(del_string):
+            kbuild_version = kbuild_version[:-len(del_string)]
+        kernel_packages.extend([pck for pck in all_packages
+                                if 'linux-kbuild' in pck and kbuild_version not in pck])
+    return kernel_packages
+
+
+# Return list with [selected, package] lists
+# Packages from autoremove are selected by default
+def get_cleanup_packages():
+    pck_data = []
+    for pck in get_autoremove_packages():
+        pck_data.append([True, pck])
+    for pck in get_deborphan_packages() + get_old_kernel_packages():
+        if [True, pck] not in pck_data and [False, pck] not in pck_data:
+            pck_data.append([False, pck])
+    return pck_data
+
+
+# Return the commands that remove the given packages (argument lists for ExecuteThreadedCommands)
+def get_cleanup_command(packages):
+    force = get_apt_force().split()
+    return [['apt-get'] + force + ['clean'],
+            ['apt-get', 'purge'] + force + list(packages)]
@@ -0,0 +1,436 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Command line interface for SolydXK System Settings
+# ====================================================================
+# Uses the same backend modules as the GUI without loading Gtk.
+#
+# solydxk-system-cli [--json] [-y] <section> <action> [arguments]
+#
+# mirrors list [--speed]          List mirrors (and test their speed)
+# mirrors set URL [URL ...]       Use the given mirrors in sources.list
+# mirrors rank                    Rank the mirrors on their saved speed tests
+# mirrors fastest                 Use the best ranked mirrors in sources.list
+# locales list                    List supported locales and time zones
+# locales set [--default LOCALE] [--add LOCALE ...] [--remove LOCALE ...] [--timezone ZONE]
+# splash list                     List installed Plymouth themes
+# splash set THEME [--resolution WxH]
+# splash disable
+# holdback list [--installed]     List held back (or installed) packages
+# holdback add|remove PKG [PKG ...]
+# cleanup list                    List packages that can be removed
+# cleanup run [--all] [PKG ...]   Remove listed packages (default: autoremove packages)
+#
+# Exit codes: 0 = success, 1 = error, 2 = wrong arguments
+# ====================================================================
+
+import os
+import sys
+import json
+import argparse
+from queue import Queue, Empty
+from logger import Logger
+
+# i18n: http://docs.python.org/3/library/gettext.html
+import gettext
+from gettext import gettext as _
+gettext.textdomain('solydxk-system')
+
+LOG_FILE = '/var/log/solydxk-system.log'
+EXCLUDE_MIRRORS = ['security', 'community']
+
+
+class CliError(Exception):
+    pass
+
+
+class SolydXKSystemCli():
+    def __init__(self, args):
+        self.args = args
+        self.log = None
+
+    # =================================================================
+    # Helper functions
+    # =================================================================
+
+    def get_log(self):
+        if self.log is None:
+            self.log = Logger(LOG_FILE, addLogTime=True, maxSizeKB=5120, useDialogs=False)
+        return self.log
+
+    def require_root(self):
+        if os.geteuid() != 0:
+            raise CliError(_("You need to be root to change the system settings."))
+
+    # Ask confirmation unless --yes was given
+    def confirm(self, question):
+        if self.args.yes:
+            return True
+        if not sys.stdin.isatty():
+            raise CliError(_("Not running interactively: use --yes to confirm."))
+        answer = input("%s [y/N] " % question)
+        return answer.strip().lower() in ['y', 'yes']
+
+    # Print progress on stderr (stdout is reserved for the result)
+    def progress(self, message):
+        if not self.args.json:
+            sys.stderr.write("%s\n" % message)
+            sys.stderr.flush()
+
+    # Start a backend thread and return the items it put in the queue
+    def run_thread(self, thread, queue, show_progress=True):
+        items = []
+        thread.daemon = True
+        thread.start()
+        while thread.is_alive() or not queue.empty():
+            try:
+                item = queue.get(timeout=0.25)
+            except Empty:
+                continue
+            queue.task_done()
+            items.append(item)
+            # Localize and PlymouthSave put [max steps, current step]
+            if show_progress and isinstance(item, list) and len(item) == 2:
+                self.progress("%d/%d" % (item[1], item[0]))
+        thread.join()
+        return items
+
+    def apt_update(self):
+        from utils import ExecuteThreadedCommands
+        self.progress("apt-get update")
+        queue = Queue()
+        self.run_thread(ExecuteThreadedCommands("apt-get update", queue), queue, False)
+
+    # =================================================================
+    # Mirrors
+    # =================================================================
+
+    def mirrors_list(self):
+        from mirror import get_mirror_data, is_url_in_sources, MirrorGetSpeed
+        mirrors = []
+        for data in get_mirror_data(excludeMirrors=EXCLUDE_MIRRORS):
+            if len(data) > 2:
+                mirrors.append({'current': is_url_in_sources(data[2], EXCLUDE_MIRRORS),
+                                'country': data[0],
+                                'repository': data[1],
+                                'url': data[2],
+                                'speed': ''})
+        if self.args.speed:
+            # MirrorGetSpeed expects the treeview rows: [current, country, repository, url, speed]
+            rows = [[m['current'], m['country'], m['repository'], m['url'], ''] for m in mirrors]
+            queue = Queue()
+            for item in self.run_thread(MirrorGetSpeed(rows, queue), queue, False):
+                # item: [url, speed, index, total]
+                for m in mirrors:
+                    if m['url'].rstrip('/') == item[0]:
+                        m['speed'] = item[1]
+                self.progress("%d/%d %s: %s" % (item[2], item[3], item[0], item[1]))
+        lines = []
+        for m in mirrors:
+            lines.append("%s %-15s %-10s %-50s %s" % ('*' if m['current'] else ' ', m['country'], m['repository'], m['url'], m['speed']))
+        return (mirrors, lines)
+
+    def mirrors_set(self):
+        from mirror import get_mirror_data
+        self.require_root()
+        return self.apply_mirrors(self.args.urls, get_mirror_data(excludeMirrors=EXCLUDE_MIRRORS))
+
+    def mirrors_rank(self):
+        from mirror import get_mirror_data
+        from mirrorhistory import mirror_history
+        urls = [data[2] for data in get_mirror_data(excludeMirrors=EXCLUDE_MIRRORS) if len(data) > 2]
+        rankings = mirror_history.get_rankings(urls)
+        if not rankings:
+            raise CliError(_("There are no speed test results yet: run mirrors list --speed first."))
+        lines = []
+        for r in rankings:
+            lines.append("%-50s %8.0f kb/s %6.0f ms %3.0f%% %s (%d)" % (r['mirror'], r['speed'], r['ttfb'] * 1000,
+                                                                     r['failure_rate'] * 100, _("failed"), r['samples']))
+        return (rankings, lines)
+
+    def mirrors_fastest(self):
+        from mirror import get_mirror_data
+        from mirrorhistory import get_fastest_mirrors
+        self.require_root()
+        mirrorData = get_mirror_data(excludeMirrors=EXCLUDE_MIRRORS)
+        urls = get_fastest_mirrors(mirrorData)
+        if not urls:
+            raise CliError(_("There are no speed test results yet: run mirrors list --speed first."))
+        return self.apply_mirrors(urls, mirrorData)
+
+    # Use the given mirror urls in sources.list
+    def apply_mirrors(self, urls, mirrorData):
+        from mirror import get_replace_repos, Mirror
+        replaceRepos = get_replace_repos(urls, mirrorData, EXCLUDE_MIRRORS)
+        if not replaceRepos:
+            return ({'changed': []}, [_("The mirrors are already in use.")])
+        if not self.confirm(_("Change the mirrors in sources.list?")):
+            raise CliError(_("Cancelled"))
+        ret = Mirror().save(replaceRepos, EXCLUDE_MIRRORS)
+        if ret != '':
+            raise CliError(str(ret))
+        self.get_log().write("Mirrors changed: %s" % str(replaceRepos), 'cli')
+        if not self.args.no_update:
+            self.apt_update()
+        lines = ["%s -> %s" % (repo[0] if repo[0] else '+', repo[1]) for repo in replaceRepos]
+        return ({'changed': [{'old': repo[0], 'new': repo[1]} for repo in replaceRepos]}, lines)
+
+    # =================================================================
+    # Locales
+    # =================================================================
+
+    def locales_list(self):
+        from localize import LocaleInfo
+        locale_info = LocaleInfo()
+        languages = locale_info.get_readable_languages()
+        locales = []
+        lines = []
+        for loc in locale_info.locales:
+            installed = loc in locale_info.available_locales
+            default = loc == locale_info.default_locale
+            locales.append({'locale': loc,
+                            'language': languages.get(loc, ''),
+                            'installed': installed,
+                            'default': default})
+            lines.append("%s%s %-12s %s" % ('*' if installed else ' ', 'D' if default else ' ', loc, languages.get(loc, '')))
+        timezone = os.path.join(locale_info.current_timezone_continent, locale_info.current_timezone)
+        lines.append('')
+        lines.append("%s: %s" % (_("Time zone"), timezone))
+        return ({'locales': locales,
+                 'default': locale_info.default_locale,
+                 'timezone': timezone}, lines)
+
+    def locales_set(self):
+        from localize import LocaleInfo, Localize
+        self.require_root()
+        locale_info = LocaleInfo()
+        default = self.args.default or locale_info.default_locale
+        for loc in [default] + self.args.add + self.args.remove:
+            if loc not in locale_info.locales:
+                raise CliError("%s: %s" % (_("Unsupported locale"), loc))
+        if default in self.args.remove:
+            raise CliError(_("The default locale cannot be removed."))
+        timezone = self.args.timezone
+        if not timezone:
+            timezone = os.path.join(locale_info.current_timezone_continent, locale_info.current_timezone)
+        if not os.path.exists(os.path.join('/usr/share/zoneinfo', timezone)):
+            raise CliError("%s: %s" % (_("Unknown time zone"), timezone))
+
+        # Localize expects the treeview rows: [install, locale, language, default]
+        languages = locale_info.get_readable_languages()
+        locales = []
+        for loc in locale_info.locales:
+            install = (loc in locale_info.available_locales or loc in self.args.add or loc == default) \
+                      and loc not in self.args.remove
+            locales.append([install, loc, languages.get(loc, ''), loc == default])
+
+        if not self.confirm(_("Configure the locales and install the language packages?")):
+            raise CliError(_("Cancelled"))
+        self.get_log().write("Localize: default=%s, timezone=%s" % (default, timezone), 'cli')
+        queue = Queue()
+        self.run_thread(Localize(locales, timezone, queue), queue)
+        installed = [loc[1] for loc in locales if loc[0]]
+        return ({'default': default, 'timezone': timezone, 'installed': installed},
+                ["%s: %s" % (_("Default locale"), default), "%s: %s" % (_("Time zone"), timezone)])
+
+    # =================================================================
+    # Plymouth splash
+    # =================================================================
+
+    def splash_list(self):
+        from plymouth import Plymouth
+        plymouth = Plymouth(self.get_log())
+        current = plymouth.getCurrentTheme()
+        themes = plymouth.getInstalledThemes()
+        themes = [t for t in themes if t]
+        lines = ["%s %s" % ('*' if t == current else ' ', t) for t in themes]
+        return ({'themes': themes,
+                 'current': current,
+                 'resolution': plymouth.getCurrentResolution()}, lines)
+
+    def splash_set(self, disable=False):
+        from plymouth import Plymouth, PlymouthSave
+        from utils import get_current_resolution
+        self.require_root()
+        theme = None
+        resolution = None
+        if not disable:
+            plymouth = Plymouth(self.get_log())
+            theme = self.args.theme
+            if theme not in plymouth.getInstalledThemes():
+                raise CliError("%s: %s" % (_("Plymouth theme not installed"), theme))
+            resolution = self.args.resolution or plymouth.getCurrentResolution() or get_current_resolution()
+            if not resolution:
+                raise CliError(_("Could not determine the resolution: use --resolution."))
+        if not self.confirm(_("Change the boot splash and update grub/initramfs?")):
+            raise CliError(_("Cancelled"))
+        queue = Queue()
+        self.run_thread(PlymouthSave(theme, resolution, queue, self.get_log()), queue)
+        return ({'theme': theme, 'resolution': resolution},
+                [_("Plymouth splash disabled") if disable else "%s (%s)" % (theme, resolution)])
+
+    # =================================================================
+    # Hold back packages
+    # =================================================================
+
+    def holdback_list(self):
+        from holdback import get_held_packages, get_installed_packages
+        packages = get_installed_packages() if self.args.installed else get_held_packages()
+        return ({'packages': packages}, packages)
+
+    def holdback_change(self, hold):
+        from holdback import get_held_packages, hold_packages, unhold_packages
+        self.require_root()
+        question = _("Hold back these packages?") if hold else _("Release these packages?")
+        if not self.confirm("%s\n%s" % (' '.join(self.args.packages), question)):
+            raise CliError(_("Cancelled"))
+        if hold:
+            done = hold_packages(self.args.packages, self.get_log())
+        else:
+            done = unhold_packages(self.args.packages, self.get_log())
+        if not done:
+            raise CliError(_("Could not change the hold back selection of the packages."))
+        held = get_held_packages()
+        return ({'held': held}, held)
+
+    # =================================================================
+    # Cleanup
+    # =================================================================
+
+    def cleanup_list(self):
+        from cleanup import get_cleanup_packages
+        packages = [{'package': p[1], 'autoremove': p[0]} for p in get_cleanup_packages()]
+        lines = ["%s %s" % ('*' if p['autoremove'] else ' ', p['package']) for p in packages]
+        return ({'packages': packages}, lines)
+
+    def cleanup_run(self):
+        from cleanup import get_cleanup_packages, get_cleanup_command
+        from utils import ExecuteThreadedCommands
+        self.require_root()
+        candidates = get_cleanup_packages()
+        packages = self.args.packages
+        if packages:
+            # Only packages that cleanup list shows can be removed
+            unknown = [p for p in packages if p not in [c[1] for c in candidates]]
+            if unknown:
+                raise CliError(_("Not a package to clean up: %s") % ' '.join(unknown))
+        else:
+            packages = [p[1] for p in candidates if p[0] or self.args.all]
+        if not packages:
+            return ({'removed': []}, [_("There are no packages to remove.")])
+        if not self.confirm("%s\n%s" % (' '.join(packages), _("Remove these packages?"))):
+            raise CliError(_("Cancelled"))
+        self.get_log().write("Remove packages: %s" % ' '.join(packages), 'cli')
+        queue = Queue()
+        ret = self.run_thread(ExecuteThreadedCommands(get_cleanup_command(packages), queue), queue, False)
+        if [r for r in ret if r != 0]:
+            raise CliError(_("Could not remove the packages."))
+        return ({'removed': packages}, packages)
+
+    # =================================================================
+    # Run the selected action and print the result
+    # =================================================================
+
+    def run(self):
+        actions = {('mirrors', 'list'): self.mirrors_list,
+                   ('mirrors', 'set'): self.mirrors_set,
+                   ('mirrors', 'rank'): self.mirrors_rank,
+                   ('mirrors', 'fastest'): self.mirrors_fastest,
+                   ('locales', 'list'): self.locales_list,
+                   ('locales', 'set'): self.locales_set,
+                   ('splash', 'list'): self.splash_list,
+                   ('splash', 'set'): self.splash_set,
+                   ('splash', 'disable'): lambda: self.splash_set(disable=True),
+                   ('holdback', 'list'): self.holdback_list,
+                   ('holdback', 'add'): lambda: self.holdback_change(True),
+                   ('holdback', 'remove'): lambda: self.holdback_change(False),
+                   ('cleanup', 'list'): self.cleanup_list,
+                   ('cleanup', 'run'): self.cleanup_run}
+        # The backend modules print to stdout and so do the commands they run:
+        # redirect stdout to stderr to keep the json output clean
+        stdout_fd = None
+        if self.args.json:
+            sys.stdout.flush()
+            stdout_fd = os.dup(1)
+            os.dup2(2, 1)
+        try:
+            data, lines = actions[(self.args.section, self.args.action)]()
+            ret = 0
+        except CliError as detail:
+            data = {'error': str(detail)}
+            lines = ["%s: %s" % (_("Error"), detail)]
+            ret = 1
+        finally:
+            if stdout_fd is not None:
+                sys.stdout.flush()
+                os.dup2(stdout_fd, 1)
+                os.close(stdout_fd)
+        if self.args.json:
+            print((json.dumps(data, indent=2)))
+        else:
+            for line in lines:
+                print(line)
+        return ret
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description="SolydXK System Settings - command line interface")
+    parser.add_argument('-j', '--json', action="store_true", help='Print the result as json.')
+    parser.add_argument('-y', '--yes', action="store_true", help='Do not ask for confirmation.')
+    sections = parser.add_subparsers(dest='section', metavar='section')
+    sections.required = True
+
+    mirrors = sections.add_parser('mirrors', help='Repository mirrors.').add_subparsers(dest='action', metavar='action')
+    mirrors.required = True
+    p = mirrors.add_parser('list', help='List the mirrors.')
+    p.add_argument('-s', '--speed', action="store_true", help='Test the download speed of each mirror.')
+    p = mirrors.add_parser('set', help='Use the given mirror urls.')
+    p.add_argument('urls', nargs='+', metavar='URL')
+    p.add_argument('--no-update', action="store_true", help='Do not run apt-get update.')
+    mirrors.add_parser('rank', help='Rank the mirrors on their saved speed tests.')
+    p = mirrors.add_parser('fastest', help='Use the best ranked mirror of each repository.')
+    p.add_argument('--no-update', action="store_true", help='Do not run apt-get update.')
+
+    locales = sections.add_parser('locales', help='Locales and time zone.').add_subparsers(dest='action', metavar='action')
+    locales.required = True
+    locales.add_parser('list', help='List the supported locales.')
+    p = locales.add_parser('set', help='Configure locales and time zone.')
+    p.add_argument('-d', '--default', metavar='LOCALE', help='Default locale (e.g. nl_NL).')
+    p.add_argument('-a', '--add', nargs='+', default=[], metavar='LOCALE', help='Locales to install.')
+    p.add_argument('-r', '--remove', nargs='+', default=[], metavar='LOCALE', help='Locales to remove.')
+    p.add_argument('-t', '--timezone', metavar='ZONE', help='Time zone (e.g. Europe/Amsterdam).')
+
+    splash = sections.add_parser('splash', help='Plymouth boot splash.').add_subparsers(dest='action', metavar='action')
+    splash.required = True
+    splash.add_parser('list', help='List the installed themes.')
+    p = splash.add_parser('set', help='Enable the splash with the given theme.')
+    p.add_argument('theme', metavar='THEME')
+    p.add_argument('-r', '--resolution', metavar='WxH', help='Splash resolution (default: current resolution).')
+    splash.add_parser('disable', help='Disable the splash.')
+
+    holdback = sections.add_parser('holdback', help='Hold back packages.').add_subparsers(dest='action', metavar='action')
+    holdback.required = True
+    p = holdback.add_parser('list', help='List the packages on hold.')
+    p.add_argument('-i', '--installed', action="store_true", help='List the installed packages that are not on hold.')
+    p = holdback.add_parser('add', help='Hold back packages.')
+    p.add_argument('packages', nargs='+', metavar='PKG')
+    p = holdback.add_parser('remove', help='Remove the hold on packages.')
+    p.add_argument('packages', nargs='+', metavar='PKG')
+
+    cleanup = sections.add_parser('cleanup', help='Remove unneeded packages.').add_subparsers(dest='action', metavar='action')
+    cleanup.required = True
+    cleanup.add_parser('list', help='List the packages that can be removed (* = autoremove).')
+    p = cleanup.add_parser('run', help='Remove packages.')
+    p.add_argument('packages', nargs='*', metavar='PKG', help='Packages from cleanup list to remove (default: autoremove packages).')
+    p.add_argument('-a', '--all', action="store_true", help='Also remove orphaned packages and old kernels.')
+    return parser
+
+
+if __name__ == '__main__':
+    # Record started processes when SOLYDXK_SYSTEM_TRACE is set
+    from tracer import tracer
+    tracer.enable_from_env()
+    if tracer.enabled:
+        import utils
+        tracer.watch(utils.process_hooks)
+    sys.exit(SolydXKSystemCli(get_parser().parse_args()).run())
@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Parsed key=value configuration files shared by all modules
+# ====================================================================
+# from configfiles import config_files, SYSTEM_CONF
+# config_files.get(SYSTEM_CONF, 'DLTEST', 'extrafiles')
+# config_files.get_int(SYSTEM_CONF, 'MIRRORS_TIMEOUT', 5)
+# get_system_config('MIRRORSLIST')
+# get_info('EDITION', 'all')        -> value from /usr/share/solydxk/info
+#
+# A file is parsed on first use and parsed again only when its
+# modification time or size changed. Missing files are empty.
+# ====================================================================
+
+import os
+import re
+import threading
+
+SYSTEM_CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'solydxk-system.conf')
+INFO_PATH = '/usr/share/solydxk/info'
+
+# POSIX config file: key=value, no sections, no multiline values, no value contains '#'
+KEY_VALUE_REGEXP = re.compile(r'^\s*(\w+)\s*=\s*["\']?(.*?)["\']?\s*(#.*)?$')
+
+
+def parse_config_file(path, key_value=KEY_VALUE_REGEXP):
+    d = {}
+    with open(path) as f:
+        for line in f:
+            matchObj = key_value.match(line)
+            if matchObj:
+                d[matchObj.group(1)] = matchObj.group(2)
+    return d
+
+
+class ConfigFiles():
+    def __init__(self):
+        # path: [(mtime_ns, size), dictionary]
+        self.files = {}
+        self._lock = threading.Lock()
+
+    # Return the parsed file as dictionary: do not change it, it is shared
+    def get_dict(self, path):
+        try:
+            st = os.stat(path)
+            signature = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            signature = None
+        with self._lock:
+            entry = self.files.get(path)
+            if entry is not None and entry[0] == signature:
+                return entry[1]
+        d = {}
+        if signature is not None:
+            try:
+                d = parse_config_file(path)
+            except Exception as detail:
+                print(("Could not read %s: %s" % (path, detail)))
+        with self._lock:
+            self.files[path] = [signature, d]
+        return d
+
+    def get(self, path, key, default=''):
+        return self.get_dict(path).get(key, default)
+
+    def get_int(self, path, key, default=0):
+        try:
+            return int(self.get_dict(path)[key])
+        except (KeyError, ValueError):
+            return default
+
+    def get_float(self, path, key, default=0.0):
+        try:
+            return float(self.get_dict(path)[key])
+        except (KeyError, ValueError):
+            return default
+
+    # true, yes, on and 1 are True
+    def get_bool(self, path, key, default=False):
+        value = self.get_dict(path).get(key)
+        if value is None:
+            return default
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+    # Values separated by sep (default: white space)
+    def get_list(self, path, key, default=[], sep=None):
+        value = self.get_dict(path).get(key)
+        if value is None:
+            return list(default)
+        return [v.strip() for v in value.split(sep) if v.strip()]
+
+
+# Shared instance
+config_files = ConfigFiles()
+
+
+# Value from solydxk-system.conf
+def get_system_config(key, default=''):
+    return config_files.get(SYSTEM_CONF, key, default)
+
+
+# Value from the SolydXK info file (its path is configured with INFO in solydxk-system.conf)
+def get_info(key, default=''):
+    return config_files.get(get_system_config('INFO', INFO_PATH), key, default)
@@ -0,0 +1,78 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Debian package version ordering (same as dpkg --compare-versions)
+# ====================================================================
+# from debversion import compare_versions, version_key
+# compare_versions('1:1.0', '2.0')        -> 1
+# compare_versions('1.0~rc1', '1.0')      -> -1
+# sorted(versions, key=version_key)
+#
+# Version format: [epoch:]upstream_version[-debian_revision]
+# ====================================================================
+
+import re
+from functools import lru_cache
+
+# Splits a version part in non-digit and digit parts
+PARTS_REGEXP = re.compile(r'(\D*)(\d*)')
+
+
+# Split a version string in [epoch, upstream version, revision]
+def parse_version(version):
+    version = version.strip()
+    epoch = 0
+    epoch_str, sep, rest = version.partition(':')
+    if sep and epoch_str.isdigit():
+        epoch = int(epoch_str)
+        version = rest
+    upstream, sep, revision = version.rpartition('-')
+    if not sep:
+        upstream, revision = version, ''
+    return [epoch, upstream, revision]
+
+
+# Sort order of a character in the non-digit parts:
+# ~ sorts before everything (even the end of the part), then letters, then other characters
+def _char_order(c):
+    if c == '~':
+        return -1
+    if c.isalpha():
+        return ord(c)
+    return ord(c) + 256
+
+
+# Return a tuple that sorts a version part the way dpkg does:
+# alternating non-digit and digit parts, the first pair is always present
+def _part_key(part):
+    key = []
+    for non_digits, digits in PARTS_REGEXP.findall(part):
+        if key and not non_digits and not digits:
+            continue
+        # The end of a non-digit part sorts after ~ and before any other character
+        key.append(tuple(_char_order(c) for c in non_digits) + (0,))
+        key.append(int(digits or 0))
+    # The end of the part sorts like an empty non-digit part
+    key.append((0,))
+    return tuple(key)
+
+
+# Key function for sorting versions; cached because versions are compared repeatedly
+@lru_cache(maxsize=4096)
+def version_key(version):
+    # Like dpkg: an empty version is lower than any other version
+    if not version.strip():
+        return (-1, (), ())
+    epoch, upstream, revision = parse_version(version)
+    return (epoch, _part_key(upstream), _part_key(revision))
+
+
+# Return -1, 0 or 1 when version_1 is lower than, equal to or higher than version_2
+def compare_versions(version_1, version_2):
+    key_1 = version_key(version_1)
+    key_2 = version_key(version_2)
+    if key_1 < key_2:
+        return -1
+    if key_1 > key_2:
+        return 1
+    return 0
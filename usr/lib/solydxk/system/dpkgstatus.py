@@ -0,0 +1,125 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# In-process index of the dpkg status file
+# ====================================================================
+# from dpkgstatus import dpkg_status
+# dpkg_status.is_installed('firefox-esr')
+# dpkg_status.get_version('openssl')
+# dpkg_status.match('nvidia-*')      -> package names
+#
+# The status file is parsed once and parsed again only when its
+# modification time, inode or size changed (e.g. after dpkg ran).
+# ====================================================================
+
+import os
+import re
+import mmap
+import threading
+
+DPKG_STATUS = '/var/lib/dpkg/status'
+
+FIELDS_REGEXP = re.compile(rb'^(Package|Status|Version|Architecture|Multi-Arch):[ \t]*(.*)$', re.M)
+
+
+class DpkgStatus():
+    def __init__(self, path=DPKG_STATUS):
+        self.path = path
+        self.signature = None
+        # name: {'want', 'state', 'version', 'architecture', 'multi_arch'}
+        self.packages = {}
+        self._lock = threading.Lock()
+
+    # Parse the status file if it changed since the last call
+    def _update(self):
+        try:
+            st = os.stat(self.path)
+            signature = (st.st_mtime_ns, st.st_ino, st.st_size)
+        except OSError:
+            signature = None
+        with self._lock:
+            if signature == self.signature:
+                return
+            self.packages = self._parse() if signature is not None else {}
+            self.signature = signature
+
+    def _parse(self):
+        packages = {}
+        try:
+            with open(self.path, 'rb') as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return packages
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    values = {}
+                    # Fields of one package follow its Package field
+                    for matchObj in FIELDS_REGEXP.finditer(mm):
+                        field = matchObj.group(1)
+                        if field == b'Package':
+                            self._add(packages, values)
+                            values = {}
+                        values[field] = matchObj.group(2).decode('utf-8', 'replace').strip()
+                    self._add(packages, values)
+        except Exception as detail:
+            print(("Could not read %s: %s" % (self.path, detail)))
+        return packages
+
+    def _add(self, packages, values):
+        name = values.get(b'Package')
+        if not name:
+            return
+        # Status: want flag state (e.g. "install ok installed")
+        status = values.get(b'Status', '').split()
+        package = {'want': status[0] if status else '',
+                   'state': status[-1] if status else '',
+                   'version': values.get(b'Version', ''),
+                   'architecture': values.get(b'Architecture', ''),
+                   'multi_arch': values.get(b'Multi-Arch', '')}
+        # Multi-arch packages are listed once per architecture: prefer the installed one
+        current = packages.get(name)
+        if current is None or (current['state'] != 'installed' and package['state'] == 'installed'):
+            packages[name] = package
+        packages["%s:%s" % (name, package['architecture'])] = package
+
+    # Return the package dictionary or None when dpkg does not know the package
+    def get(self, name):
+        self._update()
+        return self.packages.get(name)
+
+    def is_installed(self, name):
+        package = self.get(name)
+        return package is not None and package['state'] == 'installed'
+
+    # Installed version or an empty string
+    def get_version(self, name):
+        package = self.get(name)
+        if package is None or package['state'] != 'installed':
+            return ''
+        return package['version']
+
+    # Names of packages with the given selection (install, hold, deinstall, purge)
+    # Like dpkg --get-selections: "Multi-Arch: same" packages are qualified with their architecture
+    def get_selections(self, want):
+        self._update()
+        selections = []
+        for name, package in self.packages.items():
+            if package['want'] != want:
+                continue
+            if package['multi_arch'] == 'same':
+                if ':' in name:
+                    selections.append(name)
+            elif ':' not in name:
+                selections.append(name)
+        return sorted(selections)
+
+    # Package names matching a name or a pattern with wildcards
+    # Like aptitude search: a pattern is a regular expression that can match anywhere in the name
+    def match(self, pattern):
+        self._update()
+        if '*' not in pattern:
+            return [pattern] if pattern in self.packages else []
+        regexp = re.compile(pattern)
+        return [name for name in self.packages if ':' not in name and regexp.search(name)]
+
+
+# Shared instance
+dpkg_status = DpkgStatus()
@@ -1,8 +1,11 @@
 #! /usr/bin/python3
 
+import os
 import re
+import base64
 from os.path import basename, exists, join
-from utils import shell_exec, getoutput, get_uuid, \
+from utils import run_process, get_process_output, \
+                  is_device_mounted, get_uuid, \
                   get_filesystem, get_device_from_uuid, \
                   get_package_version, compare_package_versions
 
@@ -14,32 +17,43 @@ def clear_partition(partition):
     if compare_package_versions(openssl_version, '1.1.1') == 'smaller':
         # deprecated key derivation in openssl 1.1.1+
         enc_key = '-aes-256-ctr'
-    shell_exec("openssl enc {0} -pass pass:\"$(dd if=/dev/urandom bs=128 count=1 2>/dev/null | base64)\" -nosalt < /dev/zero > {1}".format(enc_key, partition.enc_status['device']))
+    # Random password: the output is only used to overwrite the partition
+    # It is passed in the environment to keep it out of the log and the process list
+    password = base64.b64encode(os.urandom(128)).decode('ascii')
+    device = partition.enc_status['device']
+    print(("Overwrite %s with random data" % device))
+    try:
+        with open('/dev/zero', 'rb') as zero, open(device, 'wb') as output:
+            result = run_process(['openssl', 'enc', enc_key, '-pass', 'env:CLEAR_PASSWORD', '-nosalt'],
+                                 env={'CLEAR_PASSWORD': password}, stdin=zero, stdout=output)
+        # openssl writes until the partition is full: the reason it stopped is on stderr
+        if result.returncode != 0:
+            print(("openssl stopped writing to %s (%d): %s" % (device, result.returncode, result.stderr.strip())))
+    except OSError as detail:
+        print(("Cannot overwrite %s: %s" % (device, detail)))
 
 
 def encrypt_partition(device, passphrase):
     if unmount_partition(device):
-        # Cannot use echo to pass the passphrase to cryptsetup because that adds a carriadge return
-        shell_exec("printf \"%s\" | cryptsetup luksFormat --cipher aes-xts-plain64 --key-size 512 --hash sha512 --iter-time 5000 --use-random %s" % (passphrase, device))
+        # The passphrase is written to stdin: no carriage return, not visible in the process list
+        run_process(['cryptsetup', 'luksFormat', '--cipher', 'aes-xts-plain64', '--key-size', '512',
+                     '--hash', 'sha512', '--iter-time', '5000', '--use-random', device], input_text=passphrase)
         mapped_device, filesystem = connect_block_device(device, passphrase)
         return mapped_device
     return ''
 
 
 def unmount_partition(device):
-    shell_exec("umount -f {}".format(device))
+    run_process(['umount', '-f', device])
     if is_connected(device):
-        shell_exec("cryptsetup close {} 2>/dev/null".format(device))
-    ret = getoutput("grep '%s ' /proc/mounts" % device)[0]
-    if not device in ret:
-        return True
-    return False
+        run_process(['cryptsetup', 'close', device])
+    return not is_device_mounted(device)
 
 
 def connect_block_device(device, passphrase):
     if exists(device):
         mapped_name = basename(device)
-        shell_exec("printf \"{}\" | cryptsetup open --type luks {} {}".format(passphrase, device, mapped_name))
+        run_process(['cryptsetup', 'open', '--type', 'luks', device, mapped_name], input_text=passphrase)
         # Collect info to return
         mapped_device = join('/dev/mapper', mapped_name)
         if exists(mapped_device):
@@ -63,7 +77,7 @@ def is_encrypted(device):
 def get_status(device):
     status_dict = {'offset': '', 'mode': '', 'device': '', 'cipher': '', 'keysize': '', 'filesystem': '', 'active': '', 'type': '', 'size': ''}
     mapped_name = basename(device)
-    status_info = getoutput("env LANG=C cryptsetup status {}".format(mapped_name))
+    status_info = get_process_output(['cryptsetup', 'status', mapped_name], env={'LANG': 'C'})
     for line in status_info:
         parts = line.split(':')
         if len(parts) == 2:
@@ -87,12 +101,13 @@ def create_keyfile(keyfile_path, device, passphrase):
     # Note: do this outside the chroot.
     # https://www.martineve.com/2012/11/02/luks-encrypting-multiple-partitions-on-debianubuntu-with-a-single-passphrase/
     if not exists(keyfile_path):
-        shell_exec("dd if=/dev/urandom of=%s bs=1024 count=4" % keyfile_path)
-        shell_exec("chmod 0400 %s" % keyfile_path)
+        with open(keyfile_path, 'wb') as f:
+            f.write(os.urandom(4096))
+        os.chmod(keyfile_path, 0o400)
     # Remove any keys for this device first
-    shell_exec("printf \"%s\" | cryptsetup luksRemoveKey %s %s" % (passphrase, device, keyfile_path))
+    run_process(['cryptsetup', 'luksRemoveKey', device, keyfile_path], input_text=passphrase)
     # Now add the new key for this device
-    shell_exec("printf \"%s\" | cryptsetup luksAddKey %s %s" % (passphrase, device, keyfile_path))
+    run_process(['cryptsetup', 'luksAddKey', device, keyfile_path], input_text=passphrase)
 
 
 def write_crypttab(device, fs_type, crypttab_path=None, keyfile_path=None, remove_device=False):
@@ -10,6 +10,8 @@ from udisks2 import Udisks2
 from utils import shell_exec, get_logged_user, get_uuid, \
                     get_nr_files_in_dir, shell_exec_popen
 from encryption import encrypt_partition, create_keyfile
+from cache import invalidate
+from treestats import BACKUP_EXCLUDES
 
 # i18n: http://docs.python.org/3/library/gettext.html
 import gettext
@@ -48,7 +50,7 @@ class EnDecryptPartitions(threading.Thread):
             if (self.udisks2.is_mounted(partition['mount_point']) and isdir(backup_dir)) or is_swap:
                 rsync_code = 0
                 if not is_swap:
-                    rsync_code = self.backup_partition(partition['mount_point'], backup_dir)
+                    rsync_code = self.backup_partition(partition['mount_point'], backup_dir, partition.get('backup_files'))
                 if rsync_code > 0:
                     msg = _("Could not create a backup on {backup_dir} (rsync code: {rsync_code}).\n"
                             "Please, select another backup medium before you try again.".format(backup_dir=backup_dir, rsync_code=rsync_code))
@@ -106,7 +108,7 @@ class EnDecryptPartitions(threading.Thread):
                     if mount:
                         # Rsync backup to the encrytped/decrypted partition
                         self.log.write("Restore backup %s to %s" % (backup_dir, partition['mount_point']), 'endecrypt', 'info')
-                        rsync_code = self.backup_partition(backup_dir, partition['mount_point'])
+                        rsync_code = self.backup_partition(backup_dir, partition['mount_point'], partition.get('backup_files'))
                         if rsync_code == 0:
                             # Make sure the user owns the pen drive
                             if partition['removable']:
@@ -171,6 +173,8 @@ class EnDecryptPartitions(threading.Thread):
 
         self.log.write(cmd, 'format_partition')
         ret = shell_exec(cmd)
+        # Cached device information (uuid, label, file system) is outdated
+        invalidate('devices')
         if ret == 0:
             self.set_label(device, fs_type, label)
             # Always return True, even if setting the label didn't go right
@@ -197,18 +201,20 @@ class EnDecryptPartitions(threading.Thread):
             if ret > 0:
                 self.log.write("Could not write label \"{}\" to partition {}".format(label, device), 'set_label', 'warning')
 
-    def backup_partition(self, source, destination):
+    # total_files: number of files to copy (counted when None)
+    def backup_partition(self, source, destination, total_files=None):
         self.log.write("Backup %s to %s" % (source, destination), 'backup_partition', 'info')
         prev_sec = -1
         current = 0
-        exclude_dirs = "dev/* proc/* sys/* tmp/* run/* mnt/* media/* lost+found source".split()
+        exclude_dirs = BACKUP_EXCLUDES
         if source[-1] != '/':
             source += '/'
         if destination[-1] != '/':
             destination += '/'
 
         # Start syncing the files
-        total_files = get_nr_files_in_dir(source)
+        if total_files is None:
+            total_files = get_nr_files_in_dir(source, excludes=exclude_dirs)
         if total_files > 0:
             self.log.write("Copying {} files".format(total_files), "backup_partition", 'info')
             rsync_filter = ' '.join('--exclude=' + source + d for d in exclude_dirs)
@@ -0,0 +1,50 @@
+#! /usr/bin/env python3
+
+# Hold back packages with dpkg selections
+# Used by the GUI and the command line interface
+
+from utils import run_process
+from dpkgstatus import dpkg_status
+
+
+# Return a list with the names of the packages on hold
+def get_held_packages():
+    return dpkg_status.get_selections('hold')
+
+
+# Return a list with the names of the installed packages that are not on hold
+def get_installed_packages():
+    return dpkg_status.get_selections('install')
+
+
+# Set the dpkg selection of all packages with one dpkg call
+# Return True when dpkg accepted the selections
+def set_selections(packages, selection, loggerObject=None, loggerName='set_selections'):
+    if not packages:
+        return True
+    result = run_process(['dpkg', '--set-selections'],
+                         input_text=''.join("%s %s\n" % (pck, selection) for pck in packages))
+    if result.returncode != 0:
+        msg = "Could not set %s selection of %s: %s" % (selection, ' '.join(packages), result.stderr.strip())
+        print(msg)
+        if loggerObject is not None:
+            loggerObject.write(msg, loggerName, 'error')
+        return False
+    if result.stderr.strip():
+        # E.g. unknown packages: dpkg warns and ignores them
+        print((result.stderr.strip()))
+        if loggerObject is not None:
+            loggerObject.write(result.stderr, loggerName, 'warning')
+    return True
+
+
+def hold_packages(packages, loggerObject=None):
+    if loggerObject is not None:
+        loggerObject.write("Hold back packages: %s" % ' '.join(packages), 'add_holdback')
+    return set_selections(packages, 'hold', loggerObject, 'add_holdback')
+
+
+def unhold_packages(packages, loggerObject=None):
+    if loggerObject is not None:
+        loggerObject.write("Remove hold back from: %s" % ' '.join(packages), 'remove_holdback')
+    return set_selections(packages, 'install', loggerObject, 'remove_holdback')
@@ -0,0 +1,292 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Measure the latency and throughput of an HTTP(S) download
+# ====================================================================
+# from httpprobe import HttpProbe
+# probe = HttpProbe(connect_timeout=5, max_time=5)
+# result = probe.probe('http://deb.debian.org/debian/extrafiles')
+# result['ttfb'], result['speed']
+# probe.close()
+#
+# Result (times in seconds, speed in bytes per second):
+# url, status, dns, connect, tls, ttfb, seconds, bytes, speed, reused, error,
+# timeout (the error is a time out), stopped (complete, time, converged or slower), windows
+#
+# Connections are kept open and reused for the next probe on the
+# same host. Redirects are followed (like curl --location).
+#
+# Adaptive probes (HttpProbe(adaptive=True)) measure the throughput in
+# windows of WINDOW seconds and stop as soon as the 95% confidence
+# interval of the mean is within CONFIDENCE of it, or when the mirror
+# is clearly slower than slower_than (probe(url, slower_than=...)).
+# range_bytes asks the server for only the first bytes of a large file.
+#
+# probe(url, method='HEAD') only measures the latency of a mirror.
+# ====================================================================
+
+import math
+import socket
+import ssl
+import threading
+import time
+import http.client
+from urllib.parse import urlsplit, urljoin
+
+USER_AGENT = 'solydxk-system'
+CHUNK_SIZE = 65536
+MAX_REDIRECTS = 5
+
+# Adaptive probes: window length in seconds, windows skipped for TCP slow start,
+# windows needed for an estimate and the relative half width of the confidence interval
+WINDOW = 0.1
+WARMUP_WINDOWS = 1
+MIN_WINDOWS = 4
+CONFIDENCE = 0.1
+# Two sided 95% confidence
+Z_95 = 1.96
+
+
+def new_result(url):
+    return {'url': url, 'status': 0, 'dns': 0.0, 'connect': 0.0, 'tls': 0.0,
+            'ttfb': 0.0, 'seconds': 0.0, 'bytes': 0, 'speed': 0.0,
+            'reused': False, 'error': '', 'timeout': False, 'stopped': '', 'windows': 0}
+
+
+# Return the mean and the half width of its 95% confidence interval
+def get_estimate(samples):
+    n = len(samples)
+    mean = sum(samples) / n
+    if n < 2:
+        return (mean, mean)
+    variance = sum((x - mean) ** 2 for x in samples) / (n - 1)
+    return (mean, Z_95 * math.sqrt(variance / n))
+
+
+class HttpProbe():
+    def __init__(self, connect_timeout=5, max_time=5, adaptive=False, range_bytes=0,
+                 window=WINDOW, confidence=CONFIDENCE):
+        self.connect_timeout = connect_timeout
+        self.max_time = max_time
+        self.adaptive = adaptive
+        self.range_bytes = range_bytes
+        self.window = window
+        self.confidence = confidence
+        # (scheme, host, port): idle connection
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def _get_ssl_context(self):
+        if self._ssl_context is None:
+            self._ssl_context = ssl.create_default_context()
+        return self._ssl_context
+
+    # Open a connection and time each step in result
+    def _connect(self, scheme, host, port, result):
+        t = time.perf_counter()
+        addresses = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        result['dns'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        sock = None
+        error = None
+        for family, sock_type, proto, canonname, address in addresses:
+            try:
+                sock = socket.socket(family, sock_type, proto)
+                sock.settimeout(self.connect_timeout)
+                sock.connect(address)
+                break
+            except OSError as detail:
+                # socket() itself fails for a disabled address family (e.g. IPv6)
+                error = detail
+                if sock is not None:
+                    sock.close()
+                sock = None
+        if sock is None:
+            raise error or OSError("Cannot connect to %s" % host)
+        result['connect'] = time.perf_counter() - t
+
+        if scheme == 'https':
+            t = time.perf_counter()
+            sock = self._get_ssl_context().wrap_socket(sock, server_hostname=host)
+            result['tls'] = time.perf_counter() - t
+            conn = http.client.HTTPSConnection(host, port, timeout=self.connect_timeout,
+                                               context=self._get_ssl_context())
+        else:
+            conn = http.client.HTTPConnection(host, port, timeout=self.connect_timeout)
+        # http.client does not connect again when the socket is set
+        conn.sock = sock
+        return conn
+
+    def _take_connection(self, key):
+        with self._lock:
+            return self._connections.pop(key, None)
+
+    def _keep_connection(self, key, conn):
+        with self._lock:
+            old = self._connections.pop(key, None)
+            self._connections[key] = conn
+        if old is not None:
+            old.close()
+
+    # Probe a url and return the result dictionary
+    # Errors are not raised but returned in result['error']
+    # slower_than: speed (bytes/s) of the best mirror so far (adaptive probes only)
+    def probe(self, url, slower_than=0, method='GET'):
+        start = time.perf_counter()
+        result = new_result(url)
+        try:
+            for i in range(MAX_REDIRECTS + 1):
+                location = self._request(url, result, start, slower_than, method)
+                if not location:
+                    break
+                url = urljoin(url, location)
+        except Exception as detail:
+            result['error'] = str(detail) or detail.__class__.__name__
+            result['timeout'] = isinstance(detail, socket.timeout)
+        result['seconds'] = time.perf_counter() - start
+        return result
+
+    # Return why an adaptive probe can stop or an empty string
+    def _check_estimate(self, samples, slower_than):
+        samples = samples[WARMUP_WINDOWS:]
+        if len(samples) < MIN_WINDOWS:
+            return ''
+        mean, half_width = get_estimate(samples)
+        if slower_than > 0 and mean + half_width < slower_than:
+            return 'slower'
+        if half_width <= self.confidence * mean:
+            return 'converged'
+        return ''
+
+    # Request a url: return the redirect location or None
+    def _request(self, url, result, start, slower_than=0, method='GET'):
+        if '://' not in url:
+            url = "http://%s" % url
+        parts = urlsplit(url)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == 'https' else 80)
+        key = (scheme, parts.hostname, port)
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        headers = {'User-Agent': USER_AGENT}
+        if self.range_bytes > 0 and method == 'GET':
+            headers['Range'] = "bytes=0-%d" % (self.range_bytes - 1)
+
+        conn = self._take_connection(key)
+        result['reused'] = conn is not None
+        response = None
+        # getresponse drops conn.sock when the server closes the connection after the response
+        sock = None
+        t = 0
+        if conn is not None:
+            # A kept connection can be closed by the server in the meantime
+            try:
+                t = time.perf_counter()
+                conn.request(method, path, headers=headers)
+                sock = conn.sock
+                response = conn.getresponse()
+            except (http.client.HTTPException, OSError):
+                conn.close()
+                conn = None
+                result['reused'] = False
+        if conn is None:
+            conn = self._connect(scheme, parts.hostname, port, result)
+            t = time.perf_counter()
+            conn.request(method, path, headers=headers)
+            sock = conn.sock
+            response = conn.getresponse()
+        result['ttfb'] = time.perf_counter() - t
+        result['status'] = response.status
+
+        if response.status in (301, 302, 303, 307, 308) and response.getheader('Location'):
+            response.read()
+            if response.will_close:
+                conn.close()
+            else:
+                self._keep_connection(key, conn)
+            return response.getheader('Location')
+
+        # Measure the sustained throughput: from the first byte until the end or the time limit
+        deadline = start + self.max_time
+        t = time.perf_counter()
+        nbytes = 0
+        complete = False
+        # Adaptive probes: throughput of each window
+        samples = []
+        window_start = t
+        window_bytes = 0
+        result['stopped'] = 'time'
+        while True:
+            # A stalled read may not block past the deadline
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            sock.settimeout(min(self.connect_timeout, remaining))
+            try:
+                chunk = response.read1(CHUNK_SIZE) if hasattr(response, 'read1') else response.read(CHUNK_SIZE)
+            except socket.timeout:
+                if time.perf_counter() < deadline:
+                    raise
+                break
+            if not chunk:
+                complete = True
+                break
+            nbytes += len(chunk)
+            if response.length == 0:
+                complete = True
+                break
+            if self.adaptive:
+                window_bytes += len(chunk)
+                now = time.perf_counter()
+                if now - window_start >= self.window:
+                    samples.append(window_bytes / (now - window_start))
+                    window_start = now
+                    window_bytes = 0
+                    stopped = self._check_estimate(samples, slower_than)
+                    if stopped:
+                        result['stopped'] = stopped
+                        break
+        if complete:
+            result['stopped'] = 'complete'
+        seconds = time.perf_counter() - t
+        result['bytes'] = nbytes
+        result['windows'] = len(samples)
+        if len(samples) > WARMUP_WINDOWS:
+            result['speed'] = get_estimate(samples[WARMUP_WINDOWS:])[0]
+        else:
+            result['speed'] = nbytes / seconds if seconds > 0 else 0.0
+
+        if complete and not response.will_close:
+            # read1 does not release the response when the length is exhausted
+            response.close()
+            sock.settimeout(self.connect_timeout)
+            self._keep_connection(key, conn)
+        else:
+            # Unread data is left on the connection: it cannot be reused
+            conn.close()
+        return None
+
+    # Close all kept connections
+    def close(self):
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+
+
+if __name__ == '__main__':
+    import sys
+    probe = HttpProbe(adaptive=True)
+    for url in sys.argv[1:]:
+        result = probe.probe(url)
+        print(("%s: status %d, dns %.3f s, connect %.3f s, tls %.3f s, ttfb %.3f s, %d bytes in %.3f s (%s), %d kb/s%s%s" %
+               (url, result['status'], result['dns'], result['connect'], result['tls'], result['ttfb'],
+                result['bytes'], result['seconds'], result['stopped'], result['speed'] / 1024,
+                ' (reused)' if result['reused'] else '',
+                ', error: %s' % result['error'] if result['error'] else '')))
+    probe.close()
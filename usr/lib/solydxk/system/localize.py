@@ -1,30 +1,90 @@
 #! /usr/bin/env python3
 
+import os
 import re
 import threading
+from shutil import copy2
 from os.path import join, abspath, dirname, exists, basename
-from utils import getoutput, get_config_dict, shell_exec, has_string_in_file, \
+from utils import get_config_dict, shell_exec, run_process, get_process_output, \
                   does_package_exist, is_package_installed, \
                   get_debian_version, get_firefox_version
+from snapshot import snapshot
+from configfiles import get_system_config, get_info, INFO_PATH
 
 DEFAULTLOCALE = 'en_US'
+SUPPORTED = '/usr/share/i18n/SUPPORTED'
+ZONETAB = '/usr/share/zoneinfo/zone.tab'
+LOCALEGEN = '/etc/locale.gen'
+DEFAULTLOCALEFILE = '/etc/default/locale'
+
+
+def read_lines(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read().splitlines()
+    except:
+        return []
+
+
+# Return the time zones from zone.tab, sorted
+def get_timezones():
+    timezones = []
+    for line in read_lines(ZONETAB):
+        if line and not line.startswith('#'):
+            fields = line.split()
+            if len(fields) > 2:
+                timezones.append(fields[2])
+    return sorted(timezones)
+
+
+# Return the UTF-8 locales (without encoding) from the SUPPORTED file
+def get_supported_locales():
+    locales = []
+    for line in read_lines(SUPPORTED):
+        if 'UTF-8' in line:
+            loc = re.split('[@. ]', line)[0]
+            if not locales or locales[-1] != loc:
+                locales.append(loc)
+    return locales
+
+
+# Return the default locale (without encoding) from /etc/default/locale
+def get_default_locale():
+    for line in read_lines(DEFAULTLOCALEFILE):
+        if 'UTF-8' in line:
+            fields = re.split('[=.]', line)
+            if len(fields) > 1:
+                return fields[1].strip('"')
+    return ''
+
+
+# Return the generated locales (without encoding)
+def get_available_locales():
+    locales = []
+    for line in get_process_output(['locale', '-a']):
+        if '_' in line:
+            locales.append(re.split('[@ .]', line)[0])
+    return locales if locales else ['']
 
 
 class LocaleInfo():
     def __init__(self):
         self.scriptDir = abspath(dirname(__file__))
-        self.timezones = getoutput("awk '/^[^#]/{print $3}' /usr/share/zoneinfo/zone.tab | sort -k3")
+        self.languages = None
+        self.timezones = snapshot.cached('timezones', [ZONETAB],
+                                         get_timezones)
         self.refresh()
 
         # Genereate locale files with the default locale if they do not exist
-        if not exists('/etc/locale.gen'):
-            shell_exec("echo \"%s.UTF-8 UTF-8\" >> /etc/locale.gen" % DEFAULTLOCALE)
-            shell_exec("locale-gen")
+        if not exists(LOCALEGEN):
+            with open(LOCALEGEN, 'a') as f:
+                f.write("%s.UTF-8 UTF-8\n" % DEFAULTLOCALE)
+            run_process(['locale-gen'])
         if self.default_locale == '':
             self.default_locale = DEFAULTLOCALE
-            shell_exec("echo \"\" > /etc/default/locale")
-            shell_exec("update-locale LANG=\"%s.UTF-8\"" % self.default_locale)
-            shell_exec("update-locale LANG=%s.UTF-8" % self.default_locale)
+            with open(DEFAULTLOCALEFILE, 'w') as f:
+                f.write("\n")
+            run_process(['update-locale', "LANG=%s.UTF-8" % self.default_locale])
 
     def list_timezones(self, continent=None):
         timezones = []
@@ -43,19 +103,37 @@ class LocaleInfo():
 
     def get_readable_language(self, locale):
         lan = ''
-        lan_list = join(self.scriptDir, 'languages.list')
-        if exists(lan_list):
-            lan = getoutput("grep '^%s' \"%s\" | awk -F'=' '{print $2}'" % (locale, lan_list))[0]
-            if lan == '':
-                lan = getoutput("grep '^%s' \"%s\" | awk -F'[= ]' '{print $2}' | uniq" % (locale.split('_')[0], lan_list))[0]
+        if self.languages is None:
+            self.languages = read_lines(join(self.scriptDir, 'languages.list'))
+        # Use the language of the locale, else of the first locale with the same language code
+        for line in self.languages:
+            if line.startswith(locale):
+                fields = line.split('=')
+                return fields[1] if len(fields) > 1 else ''
+        for line in self.languages:
+            if line.startswith(locale.split('_')[0]):
+                fields = re.split('[= ]', line)
+                return fields[1] if len(fields) > 1 else ''
         return lan
 
+    # Return dictionary with the readable language of each supported locale
+    def get_readable_languages(self):
+        def get_languages():
+            languages = {}
+            for loc in self.locales:
+                languages[loc] = self.get_readable_language(loc)
+            return languages
+        return snapshot.cached('languages', [SUPPORTED, join(self.scriptDir, 'languages.list')], get_languages)
+
     def refresh(self):
-        self.locales = getoutput("awk -F'[@. ]' '/UTF-8/{ print $1 }' /usr/share/i18n/SUPPORTED | uniq")
-        self.default_locale = getoutput("awk -F'[=.]' '/UTF-8/{ print $2 }' /etc/default/locale")[0]
-        self.available_locales = getoutput("locale -a | grep '_' | awk -F'[@ .]' '{print $1}'")
+        self.locales = snapshot.cached('locales', [SUPPORTED],
+                                       get_supported_locales)
+        self.default_locale = snapshot.cached('default_locale', [DEFAULTLOCALEFILE], get_default_locale)
+        self.available_locales = snapshot.cached('available_locales', ['/usr/lib/locale/locale-archive', '/usr/lib/locale'],
+                                                 get_available_locales)
         self.timezone_continents = self.list_timezones()
-        tz = getoutput("cat /etc/timezone 2>/dev/null")[0]
+        tz = snapshot.cached('timezone', ['/etc/timezone'],
+                             lambda: (read_lines('/etc/timezone') + [''])[0].strip())
         self.current_timezone_continent = dirname(tz)
         self.current_timezone = basename(tz)
 
@@ -75,23 +153,20 @@ class Localize(threading.Thread):
             self.default_locale = DEFAULTLOCALE
         self.timezone = timezone.strip()
         self.queue = queue
-        self.user = getoutput("logname")[0]
+        self.user = get_process_output(['logname'])[0]
         self.user_dir = "/home/%s" % self.user
-        self.current_default = getoutput("awk -F'[=.]' '/UTF-8/{ print $2 }' /etc/default/locale")[0]
+        self.current_default = get_default_locale()
         self.scriptDir = abspath(dirname(__file__))
         self.edition = 'all'
 
         # Get configuration settings
         self.debian_version = get_debian_version()
-        config = get_config_dict(join(self.scriptDir, "solydxk-system.conf"))
-        self.debian_frontend = "DEBIAN_FRONTEND=%s" % config.get('DEBIAN_FRONTEND', 'noninteractive')
-        self.apt_options = config.get('APT_OPTIONS_8', '')
+        self.debian_frontend = "DEBIAN_FRONTEND=%s" % get_system_config('DEBIAN_FRONTEND', 'noninteractive')
+        self.apt_options = get_system_config('APT_OPTIONS_8', '')
         if self.debian_version == 0 or self.debian_version >= 9:
-            self.apt_options = config.get('APT_OPTIONS_9', '')
-        self.info = config.get('INFO', '/usr/share/solydxk/info')
-        if exists(self.info):
-            config = get_config_dict(self.info)
-            self.edition = config.get('EDITION', 'all').replace(' ', '').lower()
+            self.apt_options = get_system_config('APT_OPTIONS_9', '')
+        self.info = get_system_config('INFO', INFO_PATH)
+        self.edition = get_info('EDITION', 'all').replace(' ', '').lower()
 
         # Steps
         self.max_steps = 10
@@ -107,61 +182,78 @@ class Localize(threading.Thread):
     def set_locale(self):
         print((" --> Set locale %s" % self.default_locale))
         self.queue_progress()
-#        minus_list = []
+        # Edit locale.gen in memory and write it once
+        lines = read_lines(LOCALEGEN)
         # First, comment all languages
-        shell_exec("sed -i -e '/^[a-z]/ s/^#*/# /' /etc/locale.gen")
+        lines = [re.sub('^#*', '# ', line) if re.match('^[a-z]', line) else line for line in lines]
         # Loop through all locales
         for loc in self.locales:
             if loc[0]:
-#                if not loc[3]:
-#                    minus_list.append(loc[1].replace('_', '-'))
-                if has_string_in_file(loc[1], '/etc/locale.gen'):
+                if any(loc[1] in line for line in lines):
                     # Uncomment the first occurence of the locale
-                    shell_exec("sed -i '0,/^# *%(lan)s.UTF-8/{s/^# *%(lan)s.UTF-8/%(lan)s.UTF-8/}' /etc/locale.gen" % {'lan': loc[1].replace('.', '\.')})
+                    regexp = '^# *%s.UTF-8' % loc[1].replace('.', '\\.')
+                    for i, line in enumerate(lines):
+                        if re.match(regexp, line):
+                            lines[i] = re.sub('^# *', '', line)
+                            break
                 else:
                     # Add the locale
-                    shell_exec("echo \"%s.UTF-8 UTF-8\" >> /etc/locale.gen" % loc[1])
+                    lines.append("%s.UTF-8 UTF-8" % loc[1])
 
             # Save new default locale
             if loc[3]:
                 self.default_locale = loc[1]
 
         # Check if at least one locale is set
-        locales = getoutput("awk -F'[@. ]' '{print $1}' < /etc/locale.gen | grep -v -E '^#|^$'")
-        if locales[0] == '':
-            shell_exec("echo \"%s.UTF-8 UTF-8\" >> /etc/locale.gen" % self.default_locale)
-            
-        cmd = "echo '{0}' > /etc/timezone && " \
-              "rm /etc/localtime; ln -sf /usr/share/zoneinfo/{0} /etc/localtime && " \
-              "echo 'LANG={1}.UTF-8' > /etc/default/locale && " \
-              "dpkg-reconfigure --frontend=noninteractive locales && " \
-              "update-locale LANG={1}.UTF-8".format(self.timezone, self.default_locale)
-        shell_exec(cmd)
-        
+        if not any(line.strip() and not line.startswith('#') for line in lines):
+            lines.append("%s.UTF-8 UTF-8" % self.default_locale)
+        with open(LOCALEGEN, 'w') as f:
+            f.write("%s\n" % '\n'.join(lines))
+
+        # Time zone and default locale
+        with open('/etc/timezone', 'w') as f:
+            f.write("%s\n" % self.timezone)
+        if os.path.lexists('/etc/localtime'):
+            os.remove('/etc/localtime')
+        os.symlink(join('/usr/share/zoneinfo', self.timezone), '/etc/localtime')
+        with open(DEFAULTLOCALEFILE, 'w') as f:
+            f.write("LANG=%s.UTF-8\n" % self.default_locale)
+        if run_process(['dpkg-reconfigure', '--frontend=noninteractive', 'locales']):
+            run_process(['update-locale', "LANG=%s.UTF-8" % self.default_locale])
+
         # Copy mo files for Grub if needed
-        cmd = "mkdir -p /boot/grub/locale && " \
-              "for F in $(find /usr/share/locale -name 'grub.mo'); do " \
-              "MO=/boot/grub/locale/$(echo $F | cut -d'/' -f 5).mo; " \
-              "cp -afuv $F $MO; done"
-        shell_exec(cmd)
-        
+        grub_locale = '/boot/grub/locale'
+        os.makedirs(grub_locale, exist_ok=True)
+        for root, dirs, files in os.walk('/usr/share/locale'):
+            if 'grub.mo' in files:
+                src = join(root, 'grub.mo')
+                # /usr/share/locale/<language>/LC_MESSAGES/grub.mo
+                dst = join(grub_locale, "%s.mo" % src.split('/')[4])
+                if not exists(dst) or os.path.getmtime(src) > os.path.getmtime(dst):
+                    copy2(src, dst)
+
         # Cleanup old default grub settings
         default_grub = '/etc/default/grub'
-        shell_exec("sed -i '/^# Set locale$/d' {0} && " \
-                   "sed -i '/^LANG=/d' {0} && " \
-                   "sed -i '/^LANGUAGE=/d' {0} && " \
-                   "sed -i '/^GRUB_LANG=/d' {0}".format(default_grub))
-        
+        if exists(default_grub):
+            lines = read_lines(default_grub)
+            lines = [line for line in lines if not re.match('^# Set locale$|^LANG=|^LANGUAGE=|^GRUB_LANG=', line)]
+            with open(default_grub, 'w') as f:
+                f.write("%s\n" % '\n'.join(lines))
+
         # Update Grub and make sure it uses the new locale
-        shell_exec('LANG={0}.UTF-8 update-grub'.format(self.default_locale))
-            
+        run_process(['update-grub'], env={'LANG': "%s.UTF-8" % self.default_locale})
+
         # Change user settings
         if exists(self.user_dir):
-            shell_exec("sudo -H -u %s bash -c \"sed -i 's/Language=.*/Language=%s\.utf8/' %s/.dmrc\"" % (self.user, self.default_locale, self.user_dir))
-            shell_exec("sudo -H -u %s bash -c \"printf %s > %s/.config/user-dirs.locale\"" % (self.user, self.default_locale, self.user_dir))
-            prefs = getoutput("find %s -type f -name \"prefs.js\" -not -path \"*/extensions/*\"" % self.user_dir)
-            for pref in prefs:
-                self.localizePref(pref)
+            sudo = ['sudo', '-H', '-u', self.user]
+            run_process(sudo + ['sed', '-i', "s/Language=.*/Language=%s.utf8/" % self.default_locale, join(self.user_dir, '.dmrc')])
+            run_process(sudo + ['tee', join(self.user_dir, '.config/user-dirs.locale')], input_text=self.default_locale)
+            for root, dirs, files in os.walk(self.user_dir):
+                # Skip Mozilla extensions
+                if '/extensions/' in "%s/" % root[len(self.user_dir):]:
+                    continue
+                if 'prefs.js' in files:
+                    self.localizePref(join(root, 'prefs.js'))
 
         self.current_default = self.default_locale
         
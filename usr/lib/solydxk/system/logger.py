@@ -6,14 +6,14 @@ import logging
 import re
 import sys
 from shutil import move
-from dialogs import ErrorDialog
-from treeview import TreeViewHandler
 
 
 class Logger():
 
-    def __init__(self, logPath='', defaultLogLevel='debug', addLogTime=True, rtObject=None, parent=None, maxSizeKB=None):
+    # Use useDialogs=False when running without Gtk (command line)
+    def __init__(self, logPath='', defaultLogLevel='debug', addLogTime=True, rtObject=None, parent=None, maxSizeKB=None, useDialogs=True):
         self.logPath = logPath
+        self.useDialogs = useDialogs
         if self.logPath != '':
             if self.logPath[:1] != '/':
                 homeDir = pwd.getpwuid(os.getuid()).pw_dir
@@ -71,17 +71,20 @@ class Logger():
             elif logLevel == 'error':
                 myLogger.error(message)
                 self.rtobjectWrite(message)
-                if showErrorDialog:
+                if showErrorDialog and self.useDialogs:
+                    from dialogs import ErrorDialog
                     ErrorDialog('Error', message,  None,  None,  safe)
             elif logLevel == 'critical':
                 myLogger.critical(message)
                 self.rtobjectWrite(message)
-                if showErrorDialog:
+                if showErrorDialog and self.useDialogs:
+                    from dialogs import ErrorDialog
                     ErrorDialog('Critical', message,  None,  None,  safe)
             elif logLevel == 'exception':
                 myLogger.exception(message)
                 self.rtobjectWrite(message)
-                if showErrorDialog:
+                if showErrorDialog and self.useDialogs:
+                    from dialogs import ErrorDialog
                     ErrorDialog('Exception', message,  None,  None,  safe)
             # Flush now
             sys.stdout.flush()
@@ -92,6 +95,7 @@ class Logger():
             if 'label' in self.typeString.lower():
                 self.rtobject.set_text(message)
             elif 'treeview' in self.typeString.lower():
+                from treeview import TreeViewHandler
                 tvHandler = TreeViewHandler(self.rtobject)
                 tvHandler.fillTreeview([message], ['str'], [-1], 0, 400, False, True, True, fontSize=10000)
             elif 'statusbar' in self.typeString.lower():
@@ -1,24 +1,43 @@
 #! /usr/bin/env python3 -OO
 
-# Make sure the right Gtk version is loaded
-import gi
-gi.require_version('Gtk', '3.0')
-
 import sys
-import gettext
-from os.path import abspath, dirname
-from utils import compare_package_versions
-from dialogs import ErrorDialog
-from solydxk_system import SolydXKSystemSettings
-from gi.repository import Gtk, GObject
 import argparse
+from profiler import profiler
+from tracer import tracer, TRACE_PATH
 
 
 # Handle arguments
 parser = argparse.ArgumentParser(description="SolydXK System")
 parser.add_argument('-n', '--nosplash', action="store_true", help='No startup splash.')
+parser.add_argument('-p', '--profile-startup', nargs='?', const='/var/log/solydxk-system-startup', metavar='PATH',
+                    help='Time the startup phases and write a report to PATH.txt and PATH.json on exit.')
+parser.add_argument('-t', '--trace', nargs='?', const=TRACE_PATH, metavar='PATH',
+                    help='Record every started process to PATH (json lines). Summarize with: python3 tracer.py PATH')
 args, extra = parser.parse_known_args()
 nosplash = args.nosplash
+if args.profile_startup:
+    profiler.enable(args.profile_startup)
+if args.trace:
+    tracer.enable(args.trace)
+else:
+    tracer.enable_from_env()
+
+with profiler.phase('imports'):
+    # Make sure the right Gtk version is loaded
+    import gi
+    gi.require_version('Gtk', '3.0')
+
+    import gettext
+    from os.path import abspath, dirname
+    import utils
+    profiler.watch(utils.process_hooks)
+    tracer.watch(utils.process_hooks)
+    from cache import cache
+    profiler.add_report('cache', cache.get_stats)
+    from utils import compare_package_versions
+    from dialogs import ErrorDialog
+    from solydxk_system import SolydXKSystemSettings
+    from gi.repository import Gtk, GObject
 
 # i18n: http://docs.python.org/2/library/gettext.html
 gettext.install("solydxk-system", "/usr/share/locale")
@@ -74,3 +93,4 @@ if __name__ == '__main__':
         Gtk.main()
     except KeyboardInterrupt:
         pass
+    profiler.write_report()
@@ -1,25 +1,39 @@
 #! /usr/bin/env python3
 
-# Depends: curl
-
 import os
+import time
 import threading
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 import re
-from utils import getoutput, get_config_dict, get_debian_version, \
-                  get_value_from_url
+from utils import get_debian_version
+from configfiles import config_files, get_system_config, SYSTEM_CONF
+from httpprobe import HttpProbe
+from mirrorhistory import mirror_history
 from os.path import join, abspath, dirname, exists, basename
+from snapshot import snapshot
+
+# Seconds before the mirrors list is checked again on the server
+MIRRORS_MAX_AGE = 24 * 60 * 60
+# Seconds to wait for both mirrors lists (MIRRORS_REFRESH_BUDGET in solydxk-system.conf)
+MIRRORS_REFRESH_BUDGET = 5
+# Concurrent latency tests before the speed tests (see MirrorGetSpeed.triage)
+TRIAGE_WORKERS = 32
+# Speed of mirrors that were skipped by the triage
+NOT_TESTED = "not tested"
+
+SOURCES_LIST = '/etc/apt/sources.list'
 
 
-def get_local_repos():
+def get_local_repos(sources=SOURCES_LIST):
     # Get configured repos
     repos = []
     skip_repos = ['backports', 'security', 'updates']
-    with open("/etc/apt/sources.list", 'r') as f:
+    with open(sources, 'r') as f:
         lines = f.readlines()
     for line in lines:
         line = line.strip()
-        matchObj = re.search("^deb\s+(https?:[\/a-zA-Z0-9\.\-]*).*", line)
+        matchObj = re.search("^deb\s+(https?:[\/a-zA-Z0-9\.\-:]*).*", line)
         if matchObj:
             line = matchObj.group(0)
             repo = matchObj.group(1)
@@ -29,29 +43,151 @@ def get_local_repos():
     return repos
 
 
-def get_mirror_data(excludeMirrors=[], getDeadMirrors=False):
-    mirrorData = []
-    scriptDir = abspath(dirname(__file__))
-    config = get_config_dict(join(scriptDir, "solydxk-system.conf"))
-    mirrors_url = config.get('MIRRORSLIST', 'https://repository.solydxk.com/mirrors.list')
-    print(mirrors_url)
-    mirrorsList = join(scriptDir, basename(mirrors_url))
+def is_url_in_sources(url, excludeMirrors=[], sources=SOURCES_LIST):
+    pre_str = ''
+    if not '://' in url:
+        pre_str = '://'
+    url = "%s%s" % (pre_str, url)
+    blnRet = False
+
+    for repo in get_local_repos(sources):
+        if url in repo:
+            blnRet = True
+            for excl in excludeMirrors:
+                if excl in repo:
+                    blnRet = False
+                    break
+            break
+    return blnRet
+
+
+# Return the [current url, new url] list that Mirror.save needs to switch to the given mirror urls
+# mirrorData: list returned by get_mirror_data
+def get_replace_repos(urls, mirrorData, excludeMirrors=[], sources=SOURCES_LIST):
+    replaceRepos = []
+    for url in urls:
+        repo = ''
+        for data in mirrorData:
+            if data[2] == url:
+                repo = data[1]
+                break
+        current = ''
+        for data in mirrorData:
+            if data[1] == repo and data[2] != url and is_url_in_sources(data[2], excludeMirrors, sources):
+                current = data[2]
+                break
+        if current or not is_url_in_sources(url, excludeMirrors, sources):
+            replaceRepos.append([current, url])
+    return replaceRepos
+
+
+def get_mirrors_list_url(getDeadMirrors=False):
+    url = get_system_config('MIRRORSLIST', 'https://repository.solydxk.com/mirrors.list')
     if getDeadMirrors:
-        mirrorsList = "%s.dead" % mirrorsList
+        url = "%s.dead" % url
+    return url
+
 
+# Local copy of the mirrors list
+def get_mirrors_list_path(getDeadMirrors=False):
+    return join(abspath(dirname(__file__)), basename(get_mirrors_list_url(getDeadMirrors)))
+
+
+# Download the mirrors list if it changed on the server (If-None-Match/If-Modified-Since)
+# The server is asked at most once every MIRRORS_MAX_AGE seconds unless force is set
+# Return True when the local copy changed
+# url and mirrorsList default to the configured list (see get_mirrors_list_url)
+def refresh_mirrors_list(getDeadMirrors=False, timeout_secs=5, force=False, url=None, mirrorsList=None):
+    # urllib is only needed for the mirror functions: import on first use
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError
+    if url is None:
+        url = get_mirrors_list_url(getDeadMirrors)
+    if mirrorsList is None:
+        mirrorsList = get_mirrors_list_path(getDeadMirrors)
+
+    # The validators of the server are saved with the signature of the local copy
+    key = 'mirrors.dead.http' if getDeadMirrors else 'mirrors.http'
+    validators = snapshot.get(key, [mirrorsList]) or {}
+    if not force and exists(mirrorsList) and time.time() - validators.get('checked', 0) < MIRRORS_MAX_AGE:
+        return False
+
+    req = Request(url, headers={'User-Agent': 'solydxk-system'})
+    if exists(mirrorsList):
+        if validators.get('etag'):
+            req.add_header('If-None-Match', validators['etag'])
+        if validators.get('last_modified'):
+            req.add_header('If-Modified-Since', validators['last_modified'])
+    changed = False
     try:
-        # Download the mirrors list from the server
-        url = mirrors_url
-        if getDeadMirrors:
-            url = "%s.dead" % url
-        txt = get_value_from_url(url)
-        if txt is not None:
-            # Save to a file
+        with urlopen(req, timeout=timeout_secs) as response:
+            txt = response.read().decode('utf-8')
+            validators = {'etag': response.headers.get('ETag', ''),
+                          'last_modified': response.headers.get('Last-Modified', '')}
+        # Save to a file (only when changed to keep the snapshot valid)
+        old_txt = None
+        if exists(mirrorsList):
+            with open(mirrorsList, 'r') as f:
+                old_txt = f.read()
+        if txt != old_txt:
             with open(mirrorsList, 'w') as f:
                 f.write(txt)
-    except:
-        pass
+            changed = True
+    except HTTPError as error:
+        if error.code != 304:
+            print(("ERROR: could not download {}: {}".format(url, error)))
+            return False
+        # 304: not modified
+    except Exception as detail:
+        print(("ERROR: could not download {}: {}".format(url, detail)))
+        return False
+    validators['checked'] = time.time()
+    snapshot.set(key, [mirrorsList], validators)
+    return changed
+
+
+# Refresh the active and the dead mirrors lists at the same time
+# Wait at most budget seconds in total (MIRRORS_REFRESH_BUDGET): a download
+# that takes longer finishes in the background and is used the next time
+# Return True when a list changed
+def refresh_mirrors_lists(budget=None, force=False):
+    if budget is None:
+        budget = config_files.get_float(SYSTEM_CONF, 'MIRRORS_REFRESH_BUDGET', MIRRORS_REFRESH_BUDGET)
+    results = {}
+
+    def refresh(getDeadMirrors):
+        results[getDeadMirrors] = refresh_mirrors_list(getDeadMirrors, budget, force)
+
+    deadline = time.time() + budget
+    threads = []
+    for getDeadMirrors in [False, True]:
+        t = threading.Thread(target=refresh, args=(getDeadMirrors,))
+        t.daemon = True
+        t.start()
+        threads.append(t)
+    for t in threads:
+        t.join(max(0, deadline - time.time()))
+    return any(results.values())
+
 
+# Return the mirrors in the local mirrors list: [country, repository, url]
+# refresh: first check the server for a newer list (see refresh_mirrors_list)
+# url, mirrorsList and sources default to the system files
+def get_mirror_data(excludeMirrors=[], getDeadMirrors=False, refresh=True, url=None, mirrorsList=None, sources=SOURCES_LIST):
+    if mirrorsList is None:
+        mirrorsList = get_mirrors_list_path(getDeadMirrors)
+    if refresh:
+        refresh_mirrors_list(getDeadMirrors, url=url, mirrorsList=mirrorsList)
+
+    # Use the snapshot if the local files did not change
+    key = 'mirrors.dead' if getDeadMirrors else 'mirrors'
+    inputs = [mirrorsList, sources]
+    extra = ','.join(excludeMirrors)
+    return snapshot.cached(key, inputs, lambda: read_mirrors_list(mirrorsList, excludeMirrors, getDeadMirrors, sources), extra)
+
+
+def read_mirrors_list(mirrorsList, excludeMirrors=[], getDeadMirrors=False, sources=SOURCES_LIST):
+    mirrorData = []
     if exists(mirrorsList):
         with open(mirrorsList, 'r') as f:
             lines = f.readlines()
@@ -60,7 +196,7 @@ def get_mirror_data(excludeMirrors=[], getDeadMirrors=False):
             if len(data) > 2:
                 if getDeadMirrors:
                     blnAdd = False
-                    for repo in get_local_repos():
+                    for repo in get_local_repos(sources):
                         if data[2] in repo:
                             blnAdd = True
                             break
@@ -75,61 +211,187 @@ def get_mirror_data(excludeMirrors=[], getDeadMirrors=False):
     return mirrorData
 
 
+# Return the host name of a mirror url
+def get_mirror_host(mirror):
+    if '://' in mirror:
+        mirror = mirror.split('://', 1)[1]
+    return mirror.split('/')[0].lower()
+
+
+# Test the download speed of mirrors with a pool of worker threads
+# Queue returns list: [mirror, speed, number of tested mirrors, total mirrors]
+# workers: number of concurrent tests (MIRRORS_WORKERS in solydxk-system.conf)
+# one_per_host: never test two mirrors on the same host at the same time (MIRRORS_ONE_PER_HOST)
+# history: MirrorHistory that saves the results (default: mirror_history, None: do not save)
+# adaptive: stop a test when the speed is known or clearly slower than the best so far (MIRRORS_ADAPTIVE)
+# MIRRORS_RANGE_BYTES: when set, only ask for the first bytes of DLTEST (use with a large file)
+# top_k: only test the speed of the top_k mirrors with the lowest latency (MIRRORS_TOP_K, 0: test all)
+#        the other mirrors are returned with NOT_TESTED as speed
 class MirrorGetSpeed(threading.Thread):
-    def __init__(self, mirrors, queue):
+    def __init__(self, mirrors, queue, workers=None, one_per_host=None, history=mirror_history, adaptive=None,
+                 top_k=None):
         threading.Thread.__init__(self)
         
         self.mirrors = mirrors
         self.queue = queue
+        self.history = history
         self.scriptDir = abspath(dirname(__file__))
+        if workers is None:
+            workers = config_files.get_int(SYSTEM_CONF, 'MIRRORS_WORKERS', 4)
+        if one_per_host is None:
+            one_per_host = config_files.get_bool(SYSTEM_CONF, 'MIRRORS_ONE_PER_HOST', True)
+        self.workers = max(1, workers)
+        self.one_per_host = one_per_host
+        if adaptive is None:
+            adaptive = config_files.get_bool(SYSTEM_CONF, 'MIRRORS_ADAPTIVE', True)
+        if top_k is None:
+            top_k = config_files.get_int(SYSTEM_CONF, 'MIRRORS_TOP_K', 8)
+        self.top_k = max(0, top_k)
+        self.triage_timeout = config_files.get_float(SYSTEM_CONF, 'MIRRORS_TRIAGE_TIMEOUT', 2)
+        self._pending = []
+        self._busy_hosts = set()
+        self._tested = 0
+        # Speed (bytes/s) of the fastest mirror so far
+        self._best_speed = 0
+        self._condition = threading.Condition()
+        # Keep-alive connections are shared by the workers
+        self.probe = HttpProbe(connect_timeout=5, max_time=5, adaptive=adaptive,
+                               range_bytes=config_files.get_int(SYSTEM_CONF, 'MIRRORS_RANGE_BYTES', 0))
 
     def run(self):
-        httpCode = -1
-        dlSpeed = 0
-        mirror_index = 0
+        self._pending = []
         for mirrorData in self.mirrors:
-            mirror_index += 1
-            try:
-                mirror = mirrorData[3].strip()
-                if mirror == "URL":
-                    continue
-                if mirror.endswith('/'):
-                    mirror = mirror[:-1]
-
-                # Only check Debian repository: SolydXK is on the same server
-                httpCode = -1
-                dlSpeed = 0
-                config = get_config_dict(join(self.scriptDir, "solydxk-system.conf"))
-                dl_file = config.get('DLTEST', 'extrafiles')
-                url = os.path.join(mirror, dl_file)
-                http = 'http://'
-                if '://' in url:
-                    http = ''
-                cmd = "curl --connect-timeout 5 -m 5 -w '%%{http_code}\n%%{speed_download}\n' -o /dev/null -s --location %s%s" % (http, url)
-
-                lst = getoutput(cmd)
-                if len(lst) == 2:
-                    httpCode = int(lst[0])
-                    dlSpeed = lst[1]
-                    # Download speed returns as string with decimal separator
-                    # On non-US systems converting to float throws an error
-                    # Split on the separator, and use the left part only
-                    if ',' in dlSpeed:
-                        dlSpeed = dlSpeed.split(',')[0]
-                    elif '.' in dlSpeed:
-                        dlSpeed = dlSpeed.split('.')[0]
-                    dlSpeed = int(dlSpeed) / 1024
-
-                    self.queue.put([mirror, "%d kb/s" % dlSpeed, mirror_index, len(self.mirrors)])
-                    print(("Server {0} - {1} kb/s ({2})".format(mirror, dlSpeed, self.get_human_readable_http_code(httpCode))))
+            mirror = mirrorData[3].strip()
+            if mirror == "URL":
+                continue
+            if mirror.endswith('/'):
+                mirror = mirror[:-1]
+            self._pending.append(mirror)
+        self._tested = 0
+        self._best_speed = 0
+        total = len(self._pending)
+        if self.top_k > 0 and total > 0:
+            self._pending = self.triage(self._pending, total)
+
+        threads = []
+        for i in range(min(self.workers, len(self._pending))):
+            t = threading.Thread(target=self._worker, args=(total,))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+        self.probe.close()
+
+    # Send a HEAD request to all mirrors at the same time: one timeout at most
+    # Unreachable mirrors are dropped, the top_k mirrors with the lowest latency are returned
+    def triage(self, mirrors, total):
+        probe = HttpProbe(connect_timeout=self.triage_timeout, max_time=self.triage_timeout)
+        urls = [self.get_test_url(mirror) for mirror in mirrors]
+        with ThreadPoolExecutor(max_workers=min(TRIAGE_WORKERS, len(urls))) as executor:
+            results = list(executor.map(lambda url: probe.probe(url, method='HEAD'), urls))
+        probe.close()
+
+        reachable = []
+        for mirror, result in zip(mirrors, results):
+            # 405 and 501: the server does not support HEAD requests
+            if result['error'] or not (200 <= result['status'] < 400 or result['status'] in (405, 501)):
+                print(("Server {0} - dropped: {1}".format(mirror, result['error'] or
+                                                          self.get_human_readable_http_code(result['status']))))
+                tested = self._mirror_done(mirror)
+                if result['timeout']:
+                    # The short triage timeout is not a failed test of the mirror
+                    self.queue.put([mirror, NOT_TESTED, tested, total])
+                else:
+                    self.save_history(mirror, result)
+                    self.queue.put([mirror, "0 kb/s", tested, total])
+            else:
+                latency = result['connect'] + result['tls'] + result['ttfb']
+                reachable.append([latency, mirror])
+        reachable.sort()
+        for latency, mirror in reachable[self.top_k:]:
+            print(("Server {0} - {1:.0f} ms: not in the top {2}".format(mirror, latency * 1000, self.top_k)))
+            tested = self._mirror_done(mirror)
+            self.queue.put([mirror, NOT_TESTED, tested, total])
+        return [mirror for latency, mirror in reachable[:self.top_k]]
+
+    # Take the next mirror; wait while only mirrors on busy hosts are left
+    def _next_mirror(self):
+        with self._condition:
+            while self._pending:
+                for i, mirror in enumerate(self._pending):
+                    host = get_mirror_host(mirror)
+                    if not self.one_per_host or host not in self._busy_hosts:
+                        del self._pending[i]
+                        self._busy_hosts.add(host)
+                        return mirror
+                self._condition.wait()
+            return None
+
+    # Return the number of tested mirrors
+    def _mirror_done(self, mirror, speed=0):
+        with self._condition:
+            self._busy_hosts.discard(get_mirror_host(mirror))
+            self._best_speed = max(self._best_speed, speed)
+            self._tested += 1
+            self._condition.notify_all()
+            return self._tested
 
+    def _worker(self, total):
+        while True:
+            mirror = self._next_mirror()
+            if mirror is None:
+                return
+            httpCode = -1
+            dlSpeed = 0
+            try:
+                httpCode, dlSpeed = self.get_speed(mirror)
             except Exception as detail:
                 # This is a best-effort attempt, fail graciously
                 print(("Error: http code = {} / error = {}".format(self.get_human_readable_http_code(httpCode), detail)))
+            tested = self._mirror_done(mirror, dlSpeed * 1024 if 200 <= httpCode < 400 else 0)
+            # Results are queued as they come in
+            if httpCode >= 0:
+                self.queue.put([mirror, "%d kb/s" % dlSpeed, tested, total])
+                print(("Server {0} - {1:.0f} kb/s ({2})".format(mirror, dlSpeed, self.get_human_readable_http_code(httpCode))))
+
+    def get_test_url(self, mirror):
+        # Only check Debian repository: SolydXK is on the same server
+        dl_file = get_system_config('DLTEST', 'extrafiles')
+        url = os.path.join(mirror, dl_file)
+        if '://' not in url:
+            url = "http://%s" % url
+        return url
+
+    def save_history(self, mirror, result):
+        if self.history is not None:
+            try:
+                self.history.add(mirror, result)
+            except Exception as detail:
+                # The test result is still shown
+                print(("Mirror history not saved: %s" % detail))
+
+    # Return [http code, download speed in kb/s] of a mirror
+    def get_speed(self, mirror):
+        with self._condition:
+            best_speed = self._best_speed
+        result = self.probe.probe(self.get_test_url(mirror), best_speed)
+        if result['error']:
+            print(("Server {0} - {1}".format(mirror, result['error'])))
+        else:
+            print(("Server {0} - dns {1:.0f} ms, connect {2:.0f} ms, tls {3:.0f} ms, first byte {4:.0f} ms, "
+                   "{5} kB in {6:.1f} s ({7}){8}".format(
+                   mirror, result['dns'] * 1000, result['connect'] * 1000, result['tls'] * 1000,
+                   result['ttfb'] * 1000, result['bytes'] // 1024, result['seconds'], result['stopped'],
+                   ' (reused connection)' if result['reused'] else '')))
+        self.save_history(mirror, result)
+        return [result['status'], result['speed'] / 1024]
 
     def get_human_readable_http_code(self, httpCode):
         if httpCode == 200:
             return "OK"
+        elif httpCode == 206:
+            return "206: partial content"
         elif httpCode == 302:
             return "302: found (redirect)"
         elif httpCode == 403:
@@ -143,12 +405,13 @@ class MirrorGetSpeed(threading.Thread):
 
 
 class Mirror():
-    def __init__(self):
+    def __init__(self, sources=SOURCES_LIST):
         self.debian_version = get_debian_version()
+        self.sources = sources
 
     def save(self, replaceRepos, excludeStrings=[]):
         try:
-            src = '/etc/apt/sources.list'
+            src = self.sources
             if os.path.exists(src):
                 new_repos = []
                 srcList = []
@@ -0,0 +1,331 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Offline benchmark of the mirror functions with a local mirror farm
+# ====================================================================
+# python3 mirrorbench.py [-m MIRRORS] [-e ERRORS] [-s SEED] [-w WORKERS] [-f] [-r BYTES] [-k TOP_K] [--json]
+#
+# Starts an HTTP server on the loopback interface for each mirror.
+# Each server is throttled to its own bandwidth and latency; some of
+# them return 404 or 500, or never answer. A mirrors.list with all the
+# mirrors is generated and served as well. Then the same steps as the
+# Repositories page are done without touching a real mirror:
+#
+#  1. get_mirror_data     download and read the generated mirrors.list
+#  2. MirrorGetSpeed      test all mirrors (results in a temporary history)
+#  3. Mirror.save         switch a temporary sources.list to the fastest mirror
+#
+# Reported: the wall time of each step, the bytes served by the mirrors
+# and how well the measured ranking matches the configured bandwidths
+# (Kendall tau, part of the mirrors ranked, best mirror). Compare with --fixed to see what the
+# adaptive speed test (MIRRORS_ADAPTIVE) saves.
+# ====================================================================
+
+import os
+import sys
+import json
+import time
+import re
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+from queue import Queue
+from contextlib import redirect_stdout
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Run from any directory
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from snapshot import snapshot
+from mirrorhistory import MirrorHistory, get_fastest_mirrors
+from mirror import get_mirror_data, get_replace_repos, MirrorGetSpeed, Mirror
+
+# Bytes served for the download test file
+FILE_SIZE = 4 * 1024 * 1024
+# Bandwidth range of the healthy mirrors in bytes per second
+MIN_BANDWIDTH = 200 * 1024
+MAX_BANDWIDTH = 8 * 1024 * 1024
+# Latency range in seconds before the first byte
+MIN_LATENCY = 0.005
+MAX_LATENCY = 0.3
+# Failing mirrors are one of these
+FAILURES = ['404', '500', 'hang']
+
+
+# Return a list of mirror profiles: {'bandwidth', 'latency', 'failure'}
+def get_profiles(count, error_ratio=0.2, seed=1):
+    rnd = random.Random(seed)
+    profiles = []
+    for i in range(count):
+        failure = rnd.choice(FAILURES) if rnd.random() < error_ratio else ''
+        profiles.append({'bandwidth': rnd.randint(MIN_BANDWIDTH, MAX_BANDWIDTH),
+                         'latency': rnd.uniform(MIN_LATENCY, MAX_LATENCY),
+                         'failure': failure})
+    return profiles
+
+
+class MirrorRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        profile = self.server.profile
+        if profile['failure'] == 'hang':
+            self.server.stopping.wait()
+            return
+        time.sleep(profile['latency'])
+        self.send_response(int(profile['failure']) if profile['failure'] else 200)
+        self.send_header('Content-Length', '0' if profile['failure'] else str(FILE_SIZE))
+        self.end_headers()
+
+    def do_GET(self):
+        profile = self.server.profile
+        if self.path.endswith('/mirrors.list') or self.path.endswith('/mirrors.list.dead'):
+            self.send_text(self.server.files.get(os.path.basename(self.path), ''))
+            return
+        if profile['failure'] == 'hang':
+            # Never answer: the client has to time out
+            self.server.stopping.wait()
+            return
+        time.sleep(profile['latency'])
+        if profile['failure'] in ('404', '500'):
+            self.send_text('', int(profile['failure']))
+            return
+        # Only "bytes=0-N" ranges are asked for
+        size = FILE_SIZE
+        matchObj = re.match(r'bytes=0-(\d+)$', self.headers.get('Range', ''))
+        if matchObj:
+            size = min(FILE_SIZE, int(matchObj.group(1)) + 1)
+            self.send_response(206)
+            self.send_header('Content-Range', "bytes 0-%d/%d" % (size - 1, FILE_SIZE))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        # Send in slices of 1/20 second to keep the bandwidth
+        chunk = b'\0' * max(1, profile['bandwidth'] // 20)
+        sent = 0
+        start = time.perf_counter()
+        try:
+            while sent < size and not self.server.stopping.is_set():
+                data = chunk[:size - sent]
+                self.wfile.write(data)
+                sent += len(data)
+                self.server.add_sent(len(data))
+                delay = start + sent / profile['bandwidth'] - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except OSError:
+            # The client stops reading after its time limit
+            pass
+
+    def send_text(self, text, code=200):
+        data = text.encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MirrorServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, profile, files={}):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', 0), MirrorRequestHandler)
+        self.profile = profile
+        self.files = files
+        self.stopping = threading.Event()
+        self.sent = 0
+        self._lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.stopper = None
+
+    # The probe closes connections when it stops a test early: do not print those tracebacks
+    def handle_error(self, request, client_address):
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        ThreadingHTTPServer.handle_error(self, request, client_address)
+
+    def add_sent(self, nbytes):
+        with self._lock:
+            self.sent += nbytes
+
+    def get_url(self):
+        return "127.0.0.1:%d/debian/" % self.server_address[1]
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.signal_stop()
+        self.join()
+
+    # Ask the server to stop without waiting for it (shutdown takes up to half a second)
+    def signal_stop(self):
+        self.stopping.set()
+        if self.stopper is None:
+            self.stopper = threading.Thread(target=self.shutdown)
+            self.stopper.daemon = True
+            self.stopper.start()
+
+    def join(self):
+        if self.stopper is not None:
+            self.stopper.join()
+        self.server_close()
+
+
+# Kendall rank correlation of the expected order and the measured order: 1 = same order, -1 = reversed
+# Expected items missing in measured (not tested) are ranked last and tied,
+# so a ranking of only a few mirrors does not score 1
+def kendall_tau(expected, measured):
+    position = {item: i for i, item in enumerate(measured)}
+    untested = len(measured)
+    concordant = discordant = 0
+    for i in range(len(expected)):
+        for j in range(i + 1, len(expected)):
+            pos_i = position.get(expected[i], untested)
+            pos_j = position.get(expected[j], untested)
+            if pos_i < pos_j:
+                concordant += 1
+            elif pos_i > pos_j:
+                discordant += 1
+    pairs = len(expected) * (len(expected) - 1) // 2
+    return (concordant - discordant) / pairs if pairs else 1.0
+
+
+class MirrorBench():
+    def __init__(self, mirrors=20, error_ratio=0.2, seed=1, workers=None, adaptive=True, range_bytes=0, top_k=None):
+        self.profiles = get_profiles(mirrors, error_ratio, seed)
+        self.workers = workers
+        self.adaptive = adaptive
+        self.range_bytes = range_bytes
+        self.top_k = top_k
+        self.servers = []
+        self.repository = None
+        self.tmp_dir = None
+
+    def start(self):
+        self.tmp_dir = tempfile.mkdtemp(prefix='mirrorbench-')
+        for profile in self.profiles:
+            server = MirrorServer(profile)
+            server.start()
+            self.servers.append(server)
+        lines = ["NL,debian,%s" % server.get_url() for server in self.servers]
+        # The repository server serves the generated mirrors lists
+        files = {'mirrors.list': "%s\n" % '\n'.join(lines), 'mirrors.list.dead': ''}
+        self.repository = MirrorServer({'failure': ''}, files)
+        self.repository.start()
+
+        # The sources.list uses the first mirror
+        self.sources = os.path.join(self.tmp_dir, 'sources.list')
+        with open(self.sources, 'w') as f:
+            f.write("deb http://%s buster main contrib non-free\n" % self.servers[0].get_url())
+            f.write("deb http://deb.debian.org/debian buster-backports main\n")
+
+    def stop(self):
+        servers = [server for server in self.servers + [self.repository] if server is not None]
+        for server in servers:
+            server.signal_stop()
+        for server in servers:
+            server.join()
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+    def run(self):
+        # Keep the results out of the system snapshot
+        snapshot.enabled = False
+        report = {'mirrors': len(self.profiles),
+                  'failing': len([p for p in self.profiles if p['failure']])}
+
+        t = time.perf_counter()
+        url = "http://127.0.0.1:%d/mirrors.list" % self.repository.server_address[1]
+        mirrorData = get_mirror_data(url=url, mirrorsList=os.path.join(self.tmp_dir, 'mirrors.list'),
+                                     sources=self.sources)
+        report['get_mirror_data_seconds'] = time.perf_counter() - t
+        report['listed'] = len(mirrorData)
+
+        # MirrorGetSpeed expects the treeview rows: [current, country, repository, url, speed]
+        rows = [[False, data[0], data[1], data[2], ''] for data in mirrorData]
+        history = MirrorHistory(os.path.join(self.tmp_dir, 'mirrors.sqlite'))
+        queue = Queue()
+        t = time.perf_counter()
+        thread = MirrorGetSpeed(rows, queue, workers=self.workers, history=history, adaptive=self.adaptive,
+                                top_k=self.top_k)
+        thread.probe.range_bytes = self.range_bytes
+        thread.start()
+        thread.join()
+        report['probe_seconds'] = time.perf_counter() - t
+        report['results'] = queue.qsize()
+        report['served_bytes'] = sum(server.sent for server in self.servers)
+
+        # Ranking accuracy: healthy mirrors should be ranked on bandwidth
+        expected = [server.get_url().rstrip('/') for server in
+                    sorted(self.servers, key=lambda s: -s.profile['bandwidth']) if not server.profile['failure']]
+        failing = [server.get_url().rstrip('/') for server in self.servers if server.profile['failure']]
+        rankings = history.get_rankings()
+        measured = [r['mirror'] for r in rankings if r['score'] > 0]
+        report['kendall_tau'] = kendall_tau(expected, measured)
+        # Part of the healthy mirrors that were ranked
+        report['coverage'] = len([m for m in expected if m in measured]) / len(expected) if expected else 1.0
+        report['best_expected'] = expected[0] if expected else ''
+        report['best_measured'] = measured[0] if measured else ''
+        report['best_found'] = report['best_expected'] in measured
+        report['failing_ranked'] = len([m for m in measured if m in failing])
+
+        # Switch the sources.list to the fastest mirror
+        t = time.perf_counter()
+        urls = get_fastest_mirrors(mirrorData, history)
+        replaceRepos = get_replace_repos(urls, mirrorData, sources=self.sources)
+        ret = Mirror(self.sources).save(replaceRepos) if replaceRepos else ''
+        report['save_seconds'] = time.perf_counter() - t
+        with open(self.sources, 'r') as f:
+            report['saved'] = ret == '' and bool(urls) and urls[0] in f.read()
+        history.close()
+        return report
+
+
+def get_text_report(report):
+    lines = ["Mirrors:          %d (%d failing)" % (report['mirrors'], report['failing']),
+             "get_mirror_data:  %.3f s (%d listed)" % (report['get_mirror_data_seconds'], report['listed']),
+             "MirrorGetSpeed:   %.3f s (%d results, %.1f MB served)" % (report['probe_seconds'], report['results'],
+                                                                    report['served_bytes'] / 1048576),
+             "Mirror.save:      %.3f s (%s)" % (report['save_seconds'], 'ok' if report['saved'] else 'failed'),
+             "Kendall tau:      %.3f (%.0f%% of the healthy mirrors ranked)" % (report['kendall_tau'],
+                                                                              report['coverage'] * 100),
+             "Best mirror:      %s (expected %s, %s)" % (report['best_measured'], report['best_expected'],
+                                                         'ranked' if report['best_found'] else 'not ranked'),
+             "Failing ranked:   %d" % report['failing_ranked']]
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the mirror functions with local mirrors")
+    parser.add_argument('-m', '--mirrors', type=int, default=20, help='Number of mirrors (default: 20).')
+    parser.add_argument('-e', '--errors', type=float, default=0.2, help='Part of the mirrors that fail (default: 0.2).')
+    parser.add_argument('-s', '--seed', type=int, default=1, help='Random seed of the mirror profiles.')
+    parser.add_argument('-w', '--workers', type=int, help='Concurrent tests (default: MIRRORS_WORKERS).')
+    parser.add_argument('-f', '--fixed', action="store_true", help='Test each mirror for the full time limit.')
+    parser.add_argument('-r', '--range-bytes', type=int, default=0, help='Only ask for the first bytes of the test file.')
+    parser.add_argument('-k', '--top-k', type=int, help='Only test the speed of the K fastest answering mirrors (0: all).')
+    parser.add_argument('-j', '--json', action="store_true", help='Print the report as json.')
+    args = parser.parse_args()
+
+    bench = MirrorBench(args.mirrors, args.errors, args.seed, args.workers, not args.fixed, args.range_bytes, args.top_k)
+    try:
+        bench.start()
+        # The mirror functions print their progress: keep stdout for the report
+        with redirect_stdout(sys.stderr):
+            report = bench.run()
+    finally:
+        bench.stop()
+    if args.json:
+        print((json.dumps(report, indent=2)))
+    else:
+        print((get_text_report(report)))
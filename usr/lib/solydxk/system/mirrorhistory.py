@@ -0,0 +1,196 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# History of mirror speed tests and mirror ranking
+# ====================================================================
+# from mirrorhistory import mirror_history, get_fastest_mirrors
+# mirror_history.add('deb.debian.org/debian', probe_result)
+# mirror_history.get_rankings()  -> [{'mirror', 'score', 'speed', ...}]
+# get_fastest_mirrors(get_mirror_data())  -> ['deb.debian.org/debian', ...]
+#
+# Every speed test (see MirrorGetSpeed) is saved in a sqlite database.
+# Mirrors are ranked on exponentially weighted moving averages (EWMA)
+# of their speed, time to first byte and failure rate, so that recent
+# tests count most but one bad test does not throw away weeks of data.
+# ====================================================================
+
+import os
+import time
+import sqlite3
+import threading
+
+HISTORY_PATH = '/var/lib/solydxk-system/mirrors.sqlite'
+
+# Weight of the newest test in the moving averages
+EWMA_ALPHA = 0.3
+# Score = speed * (1 - failure rate) ^ FAILURE_PENALTY
+FAILURE_PENALTY = 2
+# Tests older than this are removed
+MAX_AGE_DAYS = 90
+
+SCHEMA = """CREATE TABLE IF NOT EXISTS probes (
+    mirror TEXT NOT NULL,
+    time REAL NOT NULL,
+    http_code INTEGER NOT NULL,
+    speed REAL NOT NULL,
+    dns REAL NOT NULL,
+    connect REAL NOT NULL,
+    tls REAL NOT NULL,
+    ttfb REAL NOT NULL,
+    error TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS probes_mirror_time ON probes (mirror, time);"""
+
+
+# Mirror urls are saved without scheme and trailing slash
+def get_mirror_key(mirror):
+    if '://' in mirror:
+        mirror = mirror.split('://', 1)[1]
+    return mirror.rstrip('/')
+
+
+# A test failed when the mirror could not be reached or did not return the file
+def is_failure(http_code, error=''):
+    return bool(error) or not 200 <= http_code < 400
+
+
+def new_ranking(mirror):
+    return {'mirror': mirror, 'score': 0.0, 'speed': 0.0, 'ttfb': 0.0,
+            'failure_rate': 0.0, 'samples': 0, 'failures': 0, 'last': 0}
+
+
+# Return the ranking of a mirror from its tests (sorted on time)
+def rank_probes(mirror, probes, alpha=EWMA_ALPHA):
+    ranking = new_ranking(mirror)
+    for probe in probes:
+        failed = is_failure(probe['http_code'], probe['error'])
+        first = ranking['samples'] == 0
+        ranking['samples'] += 1
+        ranking['last'] = probe['time']
+        ranking['failure_rate'] = float(failed) if first else \
+            alpha * float(failed) + (1 - alpha) * ranking['failure_rate']
+        if failed:
+            ranking['failures'] += 1
+            continue
+        # Speed and latency only average the successful tests
+        if ranking['samples'] - ranking['failures'] == 1:
+            ranking['speed'] = probe['speed']
+            ranking['ttfb'] = probe['ttfb']
+        else:
+            ranking['speed'] = alpha * probe['speed'] + (1 - alpha) * ranking['speed']
+            ranking['ttfb'] = alpha * probe['ttfb'] + (1 - alpha) * ranking['ttfb']
+    ranking['score'] = ranking['speed'] * (1 - ranking['failure_rate']) ** FAILURE_PENALTY
+    return ranking
+
+
+class MirrorHistory():
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        self._conn = None
+        self._pruned = False
+        self._lock = threading.Lock()
+
+    # Open the database on first use (MirrorGetSpeed saves from its worker threads)
+    # Users without write access can still read an existing database
+    def _connect(self):
+        if self._conn is None:
+            history_dir = os.path.dirname(self.path)
+            if history_dir and not os.path.isdir(history_dir):
+                os.makedirs(history_dir)
+            self._conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+            self._conn.row_factory = sqlite3.Row
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    # Remove old tests once per session, only when writing
+    def _prune(self, conn):
+        if not self._pruned:
+            conn.execute("DELETE FROM probes WHERE time < ?", (time.time() - MAX_AGE_DAYS * 86400,))
+            self._pruned = True
+
+    # Save a test result (see httpprobe.HttpProbe.probe)
+    def add(self, mirror, result, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.execute("INSERT INTO probes (mirror, time, http_code, speed, dns, connect, tls, ttfb, error) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (get_mirror_key(mirror), timestamp, result['status'], result['speed'] / 1024,
+                          result['dns'], result['connect'], result['tls'], result['ttfb'], result['error']))
+            self._prune(conn)
+            conn.commit()
+
+    # Return the tests of a mirror sorted on time (speed in kb/s)
+    def get_probes(self, mirror, since=0):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with self._lock:
+                rows = self._connect().execute("SELECT * FROM probes WHERE mirror = ? AND time >= ? ORDER BY time",
+                                               (get_mirror_key(mirror), since)).fetchall()
+        except sqlite3.Error as detail:
+            print(("Cannot read mirror history %s: %s" % (self.path, detail)))
+            return []
+        return [dict(row) for row in rows]
+
+    # Return the rankings of the given (or all) mirrors, best first
+    # Mirrors without tests are left out
+    def get_rankings(self, mirrors=None):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with self._lock:
+                rows = self._connect().execute("SELECT * FROM probes ORDER BY mirror, time").fetchall()
+        except sqlite3.Error as detail:
+            print(("Cannot read mirror history %s: %s" % (self.path, detail)))
+            return []
+        probes = {}
+        for row in rows:
+            probes.setdefault(row['mirror'], []).append(dict(row))
+        if mirrors is not None:
+            keys = [get_mirror_key(mirror) for mirror in mirrors]
+            probes = {key: probes[key] for key in keys if key in probes}
+        rankings = [rank_probes(key, lst) for key, lst in probes.items()]
+        rankings.sort(key=lambda r: (-r['score'], r['ttfb']))
+        return rankings
+
+    def clear(self):
+        with self._lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM probes")
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# Shared instance
+mirror_history = MirrorHistory()
+
+
+# Return the best ranked url of each repository in mirrorData (see mirror.get_mirror_data)
+# Only mirrors with at least one successful test are selected
+def get_fastest_mirrors(mirrorData, history=mirror_history):
+    urls = {}
+    for data in mirrorData:
+        if len(data) > 2:
+            urls[get_mirror_key(data[2])] = data
+    fastest = []
+    repos = []
+    for ranking in history.get_rankings(list(urls.keys())):
+        data = urls[ranking['mirror']]
+        if ranking['score'] > 0 and data[1] not in repos:
+            repos.append(data[1])
+            fastest.append(data[2])
+    return fastest
+
+
+if __name__ == '__main__':
+    for ranking in mirror_history.get_rankings():
+        print(("%-50s %8.0f kb/s %6.0f ms %3.0f%% failed (%d tests)" %
+               (ranking['mirror'], ranking['speed'], ranking['ttfb'] * 1000,
+                ranking['failure_rate'] * 100, ranking['samples'])))
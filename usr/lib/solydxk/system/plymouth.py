@@ -7,9 +7,11 @@ import re
 import threading
 import os
 from os.path import exists, isfile
-from utils import getoutput, shell_exec, str_to_nr, get_package_version
+from utils import run_process, get_process_output, shell_exec, str_to_nr, \
+                  get_package_versions
 from grub import Grub
 from shutil import which
+from procfs import facts
 
 # i18n: http://docs.python.org/3/library/gettext.html
 import gettext
@@ -32,15 +34,14 @@ class Plymouth():
         instThemes = []
         try:
             if isfile(self.setThemePath):
-                cmd = '%s --list' % self.setThemePath
-                instThemes = getoutput(cmd)
+                instThemes = get_process_output([self.setThemePath, '--list'])
         except:
             pass
         return instThemes
         
     def is_plymouth_booted(self):
-        cmdline = getoutput("cat /proc/cmdline")[0]
-        if ' splash' in cmdline:
+        cmdline = ' '.join(facts.get_cmdline())
+        if 'splash' in cmdline.split():
             return True
         else:
             # It could be that the user manually removed splash in Grub when booting
@@ -48,9 +49,10 @@ class Plymouth():
             matchObj = re.search('\/.*=[0-9a-z\-]+', cmdline)
             if matchObj:
                 if exists(self.grubcfg):
-                    grubcfg_splash = getoutput('grep "{}" "{}" | grep " splash"'.format(matchObj.group(0), self.grubcfg))[0]
-                    if grubcfg_splash:
-                        return True
+                    with open(self.grubcfg, 'r') as f:
+                        for line in f:
+                            if matchObj.group(0) in line and ' splash' in line:
+                                return True
         return False
 
     # Get the currently used Plymouth theme
@@ -58,15 +60,14 @@ class Plymouth():
         try:
             if isfile(self.setThemePath) and \
                self.is_plymouth_booted():
-                    return getoutput(self.setThemePath)[0]
+                    return get_process_output([self.setThemePath])[0]
         except:
             pass
         return ''
 
     # Get a list of Plymouth themes in the repositories that can be installed
     def getAvailableThemes(self):
-        cmd = 'apt-cache pkgnames {}'.format(self.avlThemesSearchstr)
-        availableThemes = getoutput(cmd)
+        availableThemes = get_process_output(['apt-cache', 'pkgnames', self.avlThemesSearchstr])
         avlThemes = []
 
         for line in availableThemes:
@@ -87,9 +88,8 @@ class Plymouth():
 
     # Get the package name that can be uninstalled of a given Plymouth theme
     def getRemovablePackageName(self, theme):
-        cmd = 'dpkg -S %s.plymouth' % theme
         package = None
-        packageNames = getoutput(cmd)
+        packageNames = get_process_output(['dpkg', '-S', '%s.plymouth' % theme])
 
         for line in packageNames:
             if self.avlThemesSearchstr in line:
@@ -171,21 +171,17 @@ class PlymouthSave(threading.Thread):
             return
             
         try:
-            if not exists(self.modulesPath):
-                shell_exec("touch {}".format(self.modulesPath))
-
             # Cleanup first
             self.queue_progress()
-            shell_exec("sed -i -e 's/^ *//; s/ *$//' %s" % self.modulesPath)    # Trim all lines
-            shell_exec("sed -i -e '/^.*KMS$/d' %s" % self.modulesPath)
-            shell_exec("sed -i -e '/^intel_agp$/d' %s" % self.modulesPath)
-            shell_exec("sed -i -e '/^drm$/d' %s" % self.modulesPath)
-            shell_exec("sed -i -e '/^nouveau modeset.*/d' %s" % self.modulesPath)
-            shell_exec("sed -i -e '/^radeon modeset.*/d' %s" % self.modulesPath)
-            shell_exec("sed -i -e '/^i915 modeset.*/d' %s" % self.modulesPath)
-            shell_exec("sed -i -e '/^uvesafb\s*mode_option.*/d' %s" % self.modulesPath)
-            if self.boot is not None:
-                shell_exec("sed -i -e '/^GRUB_GFXPAYLOAD_LINUX.*/d' %s" % self.boot)
+            lines = []
+            if exists(self.modulesPath):
+                with open(self.modulesPath, 'r') as f:
+                    lines = f.read().splitlines()
+            # Trim all lines and remove the old configuration
+            regexp = '^.*KMS$|^intel_agp$|^drm$|^nouveau modeset.*|^radeon modeset.*|^i915 modeset.*|^uvesafb\\s*mode_option.*'
+            lines = [line.strip() for line in lines if not re.match(regexp, line.strip())]
+            with open(self.modulesPath, 'w') as f:
+                f.write("%s\n" % '\n'.join(lines) if lines else '')
             splashFile = '/etc/initramfs-tools/conf.d/splash'
             if exists(splashFile):
                 os.remove(splashFile)
@@ -193,29 +189,29 @@ class PlymouthSave(threading.Thread):
             # Set/Unset splash
             self.queue_progress()
             if self.boot is not None:
-                cmd = "sed -i -e 's/\s*[a-z]*splash//' {}".format(self.boot)
-                shell_exec(cmd)
+                with open(self.boot, 'r') as f:
+                    lines = f.read().splitlines()
+                lines = [re.sub('\\s*[a-z]*splash', '', line, count=1) for line in lines
+                         if not line.startswith('GRUB_GFXPAYLOAD_LINUX')]
                 if self.theme is None:
                     self.write_log("Set nosplash")
-                    cmd = "sed -i -e '/^GRUB_CMDLINE_LINUX_DEFAULT=/ s/\"$/ nosplash\"/' {}".format(self.boot)
-                    shell_exec(cmd)
+                    lines = [re.sub('"$', ' nosplash"', line) if line.startswith('GRUB_CMDLINE_LINUX_DEFAULT=') else line for line in lines]
                     # Comment the GRUB_GFXMODE line if needed
-                    cmd = "sed -i '/GRUB_GFXMODE=/s/^/#/' %s" % self.boot
-                    shell_exec(cmd)
+                    lines = ["#%s" % line if 'GRUB_GFXMODE=' in line else line for line in lines]
                 else:
                     self.write_log("Set splash")
-                    cmd = "sed -i -e '/^GRUB_CMDLINE_LINUX_DEFAULT=/ s/\"$/ splash\"/' {}".format(self.boot)
-                    shell_exec(cmd)
+                    lines = [re.sub('"$', ' splash"', line) if line.startswith('GRUB_CMDLINE_LINUX_DEFAULT=') else line for line in lines]
                     # Set resolution
                     if self.resolution is not None:
                         self.write_log("GRUB_GFXMODE={}".format(self.resolution))
-                        cmd = "sed -i -e '/GRUB_GFXMODE=/ c GRUB_GFXMODE={0}' {1}".format(self.resolution, self.boot)
-                        shell_exec(cmd)
+                        lines = ["GRUB_GFXMODE=%s" % self.resolution if 'GRUB_GFXMODE=' in line else line for line in lines]
+                with open(self.boot, 'w') as f:
+                    f.write("%s\n" % '\n'.join(lines))
 
             # Only for plymouth version older than 9
             self.queue_progress()
             if self.theme is not None and self.resolution is not None:
-                plymouthVersion = str_to_nr(get_package_version("plymouth").replace('.', '')[0:2], True)
+                plymouthVersion = str_to_nr(get_package_versions(['plymouth'])['plymouth']['installed'].replace('.', '')[0:2], True)
                 self.write_log("plymouthVersion={}".format(plymouthVersion))
                 if plymouthVersion < 9:
                     # Write uvesafb command to modules file
@@ -237,15 +233,16 @@ class PlymouthSave(threading.Thread):
 
                 # Update grub
                 self.queue_progress()
-                if 'grub' in self.boot:
-                    shell_exec('update-grub')
-                else:
-                    shell_exec('update-burg')
+                result = run_process(['update-grub' if 'grub' in self.boot else 'update-burg'])
+                if not result:
+                    self.write_log(result.stderr, 'warning')
 
             # Set the theme and update initramfs
             self.queue_progress()
             if self.theme is not None:
-                shell_exec("{0} -R {1}".format(self.setThemePath, self.theme))
+                result = run_process([self.setThemePath, '-R', self.theme])
+                if not result:
+                    self.write_log(result.stderr, 'warning')
 
         except Exception as detail:
             self.write_log(detail, 'exception')
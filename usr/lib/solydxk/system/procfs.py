@@ -0,0 +1,215 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Kernel facts read from /proc and /sys without running commands
+# ====================================================================
+# from procfs import facts
+# facts.get_swaps()          -> [{'device': '/dev/sda2', 'type': 'partition', ...}]
+# facts.get_mounts()         -> [{'device': '/dev/sda1', 'mount_point': '/', ...}]
+# facts.get_pids('firefox')  -> [1234]
+#
+# Point a SystemFacts object at a directory with the same layout
+# (proc/swaps, sys/devices/virtual/dmi/id/...) to read fixtures:
+# SystemFacts('/tmp/fixture')
+# ====================================================================
+
+import os
+import re
+
+DMI_DIR = 'sys/devices/virtual/dmi/id'
+LIVE_DIRS = ['live', 'lib/live/mount', 'rofs']
+DRM_DIR = 'sys/class/drm'
+VBE_MODES = 'sys/bus/platform/drivers/uvesafb/uvesafb.0/vbe_modes'
+
+
+# Undo the octal escapes used in /proc/mounts and /proc/swaps (e.g. \040 for a space)
+def unescape_octal(value):
+    return re.sub(r'\\([0-7]{3})', lambda m: chr(int(m.group(1), 8)), value)
+
+
+class SystemFacts():
+    def __init__(self, root='/'):
+        self.root = root
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    # Return the content of a file or default when it cannot be read
+    def read(self, *parts, default=''):
+        try:
+            with open(self.path(*parts), 'r', errors='replace') as f:
+                return f.read()
+        except (OSError, IOError):
+            return default
+
+    def read_lines(self, *parts):
+        return self.read(*parts).splitlines()
+
+    # ================================================
+    # Swap and mounts
+    # ================================================
+
+    # Active swap: [{'device', 'type', 'size', 'used', 'priority'}] (sizes in KiB)
+    def get_swaps(self):
+        swaps = []
+        for line in self.read_lines('proc', 'swaps')[1:]:
+            fields = line.split()
+            if len(fields) < 5:
+                continue
+            swaps.append({'device': unescape_octal(fields[0]),
+                          'type': fields[1],
+                          'size': int(fields[2]),
+                          'used': int(fields[3]),
+                          'priority': int(fields[4])})
+        return swaps
+
+    def get_swap_devices(self):
+        return [swap['device'] for swap in self.get_swaps() if swap['device'].startswith('/')]
+
+    def is_active_swap(self, device):
+        return device in self.get_swap_devices()
+
+    # Mounted file systems: [{'device', 'mount_point', 'fs_type', 'options'}]
+    def get_mounts(self):
+        mounts = []
+        for line in self.read_lines('proc', 'mounts'):
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            mounts.append({'device': unescape_octal(fields[0]),
+                           'mount_point': unescape_octal(fields[1]),
+                           'fs_type': fields[2],
+                           'options': fields[3].split(',')})
+        return mounts
+
+    def is_mounted(self, device_path):
+        return any(mount['device'] == device_path for mount in self.get_mounts())
+
+    # Mount points of a device or an empty list
+    def get_mount_points(self, device_path):
+        return [mount['mount_point'] for mount in self.get_mounts() if mount['device'] == device_path]
+
+    # ================================================
+    # Processes
+    # ================================================
+
+    # Running processes: [{'pid', 'uid', 'comm', 'cmdline'}]
+    # Processes that end while reading are skipped
+    def get_processes(self):
+        processes = []
+        try:
+            pids = [int(d) for d in os.listdir(self.path('proc')) if d.isdigit()]
+        except OSError:
+            return processes
+        for pid in sorted(pids):
+            try:
+                proc_dir = self.path('proc', str(pid))
+                with open(os.path.join(proc_dir, 'comm'), 'r', errors='replace') as f:
+                    comm = f.read().rstrip('\n')
+                with open(os.path.join(proc_dir, 'cmdline'), 'rb') as f:
+                    cmdline = [arg.decode(errors='replace') for arg in f.read().split(b'\0') if arg]
+                uid = os.stat(proc_dir).st_uid
+            except OSError:
+                continue
+            processes.append({'pid': pid, 'uid': uid, 'comm': comm, 'cmdline': cmdline})
+        return processes
+
+    # Pids of a process name (like pidof)
+    # fuzzy: name and argument may be anywhere in the command line (like ps -ef | grep)
+    def get_pids(self, process_name, process_argument=None, fuzzy=False):
+        pids = []
+        for proc in self.get_processes():
+            if fuzzy:
+                cmdline = ' '.join(proc['cmdline'])
+                if process_name not in cmdline:
+                    continue
+                if process_argument is not None and process_argument not in cmdline:
+                    continue
+            else:
+                # The kernel truncates comm to 15 characters
+                names = [proc['comm']]
+                if proc['cmdline']:
+                    names.append(os.path.basename(proc['cmdline'][0]))
+                if process_name not in names and process_name[:15] != proc['comm']:
+                    continue
+            pids.append(proc['pid'])
+        return pids
+
+    # ================================================
+    # Machine
+    # ================================================
+
+    def get_machine(self):
+        if self.root == '/':
+            return os.uname().machine
+        # Fixtures cannot fake uname: fall back to the architecture in /proc/version
+        version = self.get_kernel_version()
+        for machine in ['x86_64', 'i686', 'i586', 'i386', 'aarch64', 'armv7l']:
+            if machine in version:
+                return machine
+        return ''
+
+    def is_amd64(self):
+        return self.get_machine() == 'x86_64'
+
+    # Content of /proc/version
+    def get_kernel_version(self):
+        return self.read('proc', 'version').strip()
+
+    # Kernel command line as a list of parameters
+    def get_cmdline(self):
+        return self.read('proc', 'cmdline').split()
+
+    # DMI values: bios_version, product_name, board_name, sys_vendor...
+    def get_dmi(self, name):
+        return self.read(DMI_DIR, name).strip()
+
+    def in_virtualbox(self):
+        vb = 'VirtualBox'
+        return any(vb in self.get_dmi(name) for name in ['bios_version', 'product_name', 'board_name'])
+
+    def is_running_live(self):
+        return any(os.path.exists(self.path(d)) for d in LIVE_DIRS)
+
+    # ================================================
+    # Display
+    # ================================================
+
+    # Modes of the connected DRM connectors (e.g. card0-HDMI-A-1): ['1920x1080', ...]
+    def get_drm_modes(self):
+        modes = []
+        try:
+            connectors = sorted(os.listdir(self.path(DRM_DIR)))
+        except OSError:
+            return modes
+        for connector in connectors:
+            # Skip the cards themselves (card0) and render nodes
+            if not connector.startswith('card') or '-' not in connector:
+                continue
+            if self.read(DRM_DIR, connector, 'status').strip() == 'disconnected':
+                continue
+            for line in self.read_lines(DRM_DIR, connector, 'modes'):
+                matchObj = re.match(r'(\d+x\d+)', line.strip())
+                if matchObj and matchObj.group(1) not in modes:
+                    modes.append(matchObj.group(1))
+        return modes
+
+    # Modes of the uvesafb driver (lines like "1024x768-32, 0x0118"): ['1024x768', ...]
+    def get_vbe_modes(self):
+        modes = []
+        for line in self.read_lines(VBE_MODES):
+            matchObj = re.match(r'(\d+x\d+)', line.strip())
+            if matchObj and matchObj.group(1) not in modes:
+                modes.append(matchObj.group(1))
+        return modes
+
+    # Size of the frame buffer ("1920,1080" in virtual_size): '1920x1080' or an empty string
+    def get_framebuffer_size(self, fb='fb0'):
+        size = self.read('sys', 'class', 'graphics', fb, 'virtual_size').strip()
+        if re.match(r'^\d+,\d+$', size):
+            return size.replace(',', 'x')
+        return ''
+
+
+# Shared instance for the running system
+facts = SystemFacts()
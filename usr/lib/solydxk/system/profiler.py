@@ -0,0 +1,223 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Time the startup phases of SolydXK System Settings
+# ====================================================================
+# from profiler import profiler
+# profiler.enable('/var/log/solydxk-system-startup')
+# profiler.watch(utils.process_hooks)
+#
+# with profiler.phase('my phase'):
+#     do_something()
+#
+# When done (also registered with atexit):
+# profiler.write_report()
+#
+# The report is written as text (.txt) and as json (.json).
+# When not enabled, phase() does nothing.
+#
+# Check the cold import time of the main module (exits 1 when over budget):
+# python3 profiler.py --import-budget 400
+# ====================================================================
+
+import atexit
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfiler():
+    def __init__(self):
+        self.enabled = False
+        self.report_path = ''
+        self.start_time = time.time()
+        self.phases = []
+        # Processes started outside any phase
+        self.unassigned = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._written = False
+        # name: function that returns a dictionary for the report
+        self.extra_reports = {}
+
+    def enable(self, report_path):
+        self.enabled = True
+        self.report_path = report_path
+        self.start_time = time.time()
+        atexit.register(self.write_report)
+
+    # Add the dictionary returned by func to the report (e.g. cache statistics)
+    def add_report(self, name, func):
+        self.extra_reports[name] = func
+
+    # Count processes that are reported to the given hook list (utils.process_hooks)
+    def watch(self, hooks):
+        if self.enabled and self.count_process not in hooks:
+            hooks.append(self.count_process)
+
+    def _get_stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+        stack = self._get_stack()
+        phase = {'name': name,
+                 'parent': stack[-1]['name'] if stack else '',
+                 'thread': threading.current_thread().name,
+                 'start': round(time.time() - self.start_time, 4),
+                 'seconds': 0,
+                 'processes': 0,
+                 'commands': []}
+        stack.append(phase)
+        with self._lock:
+            self.phases.append(phase)
+        t = time.time()
+        try:
+            yield
+        finally:
+            phase['seconds'] = round(time.time() - t, 4)
+            stack.pop()
+
+    # Decorator: time the decorated function as a phase
+    def profile(self, func):
+        def wrapper(*args, **kwargs):
+            with self.phase(func.__name__):
+                return func(*args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    def count_process(self, process_info):
+        # Processes are counted in the innermost phase of the current thread
+        stack = self._get_stack()
+        command = process_info.get('command', '')
+        if stack:
+            stack[-1]['processes'] += 1
+            stack[-1]['commands'].append(command)
+        else:
+            with self._lock:
+                self.unassigned.append(command)
+
+    def get_report(self):
+        # Phases are listed in the order they started
+        with self._lock:
+            phases = list(self.phases)
+        report = {'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start_time)),
+                  'seconds': round(time.time() - self.start_time, 4),
+                  'processes': sum(p['processes'] for p in phases) + len(self.unassigned),
+                  'phases': phases,
+                  'unassigned_commands': list(self.unassigned)}
+        for name, func in self.extra_reports.items():
+            try:
+                report[name] = func()
+            except Exception as detail:
+                report[name] = {'error': str(detail)}
+        return report
+
+    def get_text_report(self, report=None):
+        if report is None:
+            report = self.get_report()
+        lines = ["SolydXK System Settings startup profile (%s)" % report['started'],
+                 "Total: %.3f s, %d processes" % (report['seconds'], report['processes']),
+                 '',
+                 "%-45s %-12s %9s %9s %6s" % ('Phase', 'Thread', 'Start', 'Seconds', 'Procs'),
+                 '-' * 85]
+        for phase in report['phases']:
+            name = phase['name']
+            if phase['parent']:
+                name = '  ' + name
+            lines.append("%-45s %-12s %9.3f %9.3f %6d" % (name[:45], phase['thread'][:12], phase['start'], phase['seconds'], phase['processes']))
+            for command in phase['commands']:
+                lines.append("    $ %s" % command)
+        if report['unassigned_commands']:
+            lines.append('')
+            lines.append("Processes outside any phase:")
+            for command in report['unassigned_commands']:
+                lines.append("    $ %s" % command)
+        for name in self.extra_reports:
+            lines.append('')
+            lines.append("%s:" % name)
+            for key, value in sorted(report.get(name, {}).items()):
+                lines.append("    %-40s %s" % (key, value))
+        return '\n'.join(lines) + '\n'
+
+    def write_report(self):
+        if not self.enabled or self._written:
+            return
+        self._written = True
+        report = self.get_report()
+        try:
+            with open("%s.json" % self.report_path, 'w') as f:
+                json.dump(report, f, indent=2)
+            with open("%s.txt" % self.report_path, 'w') as f:
+                f.write(self.get_text_report(report))
+            print(("Startup profile written to %s.txt and %s.json" % (self.report_path, self.report_path)))
+        except Exception as detail:
+            print(("ERROR: could not write startup profile: %s" % detail))
+
+
+# Shared instance
+profiler = StartupProfiler()
+
+
+# Modules that should only be loaded when their feature is used
+DEFERRED_MODULES = ['apt', 'apt_pkg', 'urllib.request',
+                    'gi.repository.UDisks', 'localize', 'mirror', 'encryption',
+                    'endecrypt_partitions', 'plymouth', 'image']
+
+# Import a module in a fresh interpreter and return (milliseconds, loaded deferred modules)
+def measure_import(module='solydxk_system', runs=3):
+    code = ("import sys, time\n"
+            "t = time.perf_counter()\n"
+            "import %s\n"
+            "print((time.perf_counter() - t) * 1000)\n"
+            "print(' '.join(m for m in %r if m in sys.modules))\n") % (module, DEFERRED_MODULES)
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    timings = []
+    loaded = []
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=cwd).decode('utf-8').splitlines()
+        timings.append(float(output[0]))
+        loaded = output[1].split() if len(output) > 1 else []
+    # Best of the runs: the others include disk cache noise
+    return (min(timings), loaded)
+
+
+def check_import_budget(budget_ms, module='solydxk_system', runs=3):
+    try:
+        ms, loaded = measure_import(module, runs)
+    except subprocess.CalledProcessError:
+        print(("ERROR: could not import %s" % module))
+        return False
+    print(("Import %s: %.1f ms (budget: %d ms)" % (module, ms, budget_ms)))
+    ok = True
+    if ms > budget_ms:
+        print(("ERROR: import time exceeds budget"))
+        ok = False
+    if loaded:
+        print(("ERROR: modules loaded at import time: %s" % ', '.join(loaded)))
+        ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Check the cold import time of SolydXK System Settings')
+    parser.add_argument('-b', '--import-budget', type=int, default=400, metavar='MS',
+                        help='Maximum import time in milliseconds (default: 400)')
+    parser.add_argument('-m', '--module', default='solydxk_system',
+                        help='Module to import (default: solydxk_system)')
+    parser.add_argument('-r', '--runs', type=int, default=3,
+                        help='Number of fresh interpreters to measure (default: 3)')
+    args = parser.parse_args()
+    sys.exit(0 if check_import_budget(args.import_budget, args.module, args.runs) else 1)
@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Warm-start snapshot of slow system inventories
+# ====================================================================
+# from snapshot import snapshot
+# lst = snapshot.cached('holdback', ['/var/lib/dpkg/status'], get_holdback)
+#
+# Each entry is saved with the signature (mtime, inode, size) of its
+# input files. The cached value is returned as long as the signature
+# did not change, else the function is called and its result saved.
+# Values must be json serializable.
+# ====================================================================
+
+import os
+import json
+import time
+import threading
+
+SNAPSHOT_PATH = '/var/cache/solydxk-system/snapshot.json'
+SNAPSHOT_VERSION = 1
+
+
+# Changes on every boot: use as extra key for hardware dependent data
+def get_boot_id():
+    try:
+        with open('/proc/sys/kernel/random/boot_id', 'r') as f:
+            return f.read().strip()
+    except:
+        return ''
+
+
+class SnapshotCache():
+    def __init__(self, path=SNAPSHOT_PATH):
+        self.path = path
+        self.entries = None
+        self.enabled = True
+        self._lock = threading.RLock()
+
+    # Return signature of the input files: [path, mtime_ns, inode, size]
+    # Missing files are part of the signature as well
+    def signature(self, inputs):
+        sig = []
+        for path in inputs:
+            try:
+                st = os.stat(path)
+                sig.append([path, st.st_mtime_ns, st.st_ino, st.st_size])
+            except OSError:
+                sig.append([path, None, None, None])
+        return sig
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        self.entries = {}
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == SNAPSHOT_VERSION:
+                self.entries = data.get('entries', {})
+        except:
+            pass
+
+    def _save(self):
+        cache_dir = os.path.dirname(self.path)
+        # Normal users (e.g. running solydxk-system-cli) cannot write the system cache
+        if not os.access(cache_dir if os.path.isdir(cache_dir) else os.path.dirname(cache_dir), os.W_OK):
+            return
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            tmp = "%s.tmp" % self.path
+            with open(tmp, 'w') as f:
+                json.dump({'version': SNAPSHOT_VERSION, 'entries': self.entries}, f)
+            os.replace(tmp, self.path)
+        except Exception as detail:
+            # Not being able to save the snapshot only costs time
+            print(("Snapshot cache not saved: %s" % detail))
+
+    # Return the cached value or None when the inputs changed
+    # max_age: seconds after which the entry expires regardless of its inputs
+    def get(self, key, inputs, extra='', max_age=None):
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._load()
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry['signature'] != self.signature(inputs) or entry['extra'] != extra:
+                return None
+            if max_age is not None and time.time() - entry['time'] > max_age:
+                return None
+            return entry['value']
+
+    def set(self, key, inputs, value, extra='', signature=None):
+        if not self.enabled:
+            return
+        if signature is None:
+            signature = self.signature(inputs)
+        with self._lock:
+            self._load()
+            self.entries[key] = {'signature': signature,
+                                 'extra': extra,
+                                 'time': time.time(),
+                                 'value': value}
+            self._save()
+
+    # Return the cached value, or call func and save its result
+    def cached(self, key, inputs, func, extra='', max_age=None):
+        value = self.get(key, inputs, extra, max_age)
+        if value is None:
+            # Take the signature before func runs: changes made
+            # while func is running invalidate the entry
+            signature = self.signature(inputs)
+            value = func()
+            self.set(key, inputs, value, extra, signature)
+        return value
+
+    # Remove one or all entries
+    def invalidate(self, key=None):
+        with self._lock:
+            self._load()
+            if key is None:
+                self.entries.clear()
+            elif key in self.entries:
+                del self.entries[key]
+            else:
+                return
+            self._save()
+
+
+# Shared instance
+snapshot = SnapshotCache()
@@ -9,30 +9,33 @@ from gi.repository import Gtk, GObject
 import os
 import re
 from queue import Queue
-from localize import LocaleInfo, Localize
 from udisks2 import Udisks2
 from logger import Logger
 from treeview import TreeViewHandler
 from combobox import ComboBoxHandler
 # abspath, dirname, join, expanduser, exists, basename
 from os.path import join, abspath, dirname, isdir, exists, basename
-from utils import getoutput, ExecuteThreadedCommands, \
-                  shell_exec, human_size, has_internet_connection, \
+from utils import ExecuteThreadedCommands, ExecuteThreadedFunction, \
+                  shell_exec, run_process, get_process_output, replace_in_file, human_size, has_internet_connection, \
                   get_backports, get_debian_name, comment_line, \
-                  in_virtualbox, get_apt_force, is_running_live, \
+                  in_virtualbox, is_running_live, \
                   get_device_from_uuid, get_label, is_package_installed, \
-                  get_logged_user, get_uuid, compare_package_versions, \
+                  get_logged_user, get_uuid, \
                   get_current_resolution, get_resolutions, is_xfce_running, \
                   is_process_running
 from dialogs import MessageDialog, QuestionDialog, InputDialog, \
                     WarningDialog
-from mirror import MirrorGetSpeed, Mirror, get_mirror_data, get_local_repos
-from encryption import is_encrypted, create_keyfile, write_crypttab, \
-                       connect_block_device
-from endecrypt_partitions import EnDecryptPartitions, ChangePassphrase
-from plymouth import Plymouth, PlymouthSave
-from image import ImageHandler
+# Feature modules (localize, mirror, encryption, endecrypt_partitions,
+# plymouth, image) are imported in the functions that use them
+from shutil import which
 from splash import Splash
+from profiler import profiler
+from snapshot import snapshot, get_boot_id
+from procfs import facts
+from dpkgstatus import DPKG_STATUS
+from holdback import get_held_packages, get_installed_packages, \
+                     hold_packages, unhold_packages
+from cleanup import get_cleanup_packages, get_cleanup_command
 
 # i18n: http://docs.python.org/3/library/gettext.html
 import gettext
@@ -55,24 +58,27 @@ class SolydXKSystemSettings(object):
         
         # Show splash screen while loading
         if not nosplash:
-            b_img = join(self.shareDir, 'images/splash-bgk.png')
-            f_clr = '#243e4b'
-            if is_xfce_running():
-                b_img = join(self.shareDir, 'images/splash-bgx.png')
-                f_clr = '#502800'
-            splash = Splash(title=self.title, font='Roboto Slab 18', font_weight='bold', font_color=f_clr, background_image=b_img)
-            splash.start()
+            with profiler.phase('Splash'):
+                b_img = join(self.shareDir, 'images/splash-bgk.png')
+                f_clr = '#243e4b'
+                if is_xfce_running():
+                    b_img = join(self.shareDir, 'images/splash-bgx.png')
+                    f_clr = '#502800'
+                splash = Splash(title=self.title, font='Roboto Slab 18', font_weight='bold', font_color=f_clr, background_image=b_img)
+                splash.start()
 
         # Init logging
-        self.log_file = "/var/log/solydxk-system.log"
-        self.log = Logger(self.log_file, addLogTime=True, maxSizeKB=5120)
-        self.log.write('=====================================', 'init')
-        self.log.write('>>> Start {} <<<'.format(self.title), 'init')
-        self.log.write('=====================================', 'init')
+        with profiler.phase('Logger'):
+            self.log_file = "/var/log/solydxk-system.log"
+            self.log = Logger(self.log_file, addLogTime=True, maxSizeKB=5120)
+            self.log.write('=====================================', 'init')
+            self.log.write('>>> Start {} <<<'.format(self.title), 'init')
+            self.log.write('=====================================', 'init')
 
         # Load window and widgets
-        self.builder = Gtk.Builder()
-        self.builder.add_from_file(join(self.shareDir, 'solydxk_system.glade'))
+        with profiler.phase('Gtk.Builder.add_from_file'):
+            self.builder = Gtk.Builder()
+            self.builder.add_from_file(join(self.shareDir, 'solydxk_system.glade'))
 
         # Preferences window objects
         go = self.builder.get_object
@@ -82,6 +88,7 @@ class SolydXKSystemSettings(object):
         self.btnSaveBackports = go('btnSaveBackports')
         self.btnSaveMirrors = go('btnSaveMirrors')
         self.btnCheckMirrorSpeed = go("btnCheckMirrorSpeed")
+        self.btnSelectFastestMirrors = go("btnSelectFastestMirrors")
         self.lblRepositories = go('lblRepositories')
         self.tvMirrors = go("tvMirrors")
         self.chkEnableBackports = go("chkEnableBackports")
@@ -127,6 +134,7 @@ class SolydXKSystemSettings(object):
         self.btnSaveBackports.set_label(_("Save backports"))
         self.btnSaveMirrors.set_label(_("Save mirrors"))
         self.btnCheckMirrorSpeed.set_label(_("Check mirrors speed"))
+        self.btnSelectFastestMirrors.set_label(_("Select fastest mirrors"))
         self.btnRemoveHoldback.set_label(_("Remove"))
         self.btnHoldback.set_label(_("Hold back"))
         self.lblRepositories.set_label(_("Repositories"))
@@ -217,27 +225,52 @@ class SolydXKSystemSettings(object):
         self.htmlDir = join(self.shareDir, 'html')
         self.helpFile = join(self.get_language_dir(), 'help.html')
         self.helpddFile = join(self.get_language_dir(), 'helpdd.html')
-        self.udisks2 = Udisks2()
         self.keyfile_path = None
-        self.debian_name = get_debian_name()
         self.encrypt_col_types = ['GdkPixbuf.Pixbuf', 'str', 'str', 'str', 'str', 'str', 'str']
         self.encrypt_list_header = [['', _('Partition'), _('Label'), _('File system'), _('Total size'), _('Free size'), _('Mount point')]]
         self.endecrypt_success = True
         self.encrypt = False
+        self.scanning_backup = False
         self.failed_mount_devices = []
         self.boot_partition = None
         self.changed_devices = []
         self.hardware = []
-        self.plymouth = Plymouth(self.log)
-        self.current_theme = self.plymouth.getCurrentTheme()
-        self.installed_themes = self.plymouth.getInstalledThemes()
-
-        # Collect data and disable tabs when running live: Device Driver, Fstab mounts, Localization, Hold back packages, Cleanup
-        self.live = is_running_live()
-        self.activeMirrors = get_mirror_data(excludeMirrors=self.excludeMirrors)
-        self.deadMirrors = get_mirror_data(getDeadMirrors=True)
-        self.mirrors = self.get_mirrors()
-        self.fill_treeview_mirrors()
+        self.cleanup_packages = []
+        self.locale_info = None
+        self.locale_languages = {}
+        self.activeMirrors = []
+        self.deadMirrors = []
+        self.mirrors = []
+        self.mirrors_refreshed = False
+        self.backports = ['']
+        # Plymouth is initialized when the splash page is first shown
+        self.plymouth = None
+        self.current_theme = ''
+        self.installed_themes = []
+        self.splash_resolutions = []
+        self.current_resolution = None
+        with profiler.phase('Udisks2'):
+            self.udisks2 = Udisks2()
+        with profiler.phase('get_debian_name'):
+            self.debian_name = get_debian_name()
+
+        # Notebook pages are filled the first time they are shown
+        # page number: [data function (threaded), fill function (main thread), placeholder treeview handlers]
+        # Pages without a data function are filled in the main thread (passphrase dialogs)
+        self.loading_text = _("Loading...")
+        self.page_loaders = {0: [self.get_device_driver_data, self.fill_treeview_device_driver, [self.tvDeviceDriverHandler]],
+                             1: [self.get_mirrors_data, self.fill_treeview_mirrors, [self.tvMirrorsHandler]],
+                             2: [self.get_locale_data, self.fill_locale, [self.tvLocaleHandler]],
+                             3: [None, self.fill_treeview_fstab_partitions, [self.tvFstabMountsHandler]],
+                             5: [self.get_holdback_data, self.fill_holdback, [self.tvHoldbackHandler, self.tvAvailableHandler]],
+                             6: [self.get_cleanup_data, self.fill_treeview_cleanup, [self.tvCleanupHandler]],
+                             7: [self.get_splash_data, self.fill_splash, [self.tvSplashHandler]]}
+        self.loaded_pages = []
+        self.page_threads = {}
+
+        # Disable tabs when running live: Device Driver, Fstab mounts, Localization, Hold back packages, Cleanup
+        with profiler.phase('is_running_live'):
+            self.live = is_running_live()
         self.boxEncryptionEnable.set_sensitive(False)
         if self.live:
             self.nbPref.get_nth_page(0).set_visible(False)
@@ -247,43 +280,31 @@ class SolydXKSystemSettings(object):
             self.nbPref.get_nth_page(6).set_visible(False)
             self.nbPref.get_nth_page(7).set_visible(False)
         else:
-            self.backports = get_backports()
-            self.locale_info = LocaleInfo()
-            self.fill_treeview_cleanup()
-            self.fill_treeview_device_driver()
-            self.fill_treeview_holdback()
-            self.fill_treeview_available()
-            self.fill_cmb_timezone_continent()
-            self.fill_treeview_locale()
+            with profiler.phase('get_backports'):
+                self.backports = get_backports()
             if self.backports[0]:
                 self.chkEnableBackports.set_active(True)
             else:
                 self.chkBackportsDeviceDriver.set_sensitive(False)
-            if not self.installed_themes:
+            if which('plymouth-set-default-theme') is None:
                 self.nbPref.get_nth_page(7).set_visible(False)
-            else:
-                self.fill_treeview_installed_splash()
-                self.fill_cmb_splash_resolution()
-                if self.current_theme:
-                    self.chkEnableSplash.set_active(True)
-                else:
-                    self.chkEnableSplash.set_active(False)
-                    self.swSplash.set_sensitive(False)
 
         # Disable this for later implementation
         self.btnCreateKeyfile.set_visible(False)
 
         # Connect the signals and show the window
         self.builder.connect_signals(self)
-        self.window.show()
-        
-        # In case of encrypted partitions, we can only list partitions when the splash is done
-        if not self.live:
-            self.fill_treeview_fstab_partitions()
-            
+        self.nbPref.connect('switch-page', self.on_nbPref_switch_page)
+        with profiler.phase('window.show'):
+            self.window.show()
+
+        # Only load the page that is shown
+        self.load_page(self.nbPref.get_current_page())
+
         # Destroy splash screen
         if not nosplash:
-            splash.destroy()
+            with profiler.phase('Splash.destroy'):
+                splash.destroy()
 
     # ===============================================
     # Main window functions
@@ -292,6 +313,9 @@ class SolydXKSystemSettings(object):
     def on_btnCheckMirrorSpeed_clicked(self, widget):
         self.check_mirror_speed()
 
+    def on_btnSelectFastestMirrors_clicked(self, widget):
+        self.select_fastest_mirrors()
+
     def on_btnSaveBackports_clicked(self, widget):
         self.save_backports()
 
@@ -386,6 +410,48 @@ class SolydXKSystemSettings(object):
         
     def on_tvSplash_selection_changed(self, widget):
         self.show_splash_preview()
+
+    def on_nbPref_switch_page(self, notebook, page, page_num):
+        self.load_page(page_num)
+
+    # ===============================================
+    # Notebook page loading functions
+    # ===============================================
+
+    def load_page(self, page_num):
+        if page_num in self.loaded_pages or page_num not in self.page_loaders:
+            return
+        self.loaded_pages.append(page_num)
+        data_function, fill_function, handlers = self.page_loaders[page_num]
+
+        # Show a placeholder until the data is there
+        self.nbPref.get_nth_page(page_num).set_sensitive(False)
+        for handler in handlers:
+            handler.fillTreeview([[self.loading_text]], ['str'], -1, 400, False)
+
+        if data_function is None:
+            # Fill when idle: gives Gtk the chance to draw the placeholder first
+            GObject.idle_add(self.finish_page, page_num)
+        else:
+            t = ExecuteThreadedFunction(profiler.profile(data_function))
+            self.page_threads[page_num] = t
+            t.daemon = True
+            t.start()
+            GObject.timeout_add(100, self.check_page_thread, page_num)
+
+    def check_page_thread(self, page_num):
+        if self.page_threads[page_num].is_alive():
+            return True
+        del self.page_threads[page_num]
+        self.finish_page(page_num)
+        return False
+
+    def finish_page(self, page_num):
+        fill_function = self.page_loaders[page_num][1]
+        with profiler.phase(fill_function.__name__):
+            fill_function()
+        self.nbPref.get_nth_page(page_num).set_sensitive(True)
+        return False
         
     # ===============================================
     # Fstab mount functions
@@ -411,6 +477,7 @@ class SolydXKSystemSettings(object):
         self.tvFstabMountsHandler.fillTreeview(contentList=fs_partitions, columnTypesList=columnTypes, firstItemIsColName=True, fontSize=12000)
         
     def save_fstab_mounts(self):
+        from encryption import create_keyfile, write_crypttab
         changed = False
         fix_virtualbox = False
         fstab_path = '/etc/fstab'
@@ -457,11 +524,11 @@ class SolydXKSystemSettings(object):
                     
                     if exists(mount):
                         # Mount the device
-                        shell_exec('mount {} {}'.format(device, mount))
+                        run_process(['mount', device, mount])
                         usr = get_logged_user()
                         if usr:
                             # Make current user owner of the mount
-                            shell_exec('chown {0}:{0} {1}'.format(usr, mount))
+                            run_process(['chown', '{0}:{0}'.format(usr), mount])
                     
                     # Create new line for fstab
                     uuid = 'UUID={}'.format(uuid) if uuid and not encrypted else device
@@ -536,8 +603,8 @@ class SolydXKSystemSettings(object):
                 grubcfg_path = '/boot/grub/grub.cfg'
                 if exists(grub_path) and exists(grubcfg_path):
                     self.log.write("Fix Grub in VirtualBox: %s and %s" % (grub_path, grubcfg_path), 'save_fstab_mounts', 'info')
-                    shell_exec("sed -i 's/ *splash *//g' %s" % grub_path)
-                    shell_exec("sed -i 's/ *splash *//g' %s" % grubcfg_path)
+                    replace_in_file(' *splash *', '', grub_path)
+                    replace_in_file(' *splash *', '', grubcfg_path)
 
         if changed:
             # Save fstab
@@ -664,7 +731,7 @@ class SolydXKSystemSettings(object):
         model = self.tvDeviceDriver.get_model()
         itr = model.get_iter(path)
         pae_selected = 'pae' in model[itr][2].lower()
-        pae_booted = 'pae' in getoutput('uname -r')[0]
+        pae_booted = 'pae' in os.uname().release
 
         if pae_selected and pae_booted and not toggleValue:
             title = _("Remove kernel")
@@ -691,24 +758,29 @@ class SolydXKSystemSettings(object):
                 # Save the information
                 self.hardware.append([installed, join(self.shareDir, 'images/{}.png'.format(driver_name)), matchObj.group(1), matchObj.group(4), matchObj.group(2), matchObj.group(3)])
                 
-    def fill_treeview_device_driver(self):
-        # Fill a list with supported hardware
-        self.hardware = []
-        self.hardware.append([_("Install"), '', _("Device"), 'driver', 'manid', 'deviceid'])
-        
+    def get_device_driver_data(self):
         # Use test data (check /usr/lib/solydxk/scripts/ddm-*.sh)
         tst = ''
         if self.test_devices:
             tst = '-t -f'
-        
-        # Fill with supported hardware
-        self.fill_hw('amd', getoutput('ddm -i amd -s {}'.format(tst)))
-        self.fill_hw('nvidia', getoutput('ddm -i nvidia -s {}'.format(tst)))
-        self.fill_hw('broadcom', getoutput('ddm -i broadcom -s {}'.format(tst)))
-        self.fill_hw('pae', getoutput('ddm -i pae -s {}'.format(tst)))
+
+        def get_hardware():
+            # Fill with supported hardware
+            self.hardware = []
+            for driver_name in ['amd', 'nvidia', 'broadcom', 'pae']:
+                self.fill_hw(driver_name, get_process_output(['ddm', '-i', driver_name, '-s'] + tst.split()))
+            return self.hardware
+
+        # Hardware only changes between boots, installed drivers with dpkg
+        hardware = snapshot.cached('hardware', [DPKG_STATUS], get_hardware, extra="{} {}".format(get_boot_id(), tst))
+
+        # Fill a list with supported hardware
+        self.hardware = [[_("Install"), '', _("Device"), 'driver', 'manid', 'deviceid']] + hardware
         
         print((self.hardware))
 
+    def fill_treeview_device_driver(self):
+
         # columns: checkbox, image (logo), device, driver
         columnTypes = ['bool', 'GdkPixbuf.Pixbuf', 'str']
 
@@ -745,7 +817,11 @@ class SolydXKSystemSettings(object):
             self.my_partitions.extend(my_swap)
 
     def endecrypt(self):
+        from endecrypt_partitions import EnDecryptPartitions
         name = 'endecrypt'
+        # The backup scan keeps the GUI running: ignore clicks until it is done
+        if self.scanning_backup or name in self.threads:
+            return
         action = self.btnDecrypt.get_label()
         
         # Check passphrase first
@@ -832,6 +908,7 @@ class SolydXKSystemSettings(object):
             GObject.timeout_add(5, self.check_thread, name)
 
     def change_passphrase(self):
+        from endecrypt_partitions import ChangePassphrase
         if len(self.my_partitions) == 0:
             return
         
@@ -861,12 +938,10 @@ class SolydXKSystemSettings(object):
         GObject.timeout_add(250, self.check_thread, name)
 
     def is_active_swap_partition(self, device):
-        out = getoutput('grep "{}" /proc/swaps'.format(device))[0]
-        if out:
-            return True
-        return False
+        return facts.is_active_swap(device)
     
     def fill_partitions(self, check_encryptable=True, include_flash=False):
+        from encryption import is_encrypted
         # Exclude these device paths
         exclude_devices = ['/dev/sr0', '/dev/sr1', '/dev/cdrom', '/dev/dvd', '/dev/fd0', '/dev/mmcblk0boot0', '/dev/mmcblk0boot1', '/dev/mmcblk0rpmb']
 
@@ -984,6 +1059,35 @@ class SolydXKSystemSettings(object):
             self.imgPassphraseCheck.set_from_stock(Gtk.STOCK_OK, Gtk.IconSize.BUTTON)
             self.my_passphrase = pf1
 
+    # Scan the files to backup in a thread while keeping the GUI responsive
+    # Returns None when the scan failed
+    def get_backup_stats(self, mount_point):
+        from treestats import get_tree_stats, BACKUP_EXCLUDES
+
+        def scan():
+            try:
+                return get_tree_stats(mount_point, BACKUP_EXCLUDES)
+            except Exception as detail:
+                print(("ERROR: could not scan %s: %s" % (mount_point, detail)))
+                return None
+
+        queue = Queue()
+        t = ExecuteThreadedFunction(scan, queue)
+        t.daemon = True
+        self.scanning_backup = True
+        sensitive = self.boxEncryptionEnable.get_sensitive()
+        self.boxEncryptionEnable.set_sensitive(False)
+        try:
+            t.start()
+            while t.is_alive():
+                while Gtk.events_pending():
+                    Gtk.main_iteration()
+                t.join(0.05)
+        finally:
+            self.boxEncryptionEnable.set_sensitive(sensitive)
+            self.scanning_backup = False
+        return None if queue.empty() else queue.get_nowait()
+
     def get_backup_partition(self):
         # Set a safe margin to have extra available on the backup partition
         safe_margin_kb = 10240
@@ -994,10 +1098,16 @@ class SolydXKSystemSettings(object):
         bak_partition = ''
         used_size = 0
 
-        # Get the combined used size of the selected partitions, except the swap partition
+        # Get the combined size of the files to backup, except the swap partition
+        # Mounted partitions are scanned: the file count is used for the backup progress
         for my_p in self.my_partitions:
             if my_p['fs_type'] != 'swap':
-                used_size += my_p['used_size']
+                stats = self.get_backup_stats(my_p['mount_point']) if my_p['mount_point'] else None
+                if stats is not None:
+                    my_p['backup_files'] = stats['files']
+                    used_size += stats['allocated_bytes'] / 1024
+                else:
+                    used_size += my_p['used_size']
                 
         # Add the safe margin
         used_size += safe_margin_kb
@@ -1080,6 +1190,7 @@ class SolydXKSystemSettings(object):
         return cont
         
     def get_partition_configuration_info(self, partition, partitions, check_encryptable):
+        from encryption import connect_block_device
         fstab_paths = ['/etc/fstab']
 
         # Search for fstab file if you're in a live session
@@ -1220,6 +1331,7 @@ class SolydXKSystemSettings(object):
         return ('', '', '', '', '', '')
 
     def write_partition_configuration(self, keyfile_only=False):
+        from encryption import create_keyfile, write_crypttab
         keyfile_path = ''
         crypttab_keyfile_path = None
         encrypt_info = []
@@ -1287,8 +1399,7 @@ class SolydXKSystemSettings(object):
                 # Remove device from crypttab
                 bn = basename(p['device'])
                 self.log.write("Remove %s from %s" % (bn, p['crypttab_path']), 'write_partition_configuration', 'info')
-                cmd = "sed -i '/^%s /d' %s" % (bn, p['crypttab_path'])
-                shell_exec(cmd)
+                replace_in_file('^%s .*\n?' % re.escape(bn), '', p['crypttab_path'])
                 
                 # Remove any references of a key file when the key file is on this decrypted and unsafe partition
                 lukskey = join(p['mount_point'], '.lukskey')
@@ -1296,8 +1407,7 @@ class SolydXKSystemSettings(object):
                     self.log.write("Remove %s from unencrypted and unsafe %s" % (lukskey, p['device']), 'write_partition_configuration', 'info')
                     os.remove(lukskey)
                 self.log.write("Remove %s references from %s" % (lukskey, p['crypttab_path']), 'write_partition_configuration', 'info')
-                cmd = "sed -i 's#%s#none#g' %s" % (lukskey, p['crypttab_path'])
-                shell_exec(cmd)
+                replace_in_file(re.escape(lukskey), 'none', p['crypttab_path'])
             
         # Write the new content to the fstab files, the key files and crypttab files
         saved_fstab = ''
@@ -1306,7 +1416,7 @@ class SolydXKSystemSettings(object):
                 saved_fstab = enc_dict['fstab_path']
                 # Logging
                 self.log.write("%s blkid %s" % ('=' * 10, '=' * 10), 'write_partition_configuration', 'info')
-                self.log.write('\n'.join(getoutput("blkid")), 'write_partition_configuration', 'info')
+                self.log.write('\n'.join(get_process_output(['blkid'])), 'write_partition_configuration', 'info')
                 self.log.write("%s %s %s" % ('=' * 10, enc_dict['fstab_path'], '=' * 10), 'write_partition_configuration', 'info')
                 self.log.write(saved_fstabs[enc_dict['fstab_path']], 'write_partition_configuration', 'info')
                 self.log.write('=' * 25, 'write_partition_configuration', 'info')
@@ -1357,8 +1467,8 @@ class SolydXKSystemSettings(object):
             #print((">>> grub_path=%s, grubcfg_path=%s" % (grub_path, grubcfg_path)))
             if grub_path and grubcfg_path:
                 self.log.write("Fix Grub in VirtualBox: %s and %s" % (grub_path, grubcfg_path), 'write_partition_configuration', 'info')
-                shell_exec("sed -i 's/ *splash *//g' %s" % grub_path)
-                shell_exec("sed -i 's/ *splash *//g' %s" % grubcfg_path)
+                replace_in_file(' *splash *', '', grub_path)
+                replace_in_file(' *splash *', '', grubcfg_path)
 
         if not keyfile_only:
             pf = ''
@@ -1379,6 +1489,7 @@ class SolydXKSystemSettings(object):
     # ===============================================
 
     def save_locale(self):
+        from localize import Localize
         # Collect information
         if has_internet_connection():
             # Check if FF and TB are running
@@ -1408,12 +1519,27 @@ class SolydXKSystemSettings(object):
                     "Please repeat this process when you established an internet connection.")
             WarningDialog(self.btnSaveLocale.get_label(), msg)
 
+    def get_locale_data(self):
+        from localize import LocaleInfo
+        with profiler.phase('LocaleInfo'):
+            locale_info = LocaleInfo()
+        self.locale_languages = locale_info.get_readable_languages()
+        self.locale_info = locale_info
+
+    def fill_locale(self):
+        if self.locale_info is None:
+            return
+        self.fill_cmb_timezone_continent()
+        self.fill_treeview_locale()
+
     def fill_treeview_locale(self):
         self.locales = [[self.installed_title, self.locale_title, self.language_title, self.default_title]]
         select_row = 0
         i = 0
         for loc in self.locale_info.locales:
-            lan = self.locale_info.get_readable_language(loc)
+            lan = self.locale_languages.get(loc)
+            if lan is None:
+                lan = self.locale_info.get_readable_language(loc)
             select = False
             default = False
             if loc in self.locale_info.available_locales:
@@ -1467,40 +1593,33 @@ class SolydXKSystemSettings(object):
     # Hold back functions
     # ===============================================
 
+    def get_holdback_data(self):
+        self.holdback = [[False, pck] for pck in get_held_packages()]
+        self.available = [[False, pck] for pck in get_installed_packages()]
+
+    def fill_holdback(self):
+        self.fill_treeview_holdback()
+        self.fill_treeview_available()
+
     def fill_treeview_holdback(self):
-        self.holdback = []
-        lst = getoutput("env LANG=C dpkg --get-selections | grep hold$ | awk '{print $1}'")
-        for pck in lst:
-            if pck != '':
-                self.holdback.append([False, pck.strip()])
         # Fill treeview
         col_type_lst = ['bool', 'str']
         self.tvHoldbackHandler.fillTreeview(self.holdback, col_type_lst, 0, 400, False)
 
     def fill_treeview_available(self):
-        self.available = []
-        lst = getoutput("env LANG=C dpkg --get-selections | grep install$ | awk '{print $1}'")
-        for pck in lst:
-            self.available.append([False, pck.strip()])
         # Fill treeview
         col_type_lst = ['bool', 'str']
         self.tvAvailableHandler.fillTreeview(self.available, col_type_lst, 0, 400, False)
 
     def add_holdback(self):
-        packages = self.tvAvailableHandler.getToggledValues()
-        for pck in packages:
-            self.log.write("Hold back package: %s" % pck, 'add_holdback')
-            shell_exec("echo '%s hold' | dpkg --set-selections" % pck)
-        self.fill_treeview_holdback()
-        self.fill_treeview_available()
+        hold_packages(self.tvAvailableHandler.getToggledValues(), self.log)
+        self.get_holdback_data()
+        self.fill_holdback()
 
     def remove_holdback(self):
-        packages = self.tvHoldbackHandler.getToggledValues()
-        for pck in packages:
-            self.log.write("Remove hold back from: %s" % pck, 'remove_holdback')
-            shell_exec("echo '%s install' | dpkg --set-selections" % pck)
-        self.fill_treeview_holdback()
-        self.fill_treeview_available()
+        unhold_packages(self.tvHoldbackHandler.getToggledValues(), self.log)
+        self.get_holdback_data()
+        self.fill_holdback()
 
     # ===============================================
     # Mirror functions
@@ -1577,9 +1696,51 @@ class SolydXKSystemSettings(object):
         else:
             self.chkBackportsDeviceDriver.set_sensitive(False)
 
+    # The local mirrors lists are used right away: the server is checked
+    # in the background when the page is filled (see refresh_mirrors)
+    def get_mirrors_data(self, download=True):
+        from mirror import get_mirror_data, get_mirrors_list_path, refresh_mirrors_lists
+        # Only wait for the server when there is no local copy yet
+        if download and not (exists(get_mirrors_list_path()) and exists(get_mirrors_list_path(True))):
+            with profiler.phase('refresh_mirrors_lists'):
+                refresh_mirrors_lists()
+            self.mirrors_refreshed = True
+        with profiler.phase('get_mirror_data (active)'):
+            self.activeMirrors = get_mirror_data(excludeMirrors=self.excludeMirrors, refresh=False)
+        with profiler.phase('get_mirror_data (dead)'):
+            self.deadMirrors = get_mirror_data(getDeadMirrors=True, refresh=False)
+        with profiler.phase('get_mirrors'):
+            self.mirrors = self.get_mirrors()
+
+    # Download the mirrors lists if they changed on the server
+    # and fill the tree view again when they did
+    def refresh_mirrors(self):
+        from mirror import refresh_mirrors_lists
+        self.mirrors_refreshed = True
+        queue = Queue()
+        t = ExecuteThreadedFunction(refresh_mirrors_lists, queue)
+        t.daemon = True
+        t.start()
+        GObject.timeout_add(250, self.check_mirrors_refresh, t, queue)
+
+    def check_mirrors_refresh(self, thread, queue):
+        if thread.is_alive():
+            return True
+        changed = not queue.empty() and queue.get()
+        # Do not replace the tree view while the mirrors speed is checked
+        if changed and 'mirrorspeed' not in self.threads:
+            self.log.write("Mirrors list changed on the server", 'check_mirrors_refresh', 'info')
+            self.get_mirrors_data(False)
+            self.fill_treeview_mirrors()
+        return False
+
     def fill_treeview_mirrors(self):
+        if not self.mirrors_refreshed:
+            self.refresh_mirrors()
         # Fill mirror list
         if len(self.mirrors) > 1:
+            # The page was hidden when there was no mirrors list yet
+            self.nbPref.get_nth_page(1).set_visible(True)
             # Fill treeview
             col_type_lst = ['bool', 'str', 'str', 'str', 'str']
             self.tvMirrorsHandler.fillTreeview(self.mirrors, col_type_lst, 0, 400, True)
@@ -1633,32 +1794,62 @@ class SolydXKSystemSettings(object):
                 itr = model.iter_next(itr)
 
         if replaceRepos:
-            m = Mirror()
-            ret = m.save(replaceRepos, self.excludeMirrors)
-            if ret == '':
-                if has_internet_connection():
-                    # Run update in a thread and show progress
-                    name = 'updatebp'
-                    self.set_buttons_state(False)
-                    t = ExecuteThreadedCommands("apt-get update", self.queue)
-                    self.threads[name] = t
-                    t.daemon = True
-                    t.start()
-                    self.queue.join()
-                    GObject.timeout_add(250, self.check_thread, name)
-                else:
-                    msg = _("Could not update the apt cache.\n"
-                            "Please update the apt cache manually with: apt-get update")
-                    WarningDialog(self.btnSaveMirrors.get_label(), msg)
-            else:
-                self.log.write(ret, 'save_mirrors')
-
+            self.apply_mirrors(replaceRepos, self.btnSaveMirrors.get_label())
         else:
             msg = _("There are no repositories to save.")
             MessageDialog(self.lblRepositories.get_label(), msg)
 
+    # Save the [current url, new url] list in sources.list and update the apt cache
+    def apply_mirrors(self, replaceRepos, title):
+        from mirror import Mirror
+        m = Mirror()
+        ret = m.save(replaceRepos, self.excludeMirrors)
+        if ret == '':
+            if has_internet_connection():
+                # Run update in a thread and show progress
+                name = 'updatebp'
+                self.set_buttons_state(False)
+                t = ExecuteThreadedCommands("apt-get update", self.queue)
+                self.threads[name] = t
+                t.daemon = True
+                t.start()
+                self.queue.join()
+                GObject.timeout_add(250, self.check_thread, name)
+            else:
+                msg = _("Could not update the apt cache.\n"
+                        "Please update the apt cache manually with: apt-get update")
+                WarningDialog(title, msg)
+        else:
+            self.log.write(ret, 'save_mirrors')
+
+    # Use the mirrors that performed best in the saved speed tests
+    def select_fastest_mirrors(self):
+        from mirror import get_replace_repos
+        from mirrorhistory import get_fastest_mirrors
+        title = self.btnSelectFastestMirrors.get_label()
+        urls = get_fastest_mirrors(self.activeMirrors)
+        if not urls:
+            msg = _("There are no speed test results yet.\n"
+                    "Please check the mirrors speed first.")
+            MessageDialog(title, msg)
+            return
+        self.log.write("Fastest mirrors: %s" % ', '.join(urls), 'select_fastest_mirrors')
+        replaceRepos = get_replace_repos(urls, self.activeMirrors, self.excludeMirrors)
+        if replaceRepos:
+            self.apply_mirrors(replaceRepos, title)
+        else:
+            msg = _("You are already using the fastest mirrors.")
+            MessageDialog(title, msg)
+
     def get_mirrors(self):
+        from mirrorhistory import mirror_history, get_mirror_key
         mirrors = [[_("Current"), _("Country"), _("Repository"), _("URL"), _("Speed")]]
+        # Show the average speed of earlier tests until the speed is checked again
+        try:
+            rankings = {r['mirror']: r for r in mirror_history.get_rankings()}
+        except Exception as detail:
+            self.log.write("Cannot read the mirror history: %s" % detail, 'get_mirrors', 'warning')
+            rankings = {}
         for mirror in self.activeMirrors:
             if mirror:
                 self.log.write("Mirror data: %s" % ' '.join(mirror), 'get_mirrors')
@@ -1666,27 +1857,19 @@ class SolydXKSystemSettings(object):
                 # Save current debian repo in a variable
                 if blnCurrent and 'debian.org' in mirror[2]:
                     self.current_debian_repo = mirror[2]
-                mirrors.append([blnCurrent, mirror[0], mirror[1], mirror[2], ''])
+                speed = ''
+                ranking = rankings.get(get_mirror_key(mirror[2]))
+                if ranking and ranking['score'] > 0:
+                    speed = "~%d kb/s" % ranking['speed']
+                mirrors.append([blnCurrent, mirror[0], mirror[1], mirror[2], speed])
         return mirrors
 
     def is_url_in_sources(self, url):
-        pre_str = ''
-        if not '://' in url:
-            pre_str = '://'
-        url = "%s%s" % (pre_str, url)
-        blnRet = False
-
-        for repo in get_local_repos():
-            if url in repo:
-                blnRet = True
-                for excl in self.excludeMirrors:
-                    if excl in repo:
-                        blnRet = False
-                        break
-                break
-        return blnRet
+        from mirror import is_url_in_sources
+        return is_url_in_sources(url, self.excludeMirrors)
 
     def check_mirror_speed(self):
+        from mirror import MirrorGetSpeed
         name = 'mirrorspeed'
         self.set_buttons_state(False)
         t = MirrorGetSpeed(self.mirrors, self.queue)
@@ -1732,77 +1915,15 @@ class SolydXKSystemSettings(object):
     # Cleanup functions
     # ===============================================
     
+    def get_cleanup_data(self):
+        self.cleanup_packages = get_cleanup_packages()
+
     def fill_treeview_cleanup(self):
-        pck_data = []
-        # Get list of packages from autoremove and deborphan
-        for pck in self.get_autoremove_packages():
-            pck_data.append([True, pck])
-        for pck in self.get_deborphan_packages():
-            pck_lst = [False, pck]
-            if pck_lst not in pck_data:
-                pck_data.append(pck_lst)
-        for pck in self.get_old_kernel_packages():
-            pck_lst = [False, pck]
-            if pck_lst not in pck_data:
-                pck_data.append([False, pck_lst])
         # Fill treeview
         col_type_lst = ['bool', 'str']
-        self.tvCleanupHandler.fillTreeview(pck_data, col_type_lst, 0, 400, False)
-        
-    def get_autoremove_packages(self):
-        ret = []
-        # Create approriate command
-        # Use env LANG=C to ensure the output of dist-upgrade is always en_US
-        cmd = "env LANG=C sudo apt-get autoremove --assume-no | grep -E '^ '"
-        lst = getoutput(cmd)
-
-        # Loop through each line and fill the package lists
-        for line in lst:
-            packages = line.split()
-            for package in packages:
-                package = package.strip().replace('*', '')
-                if package and package not in ret:
-                    ret.append(package)
-        return ret
-        
-    def get_deborphan_packages(self):
-        orphans = getoutput('deborphan')
-        if len(orphans) == 1 and orphans[0] == '':
-            orphans = []
-        return orphans
-        
-    def get_old_kernel_packages(self):
-        kernel_packages = []
-        # Check booted kernel version
-        regexp = '[0-9][0-9\.\-]+[0-9]'
-        cur_version = getoutput("uname -r | egrep -o '%s'" % regexp)[0]
-        #cur_version = getoutput("ls -al / | grep -e '\svmlinuz\s' | egrep -o '%s'" % regexp)[0]
-        # Get kernel packages not with cur_version
-        packages = getoutput("dpkg-query -f '${binary:Package}\n' -W | grep -E 'linux-image-[0-9]|linux-headers-[0-9]' | grep -v '%s' | egrep -v '[a-z]-486|[a-z]-686|[a-z]-586'" % cur_version)
-        # Check version number of found kernel packages
-        for pck in packages:
-            matchObj = re.search(regexp, pck)
-            if matchObj:
-                if compare_package_versions(matchObj.group(0), cur_version) == 'smaller':
-                    # Add to the kernel_packages list
-                    kernel_packages.append(pck)
-                            
-        if kernel_packages:
-            # Add kbuild packages
-            del_string = '.0'
-            try:
-                kbuild_version = cur_version[:cur_version.index('-')]
-            except:
-                kbuild_version = cur_version
-            while kbuild_version.endswith(del_string):
-                kbuild_version = kbuild_version[:-len(del_string)]
-            kbuild_packages = getoutput("dpkg-query -f '${binary:Package}\n' -W | grep linux-kbuild | grep -v '%s'" % kbuild_version)
-            if kbuild_packages[0]:
-                kernel_packages.append(kbuild_packages)
-        return kernel_packages
-        
+        self.tvCleanupHandler.fillTreeview(self.cleanup_packages, col_type_lst, 0, 400, False)
+
     def remove_unneeded_packages(self):
-        force = get_apt_force()
         packages = []
         # Build list with selected packages
         model = self.tvCleanup.get_model()
@@ -1815,7 +1936,7 @@ class SolydXKSystemSettings(object):
             # Run cleanup in a thread and show progress
             name = 'cleanup'
             self.set_buttons_state(False)
-            t = ExecuteThreadedCommands("apt-get {0} clean; apt-get purge {0} {1}".format(force, ' '.join(packages)), self.queue)
+            t = ExecuteThreadedCommands(get_cleanup_command(packages), self.queue)
             self.threads[name] = t
             t.daemon = True
             t.start()
@@ -1826,6 +1947,41 @@ class SolydXKSystemSettings(object):
     # Plymouth splash functions
     # ===============================================
 
+    def get_splash_data(self):
+        def get_splash():
+            if self.plymouth is None:
+                from plymouth import Plymouth
+                with profiler.phase('Plymouth'):
+                    self.plymouth = Plymouth(self.log)
+            current_resolution = self.plymouth.getCurrentResolution()
+            if current_resolution is None:
+                current_resolution = get_current_resolution()
+            return {'current_theme': self.plymouth.getCurrentTheme(),
+                    'current_resolution': current_resolution,
+                    'splash_resolutions': get_resolutions(use_vesa=True),
+                    'installed_themes': self.plymouth.getInstalledThemes()}
+
+        # Resolutions depend on the hardware: refresh after each boot
+        inputs = ['/usr/share/plymouth/themes', '/etc/plymouth/plymouthd.conf', '/etc/default/grub',
+                  '/boot/grub/grub.cfg', '/etc/initramfs-tools/modules']
+        splash = snapshot.cached('splash', inputs, get_splash, extra=get_boot_id())
+        self.current_theme = splash['current_theme']
+        self.current_resolution = splash['current_resolution']
+        self.splash_resolutions = splash['splash_resolutions']
+        self.installed_themes = splash['installed_themes']
+
+    def fill_splash(self):
+        if not self.installed_themes:
+            self.nbPref.get_nth_page(7).set_visible(False)
+            return
+        self.fill_treeview_installed_splash()
+        self.fill_cmb_splash_resolution()
+        if self.current_theme:
+            self.chkEnableSplash.set_active(True)
+        else:
+            self.chkEnableSplash.set_active(False)
+            self.swSplash.set_sensitive(False)
+
     def fill_treeview_installed_splash(self):
         themes = []
         cursor = 0
@@ -1845,10 +2001,8 @@ class SolydXKSystemSettings(object):
         
     def fill_cmb_splash_resolution(self):
         sel_res = '1024x768'
-        cur_res = self.plymouth.getCurrentResolution()
-        if cur_res is None:
-            cur_res = get_current_resolution()
-        resolutions = get_resolutions(use_vesa=True)
+        cur_res = self.current_resolution
+        resolutions = self.splash_resolutions
         for res in resolutions:
             try:
                 if int(res.split('x')[0]) >= int(cur_res.split('x')[0]):
@@ -1878,6 +2032,9 @@ class SolydXKSystemSettings(object):
             rowCnt += 1
             
     def show_splash_preview(self):
+        from image import ImageHandler
+        if not self.installed_themes:
+            return
         plymouth_theme_name = self.tvSplashHandler.getSelectedValue(1)
         preview_path = '{}/images/splash-{}.png'.format(self.shareDir, plymouth_theme_name)
         if not exists(preview_path):
@@ -1897,6 +2054,7 @@ class SolydXKSystemSettings(object):
 
             
     def save_splash(self):
+        from plymouth import PlymouthSave
         selected_theme = None
         resolution = None
         if self.chkEnableSplash.get_active():
@@ -1954,9 +2112,9 @@ class SolydXKSystemSettings(object):
                             self.changed_devices.append(ret[3]['device'].replace('/mapper', ''))
             return True
 
-        # Thread is done
+        # Thread is done: handle everything still in the queue
         print(("Thread %s ended" % name))
-        if not self.queue.empty():
+        while not self.queue.empty():
             ret = self.queue.get()
             self.queue.task_done()
             if ret:
@@ -1990,6 +2148,7 @@ class SolydXKSystemSettings(object):
             self.update_progress(0)
             self.set_buttons_state(True)
         elif name == 'cleanup':
+            self.get_cleanup_data()
             self.fill_treeview_cleanup()
             self.update_progress(0)
             self.set_buttons_state(True)
@@ -2015,7 +2174,7 @@ class SolydXKSystemSettings(object):
                                               "Do you want to restart your computer?"))
                 if answer:
                     # Reboot
-                    shell_exec('reboot')
+                    run_process(['reboot'])
 
             # Refresh
             self.update_progress(0)
@@ -2035,6 +2194,7 @@ class SolydXKSystemSettings(object):
 
     def set_buttons_state(self, enable):
         self.btnCheckMirrorSpeed.set_sensitive(enable)
+        self.btnSelectFastestMirrors.set_sensitive(enable)
         self.btnSaveBackports.set_sensitive(enable)
         self.btnSaveMirrors.set_sensitive(enable)
         self.btnEncrypt.set_sensitive(enable)
@@ -2101,10 +2261,10 @@ class SolydXKSystemSettings(object):
         
     def temp_unmount_all(self):
         # Unmount temp mounts and remove
-        tmp_mounts = getoutput("grep '%s' /proc/mounts | awk '{print $1,$2}'" % TMPMOUNT)
+        tmp_mounts = [[m['device'], m['mount_point']] for m in facts.get_mounts() if TMPMOUNT in m['mount_point']]
         for tmp_mount in tmp_mounts:
             try:
-                device, mount = tmp_mount.split()
+                device, mount = tmp_mount
                 try:
                     if self.udisks2.unmount_device(device):
                         self.log.write("Remove temporary mount point: %s" % mount, 'temp_unmount_all', 'info')
@@ -0,0 +1,123 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# Record every process started through utils to a JSON-lines file
+# ====================================================================
+# Enable with solydxk-system --trace [PATH]
+# or with the environment variable SOLYDXK_SYSTEM_TRACE=PATH
+#
+# from tracer import tracer
+# tracer.enable('/tmp/trace.jsonl')
+# tracer.watch(utils.process_hooks)
+#
+# Summarize a trace file grouped by the calling function:
+# python3 tracer.py /tmp/trace.jsonl
+# python3 tracer.py --group-by command /tmp/trace.jsonl
+# ====================================================================
+
+import os
+import sys
+import json
+import threading
+
+TRACE_ENV = 'SOLYDXK_SYSTEM_TRACE'
+TRACE_PATH = '/var/log/solydxk-system-trace.jsonl'
+
+
+class ProcessTracer():
+    def __init__(self):
+        self.enabled = False
+        self.path = ''
+        self._file = None
+        self._lock = threading.Lock()
+
+    def enable(self, path=TRACE_PATH):
+        try:
+            # Line buffered: the trace is complete even when the program crashes
+            self._file = open(path, 'a', buffering=1)
+            self.path = path
+            self.enabled = True
+        except Exception as detail:
+            print(("ERROR: could not open trace file %s: %s" % (path, detail)))
+
+    # Enable when the environment variable is set
+    def enable_from_env(self):
+        path = os.environ.get(TRACE_ENV, '')
+        if path and not self.enabled:
+            self.enable(path)
+
+    # Record processes that are reported to the given hook list (utils.process_hooks)
+    def watch(self, hooks):
+        if self.enabled and self.record not in hooks:
+            hooks.append(self.record)
+
+    def record(self, process_info):
+        line = json.dumps(process_info)
+        with self._lock:
+            try:
+                self._file.write(line + '\n')
+            except Exception as detail:
+                print(("ERROR: could not write trace: %s" % detail))
+
+
+# Shared instance
+tracer = ProcessTracer()
+
+
+def read_trace(path):
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # Last line of a trace that was being written
+                pass
+    return records
+
+
+# Return [[key, processes, seconds, output bytes, failures]] sorted by seconds
+def summarize(records, group_by='caller'):
+    groups = {}
+    for record in records:
+        key = record.get(group_by) or '(unknown)'
+        group = groups.setdefault(key, [key, 0, 0.0, 0, 0])
+        group[1] += 1
+        group[2] += record.get('seconds') or 0
+        group[3] += record.get('output_size') or 0
+        if record.get('returncode') not in (0, None):
+            group[4] += 1
+    return sorted(groups.values(), key=lambda g: (-g[2], -g[1]))
+
+
+def get_text_summary(records, group_by='caller', limit=None):
+    summary = summarize(records, group_by)
+    total_seconds = sum(g[2] for g in summary)
+    # Processes that were only started (shell_exec_popen) have no seconds
+    untimed = len([r for r in records if r.get('seconds') is None])
+    lines = ["%d processes (%d not timed), %.3f s" % (len(records), untimed, total_seconds),
+             '',
+             "%-50s %7s %9s %10s %6s" % (group_by.capitalize(), 'Procs', 'Seconds', 'Output', 'Failed'),
+             '-' * 86]
+    for key, processes, seconds, output_size, failures in summary[:limit]:
+        lines.append("%-50s %7d %9.3f %10d %6d" % (key[:50], processes, seconds, output_size, failures))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Summarize a SolydXK System Settings process trace')
+    parser.add_argument('path', nargs='?', default=TRACE_PATH,
+                        help='Trace file (default: %s)' % TRACE_PATH)
+    parser.add_argument('-g', '--group-by', default='caller',
+                        choices=['caller', 'command', 'function', 'thread'],
+                        help='Field to group the processes by (default: caller)')
+    parser.add_argument('-l', '--limit', type=int, default=None,
+                        help='Only show the most expensive groups')
+    args = parser.parse_args()
+    try:
+        records = read_trace(args.path)
+    except Exception as detail:
+        print(("ERROR: could not read %s: %s" % (args.path, detail)))
+        sys.exit(1)
+    print((get_text_summary(records, args.group_by, args.limit)))
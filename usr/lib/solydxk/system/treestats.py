@@ -0,0 +1,113 @@
+#! /usr/bin/env python3
+
+# ====================================================================
+# File count and size of a directory tree
+# ====================================================================
+# from treestats import get_tree_stats, BACKUP_EXCLUDES
+# stats = get_tree_stats('/home', BACKUP_EXCLUDES)
+# stats['files'], stats['apparent_bytes'], stats['allocated_bytes']
+#
+# Each sub directory of the root is scanned by a worker thread with
+# os.scandir. Hard linked files are counted in 'files' for every path
+# (rsync copies every path) but their size is only counted once.
+# Symbolic links are not followed.
+# ====================================================================
+
+import os
+import threading
+from fnmatch import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+
+# Paths relative to the root of a partition that are not backed up (see EnDecryptPartitions.backup_partition)
+BACKUP_EXCLUDES = "dev/* proc/* sys/* tmp/* run/* mnt/* media/* lost+found source".split()
+
+# Scanning is mostly waiting for the disk: more threads than processors help
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+
+class TreeScanner():
+    def __init__(self, root, excludes=[]):
+        self.root = root
+        self.excludes = excludes
+        # (device, inode) of hard linked files that were already counted
+        self.seen = set()
+        self._lock = threading.Lock()
+
+    def is_excluded(self, rel_path):
+        return any(fnmatch(rel_path, pattern) for pattern in self.excludes)
+
+    # Add a non-directory entry to stats
+    def add_file(self, stats, st):
+        stats['files'] += 1
+        if st.st_nlink > 1:
+            key = (st.st_dev, st.st_ino)
+            with self._lock:
+                if key in self.seen:
+                    return
+                self.seen.add(key)
+        stats['apparent_bytes'] += st.st_size
+        stats['allocated_bytes'] += st.st_blocks * 512
+
+    # Scan the entries of a directory: return the paths of its sub directories
+    def scan_dir(self, stats, dir_path):
+        sub_dirs = []
+        try:
+            entries = list(os.scandir(dir_path))
+        except OSError:
+            stats['errors'] += 1
+            return sub_dirs
+        for entry in entries:
+            if self.excludes and self.is_excluded(os.path.relpath(entry.path, self.root)):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stats['dirs'] += 1
+                    sub_dirs.append(entry.path)
+                else:
+                    self.add_file(stats, entry.stat(follow_symlinks=False))
+            except OSError:
+                stats['errors'] += 1
+        return sub_dirs
+
+    # Scan a directory and everything below it: return a stats dictionary
+    def scan(self, path):
+        stats = new_stats()
+        stack = [path]
+        while stack:
+            stack.extend(self.scan_dir(stats, stack.pop()))
+        return stats
+
+
+def new_stats():
+    return {'files': 0, 'dirs': 0, 'apparent_bytes': 0, 'allocated_bytes': 0, 'errors': 0}
+
+
+# Return {'files', 'dirs', 'apparent_bytes', 'allocated_bytes', 'errors'} of a directory tree
+# excludes: glob patterns relative to path (e.g. BACKUP_EXCLUDES)
+def get_tree_stats(path, excludes=[], workers=MAX_WORKERS):
+    stats = new_stats()
+    if not os.path.isdir(path):
+        return stats
+    scanner = TreeScanner(path, excludes)
+
+    # Scan the first level here and give each sub directory to a worker
+    sub_dirs = scanner.scan_dir(stats, path)
+    if sub_dirs:
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(sub_dirs)))) as executor:
+            for result in executor.map(scanner.scan, sub_dirs):
+                for key in stats:
+                    stats[key] += result[key]
+    return stats
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    if len(sys.argv) < 2:
+        print(("Usage: %s PATH [EXCLUDE ...]" % sys.argv[0]))
+        sys.exit(1)
+    t = time.time()
+    stats = get_tree_stats(sys.argv[1], sys.argv[2:])
+    for key, value in stats.items():
+        print(("%-16s %d" % (key, value)))
+    print(("%-16s %.3f" % ('seconds', time.time() - t)))
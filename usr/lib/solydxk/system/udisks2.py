@@ -4,16 +4,26 @@
 # http://storaged.org/doc/udisks2-api/latest/ref-library.html
 
 import gi
-# Make sure the right UDisks version is loaded
-gi.require_version('UDisks', '2.0')
-from gi.repository import UDisks, GLib
+from gi.repository import GLib
 from os.path import exists, join, basename
 import os
 from os import makedirs
-from utils import getoutput, shell_exec, has_grub, get_uuid, \
+from cache import invalidate
+from bootsector import get_bootloaders
+from utils import run_process, is_device_mounted, get_uuid, \
                   get_mount_points, get_filesystem, get_label
-from encryption import get_status, is_encrypted, \
-                       is_connected, connect_block_device
+
+
+# The UDisks typelib is loaded when the first client is created
+_udisks = None
+def get_udisks_client():
+    global _udisks
+    if _udisks is None:
+        # Make sure the right UDisks version is loaded
+        gi.require_version('UDisks', '2.0')
+        from gi.repository import UDisks
+        _udisks = UDisks
+    return _udisks.Client.new_sync(None)
 
 
 # Subclass dict class to overwrite the __missing__() method
@@ -38,7 +48,7 @@ class Udisks2():
 
         self.devices.clear()
 
-        client = UDisks.Client.new_sync(None)
+        client = get_udisks_client()
         manager = client.get_object_manager()
         objects = manager.get_objects()
 
@@ -140,7 +150,6 @@ class Udisks2():
                 if add_device:
                     uuid = get_uuid(device_path)
                     label = get_label(device_path)
-                    grub = has_grub(device_path)
                     debug_title = "Device Info of: %s" % device_path
                     print(('========== %s ==========' % debug_title))
                     print(('UUID: %s' % uuid))
@@ -154,7 +163,6 @@ class Udisks2():
                     print(('Removable: %s' % str(removable)))
                     print(('Ejectable: %s' % str(ejectable)))
                     print(('CanPowerOff: %s' % str(canpoweroff)))
-                    print(('Has Grub: %s' % str(grub)))
                     print((('=' * 22) + ('=' * len(debug_title))))
 
                     # Partition information
@@ -169,32 +177,36 @@ class Udisks2():
                     self.devices[device_path]['removable'] = removable
                     self.devices[device_path]['ejectable'] = ejectable
                     self.devices[device_path]['canpoweroff'] = canpoweroff
-                    self.devices[device_path]['has_grub'] = grub
+
+        # Inspect the boot sectors of all devices at once
+        for device_path, bootloader in get_bootloaders(list(self.devices)).items():
+            self.devices[device_path]['has_grub'] = bootloader == 'grub'
+            print(('Boot loader on %s: %s' % (device_path, bootloader or 'none')))
 
     def _get_object_path(self, device_path):
         return "/org/freedesktop/UDisks2/block_devices/%s" % basename(device_path)
 
     def _get_block(self, device_path):
         obj_path = self._get_object_path(device_path)
-        client = UDisks.Client.new_sync(None)
+        client = get_udisks_client()
         dev = client.get_object(obj_path)
         return dev.get_block()
 
     def _get_filesystem(self, device_path):
         obj_path = self._get_object_path(device_path)
-        client = UDisks.Client.new_sync(None)
+        client = get_udisks_client()
         dev = client.get_object(obj_path)
         return dev.get_filesystem()
 
     def _get_partition(self, device_path):
         obj_path = self._get_object_path(device_path)
-        client = UDisks.Client.new_sync(None)
+        client = get_udisks_client()
         dev = client.get_object(obj_path)
         return dev.get_partition()
 
     def _get_drive(self, device_path):
         obj_path = self._get_object_path(device_path)
-        client = UDisks.Client.new_sync(None)
+        client = get_udisks_client()
         manager = client.get_object_manager()
         dev = client.get_object(obj_path)
         block = dev.get_block()
@@ -244,10 +256,7 @@ class Udisks2():
         return devices
 
     def is_mounted(self, device_path):
-        ret = getoutput("grep '%s ' /proc/mounts" % device_path)[0]
-        if device_path in ret:
-            return True
-        return False
+        return is_device_mounted(device_path)
     
     def mount_device(self, device_path, mount_point=None, filesystem=None, options=None, passphrase=None):
         if mount_point is None:
@@ -260,8 +269,8 @@ class Udisks2():
             passphrase = ''
             
         # Connect encrypted partition
-        connected = False
         if passphrase:
+            from encryption import is_encrypted, is_connected, connect_block_device
             if is_encrypted(device_path) and not is_connected(device_path):
                 device_path, filesystem = connect_block_device(device_path, passphrase)
                 
@@ -293,14 +302,14 @@ class Udisks2():
         if not exists(mount_point):
             makedirs(mount_point, exist_ok=True)
         if exists(mount_point):
+            args = ['mount']
             if options:
                 if options[0:1] != '-':
-                    options = '-o ' + options
-            else:
-                options = ''
-            fs = '-t ' + filesystem if filesystem else ''
-            cmd = "mount {options} {fs} {device_path} {mount_point}".format(**locals())
-            shell_exec(cmd)
+                    args.append('-o')
+                args.extend(options.split())
+            if filesystem:
+                args.extend(['-t', filesystem])
+            run_process(args + [device_path, mount_point])
         if self.is_mounted(device_path):
             filesystem = get_filesystem(device_path)
             return (device_path, mount_point, filesystem)
@@ -314,10 +323,11 @@ class Udisks2():
             except:
                 pass
         if self.is_mounted(device_path):
-            shell_exec("umount -f {}".format(device_path))
+            run_process(['umount', '-f', device_path])
         if not self.is_mounted(device_path):
+            from encryption import is_encrypted
             if is_encrypted(device_path):
-                shell_exec("cryptsetup close {} 2>/dev/null".format(device_path))
+                run_process(['cryptsetup', 'close', device_path])
             return True
         return False
 
@@ -339,6 +349,9 @@ class Udisks2():
             return fs.set_label_sync(label, self.no_options, None)
         except:
             raise
+        finally:
+            # Cached labels are outdated
+            invalidate('devices')
 
     def set_filesystem_label_by_device(self, device_path, label):
         fs = self._get_filesystem(device_path)
@@ -373,6 +386,7 @@ class Udisks2():
     def get_drive_from_device_path(self, device_path):
         if '/dev/mapper' in device_path:
             if exists(device_path):
+                from encryption import get_status
                 status = get_status(device_path)
                 device_path = status['device']
             else:
@@ -394,11 +408,12 @@ class Udisks2():
         mapper_path = ''
         mount_points = []
         mapper = '/dev/mapper'
-        mapper_name = getoutput("ls %s | grep %s$" % (mapper, basename(partition_path)))[0]
+        names = sorted(os.listdir(mapper)) if exists(mapper) else []
+        mapper_name = next((n for n in names if n.endswith(basename(partition_path))), '')
         if not mapper_name:
             uuid = get_uuid(partition_path)
             if uuid:
-                mapper_name = getoutput("ls %s | grep %s$" % (mapper, uuid))[0]
+                mapper_name = next((n for n in names if n.endswith(uuid)), '')
         if mapper_name:
             mapper_path = join(mapper, mapper_name)
         if mapper_path:
@@ -1,87 +1,194 @@
 #! /usr/bin/env python3
 
+import os
+import sys
+import time
 import subprocess
-from socket import timeout
-from urllib.request import ProxyHandler, HTTPBasicAuthHandler, Request, \
-                           build_opener, HTTPHandler, install_opener, urlopen
-from urllib.error import URLError, HTTPError
 from random import choice
 import re
 import threading
 import operator
-import apt
 import filecmp
-from os import walk, listdir
+from os import listdir
 from os.path import exists, isdir, expanduser,  splitext,  dirname, islink
-from distutils.version import LooseVersion, StrictVersion
+from shutil import which
+from cache import cached, invalidate_for_command
+from procfs import facts
+from blockindex import block_index
+from dpkgstatus import dpkg_status
+from aptcache import apt_cache
+from debversion import compare_versions
+from bootsector import get_bootloader
+from configfiles import config_files, parse_config_file
+
+# Functions that are called with a dictionary with process information
+# for every process started by this module (see profiler.py and tracer.py):
+# command, function, caller, thread, time, seconds, returncode, output_size
+process_hooks = []
+
+# Files that are skipped when looking for the function that started a process
+CALLER_SKIP_FILES = ['utils.py', 'cache.py', 'blockindex.py', 'threading.py']
+_process_context = threading.local()
+
+
+# Return module.function of the first caller outside this module
+def get_process_caller():
+    caller = getattr(_process_context, 'caller', '')
+    if caller:
+        return caller
+    frame = sys._getframe(1)
+    while frame is not None:
+        file_name = os.path.basename(frame.f_code.co_filename)
+        if file_name not in CALLER_SKIP_FILES:
+            return "%s.%s" % (splitext(file_name)[0], frame.f_code.co_name)
+        frame = frame.f_back
+    return ''
+
+
+# start: time the process started
+# returncode and output_size are None when unknown (e.g. shell_exec_popen)
+# running: the process was only started, its seconds are None
+def notify_process_hooks(command, function='', start=None, returncode=None, output_size=None, running=False):
+    if not process_hooks:
+        return
+    info = {'command': command,
+            'function': function,
+            'caller': get_process_caller(),
+            'thread': threading.current_thread().name,
+            'time': start,
+            'seconds': None if start is None or running else round(time.time() - start, 4),
+            'returncode': returncode,
+            'output_size': output_size}
+    for hook in process_hooks:
+        try:
+            hook(info)
+        except Exception as detail:
+            print(("Process hook error: %s" % detail))
+
 
-    
 def shell_exec_popen(command, kwargs={}):
     print(("Executing: %s" % command))
+    # The process is still running: only the start is reported
+    notify_process_hooks(command, 'shell_exec_popen', time.time(), running=True)
     #return subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, **kwargs)
+    # Invalidated when started: the caller reads the output while it runs
+    invalidate_for_command(command)
     return subprocess.Popen(command, shell=True, bufsize=0, stdout=subprocess.PIPE, universal_newlines=True, **kwargs)
 
 
 def shell_exec(command):
     print(("Executing: %s" % command))
+    start = time.time()
     # Returns the returncode attribute
-    return subprocess.call(command, shell=True)
+    ret = subprocess.call(command, shell=True)
+    notify_process_hooks(command, 'shell_exec', start, ret)
+    invalidate_for_command(command)
+    return ret
 
 
 def getoutput(command):
     #return shell_exec(command).stdout.read().strip()
     #print(("Executing: %s" % command))
+    start = time.time()
+    returncode = None
+    output_size = None
     try:
-        output = subprocess.check_output(command, shell=True).decode('utf-8').strip().split('\n')
+        p = subprocess.run(command, shell=True, stdout=subprocess.PIPE)
+        returncode = p.returncode
+        output_size = len(p.stdout)
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, command)
+        output = p.stdout.decode('utf-8').strip().split('\n')
     except:
         output = ['']
+    notify_process_hooks(command, 'getoutput', start, returncode, output_size)
+    invalidate_for_command(command)
     return output
 
 
+# Result of run_process
+class ProcessResult():
+    def __init__(self, args, returncode, stdout='', stderr=''):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+
+    def __bool__(self):
+        return self.returncode == 0
+
+    # Output lines like getoutput: [''] when there is no output
+    @property
+    def lines(self):
+        return self.stdout.strip().split('\n')
+
+    # Return the output lines that match the regular expression
+    def grep(self, pattern):
+        return [line for line in self.stdout.splitlines() if re.search(pattern, line)]
+
+
+# Run a command given as argument list (no shell)
+# input_text: string that is written to stdin (e.g. a passphrase)
+# env: dictionary with environment variables added to the current environment
+# stdin, stdout: open files to redirect from and to (result.stdout is then empty)
+# Errors are not raised but returned in the result:
+# returncode 127 when the command was not found, -1 on timeout
+def run_process(args, input_text=None, env=None, timeout=None, stdin=None, stdout=None):
+    args = [str(arg) for arg in args]
+    start = time.time()
+    process_env = None
+    if env is not None:
+        process_env = os.environ.copy()
+        process_env.update(env)
+    try:
+        p = subprocess.run(args,
+                           input=input_text,
+                           stdin=stdin,
+                           stdout=subprocess.PIPE if stdout is None else stdout,
+                           stderr=subprocess.PIPE,
+                           env=process_env,
+                           timeout=timeout,
+                           universal_newlines=True,
+                           errors='replace')
+        result = ProcessResult(args, p.returncode, p.stdout or '', p.stderr)
+        invalidate_for_command(' '.join(args))
+    except subprocess.TimeoutExpired as detail:
+        result = ProcessResult(args, -1, '', str(detail))
+    except OSError as detail:
+        result = ProcessResult(args, 127, '', str(detail))
+    notify_process_hooks(' '.join(args), 'run_process', start, result.returncode, len(result.stdout))
+    return result
+
+
+# Return the output lines of a command given as argument list
+# Same return value as getoutput: [''] on error
+def get_process_output(args, input_text=None, env=None, timeout=None):
+    result = run_process(args, input_text, env, timeout)
+    if result.returncode != 0:
+        return ['']
+    return result.lines
+
+
+# Check /proc/mounts for a mounted device
+def is_device_mounted(device_path):
+    return facts.is_mounted(device_path)
+
+
 def chroot_exec(command, target):
     command = command.replace('"', "'").strip()  # FIXME
     return shell_exec('chroot %s/ /bin/sh -c "%s"' % (target, command))
 
 
-def memoize(func):
-    """ Caches expensive function calls.
-
-    Use as:
-
-        c = Cache(lambda arg: function_to_call_if_yet_uncached(arg))
-        c('some_arg')  # returns evaluated result
-        c('some_arg')  # returns *same* (non-evaluated) result
-
-    or as a decorator:
-
-        @memoize
-        def some_expensive_function(args [, ...]):
-            [...]
-
-    See also: http://en.wikipedia.org/wiki/Memoization
-    """
-    class memodict(dict):
-        def __call__(self, *args):
-            return self[args]
-
-        def __missing__(self, key):
-            ret = self[key] = func(*key)
-            return ret
-    return memodict()
-
-
-def get_config_dict(file, key_value=re.compile(r'^\s*(\w+)\s*=\s*["\']?(.*?)["\']?\s*(#.*)?$')):
+def get_config_dict(file, key_value=None):
     """Returns POSIX config file (key=value, no sections) as dict.
-    Assumptions: no multiline values, no value contains '#'. """
-    d = {}
-    with open(file) as f:
-        for line in f:
-            try:
-                key, value, _ = key_value.match(line).groups()
-            except AttributeError:
-                continue
-            d[key] = value
-    return d
+    Assumptions: no multiline values, no value contains '#'.
+    Returns a copy of the shared parsed file (see configfiles.py). """
+    if key_value is not None:
+        return parse_config_file(file, key_value)
+    if not exists(file):
+        # A missing file raises like open()
+        return parse_config_file(file)
+    return dict(config_files.get_dict(file))
 
 
 # Check for internet connection
@@ -106,6 +213,11 @@ def has_internet_connection(test_url=None):
 
 
 def get_value_from_url(url, timeout_secs=5, return_errors=False):
+    # urllib is only needed for the mirror functions: import on first use
+    from socket import timeout
+    from urllib.request import ProxyHandler, HTTPBasicAuthHandler, Request, \
+                               build_opener, HTTPHandler, install_opener, urlopen
+    from urllib.error import URLError, HTTPError
     try:
         # http://www.webuseragents.com/my-user-agent
         user_agents = [
@@ -154,93 +266,105 @@ def get_value_from_url(url, timeout_secs=5, return_errors=False):
 
 # Check if running in VB
 def in_virtualbox():
-    vb = 'VirtualBox'
-    dmiBIOSVersion = getoutput("grep '{}' /sys/devices/virtual/dmi/id/bios_version".format(vb))
-    dmiSystemProduct = getoutput("grep '{}' /sys/devices/virtual/dmi/id/product_name".format(vb))
-    dmiBoardProduct = getoutput("grep '{}' /sys/devices/virtual/dmi/id/board_name".format(vb))
-    if vb not in dmiBIOSVersion and \
-       vb not in dmiSystemProduct and \
-       vb not in dmiBoardProduct:
-        return False
-    return True
+    return facts.in_virtualbox()
 
 
 # Check if is 64-bit system
 def is_amd64():
-    machine = getoutput("uname -m")[0]
-    if machine == "x86_64":
-        return True
-    return False
+    return facts.is_amd64()
 
 # Check if xfce is running
 def is_xfce_running():
-    xfce = getoutput('pidof xfce4-session')[0]
-    if xfce:
+    if facts.get_pids('xfce4-session'):
         return True
     return False
 
 
+# Parse apt-cache policy output into the dictionary of get_package_versions
+def parse_apt_policy(lines, names):
+    versions = {}
+    for name in names:
+        versions[name] = {'installed': '', 'candidate': '', 'origins': []}
+    current = None
+    for line in lines:
+        if line and not line[0].isspace() and line.rstrip().endswith(':'):
+            current = versions.get(line.strip()[:-1])
+            continue
+        if current is None:
+            continue
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == 'Installed:':
+            current['installed'] = fields[1]
+        elif len(fields) == 2 and fields[0] == 'Candidate:':
+            current['candidate'] = fields[1]
+        elif len(fields) >= 3 and '://' in fields[1]:
+            # 500 http://deb.debian.org/debian buster-backports/main amd64 Packages
+            origin = "%s %s" % (fields[1].split('/')[2], fields[2])
+            if origin not in current['origins']:
+                current['origins'].append(origin)
+    return versions
+
+
+# Return {name: {'installed', 'candidate', 'origins'}} for a list of packages
+# Versions are '(none)' when there is no such version, '' when the package is unknown
+def get_package_versions(names):
+    names = list(names)
+    versions = apt_cache.get_versions(names)
+    if versions is None:
+        # python-apt is not available: one apt-cache call for all packages
+        result = run_process(['apt-cache', 'policy'] + names, env={'LANG': 'C'})
+        versions = parse_apt_policy(result.stdout.splitlines(), names)
+    return versions
+
+
+# Return the installed (or candidate) version of a package
 def get_package_version(package, candidate=False):
-    version = ''
-    cmd = "env LANG=C bash -c 'apt-cache policy %s | grep \"Installed:\"'" % package
-    if candidate:
-        cmd = "env LANG=C bash -c 'apt-cache policy %s | grep \"Candidate:\"'" % package
-    lst = getoutput(cmd)[0].strip().split(' ')
-    if lst:
-        version = lst[-1]
-    return version
+    return get_package_versions([package])[package]['candidate' if candidate else 'installed']
     
-# Compare two package version strings
+# Compare two package version strings with dpkg version ordering
+# Returns 'smaller', 'larger' or 'equal' ('' when a version is not a string)
+# compare_loose is kept for compatibility: dpkg ordering handles both cases
 def compare_package_versions(package_version_1, package_version_2, compare_loose=True):
-    if compare_loose:
-        try:
-            if LooseVersion(package_version_1) < LooseVersion(package_version_2):
-                return 'smaller'
-            if LooseVersion(package_version_1) > LooseVersion(package_version_2):
-                return 'larger'
-            else:
-                return 'equal'
-        except:
-            return ''
-    else:
-        try:
-            if StrictVersion(package_version_1) < StrictVersion(package_version_2):
-                return 'smaller'
-            if StrictVersion(package_version_1) > StrictVersion(package_version_2):
-                return 'larger'
-            else:
-                return 'equal'
-        except:
-            return ''
+    try:
+        result = compare_versions(package_version_1, package_version_2)
+    except:
+        return ''
+    if result < 0:
+        return 'smaller'
+    if result > 0:
+        return 'larger'
+    return 'equal'
 
 # Get system version information
 def get_system_version_info():
-    info = ''
-    try:
-        infoList = getoutput('cat /proc/version')
-        if infoList:
-            info = infoList[0]
-    except Exception as detail:
-        print((detail))
-    return info
+    return facts.get_kernel_version()
+
+
+# Return the display modes without duplicates: ['1920x1080', ...]
+# Read from sysfs (uvesafb when use_vesa, DRM connectors);
+# xrandr and hwinfo are only used when sysfs has no modes
+@cached(ttl=60, tags=['display'])
+def get_display_modes(use_vesa=False):
+    modes = []
+    if use_vesa:
+        modes = facts.get_vbe_modes()
+    if not modes:
+        modes = facts.get_drm_modes()
+    if not modes:
+        modes = [line.split()[0] for line in get_process_output(['xrandr']) if re.match(r'^\s+\d+x\d+\s', line)]
+    if not modes and use_vesa and which('hwinfo'):
+        modes = [line.split()[2] for line in get_process_output(['hwinfo', '--framebuffer'])
+                 if len(line.split()) > 2 and re.match(r'^\d+x\d+$', line.split()[2])]
+    return list(dict.fromkeys(modes))
 
 
 # Get valid screen resolutions
 def get_resolutions(minRes='', maxRes='', reverse_order=False, use_vesa=False):
-    cmd = None
     resolutions = []
     default_res = ['640x480', '800x600', '1024x768', '1280x1024', '1600x1200']
 
-    cmd = "xrandr | awk '{print $1}' | egrep '[0-9]+x[0-9]+$'"
-    if use_vesa:
-        vbeModes = '/sys/bus/platform/drivers/uvesafb/uvesafb.0/vbe_modes'
-        if exists(vbeModes):
-            cmd = "cat %s | cut -d'-' -f1" % vbeModes
-        elif is_package_installed('hwinfo'):
-            cmd = "hwinfo --framebuffer | awk '{print $3}' | egrep '[0-9]+x[0-9]+$' | uniq"        
-
-    resolutions = getoutput(cmd)
-    if not resolutions[0]:
+    resolutions = get_display_modes(use_vesa)
+    if not resolutions:
         resolutions = default_res
 
     # Remove any duplicates from the list
@@ -283,8 +407,11 @@ def get_resolutions(minRes='', maxRes='', reverse_order=False, use_vesa=False):
     return avlRes
     
 
+# Size of the frame buffer; xrandr and xdpyinfo when there is no frame buffer
 def get_current_resolution():
-    res = getoutput("xrandr | grep '*' | awk '{print $1}'")[0]
+    res = facts.get_framebuffer_size()
+    if not res:
+        res = getoutput("xrandr | grep '*' | awk '{print $1}'")[0]
     if not res:
         res = getoutput("xdpyinfo | grep dimensions | sed -r 's/^[^0-9]*([0-9]+x[0-9]+).*$/\1/'")[0]
     return res
@@ -390,62 +517,45 @@ def has_string_in_file(searchString, filePath):
     return False
 
 
+# Replace a regular expression in a file (like sed -i 's/regexp/replacement/g')
+def replace_in_file(regexp, replacement, filePath):
+    if exists(filePath):
+        with open(filePath, 'r') as f:
+            text = f.read()
+        new_text = re.sub(regexp, replacement, text, flags=re.MULTILINE)
+        if new_text != text:
+            with open(filePath, 'w') as f:
+                f.write(new_text)
+
+
 # Check if a package is installed
+# packageName can be a pattern with wildcards (e.g. nvidia-*)
+# alsoCheckVersion: the installed version must also be the candidate version
 def is_package_installed(packageName, alsoCheckVersion=False):
-    isInstalled = False
-    expr = '^i\s([a-z0-9\-_\.]+)\s+(.*)\s+(.*)'
-    if not '*' in packageName:
-        packageName = '^{}$'.format(packageName)
-    try:
-        # https://aptitude.alioth.debian.org/doc/en/ch02s05s01.html
-        cmd = "aptitude search -F '%c %p %v %V' --disable-columns {} | grep ^i".format(packageName)
-        pckList = getoutput(cmd)
-        for line in pckList:
-            matchObj = re.search(expr, line)
-            if matchObj:
-                if alsoCheckVersion:
-                    if matchObj.group(2) == matchObj.group(3):
-                        isInstalled = True
-                        break
-                else:
-                    isInstalled = True
-                    break
-            if isInstalled:
-                break
-    except:
-        pass
-    return isInstalled
+    names = [name for name in dpkg_status.match(packageName) if dpkg_status.is_installed(name)]
+    if not alsoCheckVersion:
+        return len(names) > 0
+    versions = get_package_versions(names)
+    for name in names:
+        if dpkg_status.get_version(name) == versions[name]['candidate']:
+            return True
+    return False
 
 
 # Check if a package exists
 def does_package_exist(packageName):
-    try:
-        cache = apt.Cache()
-        cache[packageName]
-        return True
-    except:
-        return False
+    return apt_cache.has_package(packageName)
 
 
 def is_running_live():
-    liveDirs = ['/live', '/lib/live/mount', '/rofs']
-    for ld in liveDirs:
-        if exists(ld):
-            return True
-    return False
+    return facts.is_running_live()
 
 
+# Return the pids as strings: [''] when the process is not running
 def get_process_pids(process_name, process_argument=None, fuzzy=False):
-    if fuzzy:
-        args = ''
-        if process_argument is not None:
-            args = "| grep '%s'" % process_argument
-        cmd = "ps -ef | grep -v grep | grep '%s' %s | awk '{print $2}'" % (process_name, args)
-        #print(cmd)
-        pids = getoutput(cmd)
-    else:
-        pids = getoutput("pidof %s" % process_name)
-    return pids
+    pids = [str(pid) for pid in facts.get_pids(process_name, process_argument, fuzzy)
+            if pid != os.getpid()]
+    return pids or ['']
 
 
 def is_process_running(process_name, process_argument=None, fuzzy=False):
@@ -467,7 +577,7 @@ def get_apt_force():
     
 def get_apt_cache_locked_program():
     aptPackages = ["dpkg", "apt-get", "synaptic", "adept", "adept-notifier"]
-    procLst = getoutput("ps -U root -u root -o comm=")
+    procLst = [proc['comm'] for proc in facts.get_processes() if proc['uid'] == 0]
     for aptProc in aptPackages:
         if aptProc in procLst:
             return aptProc
@@ -488,11 +598,13 @@ def get_debian_name():
 
 
 # Get Debian's version number (float)
+@cached()
 def get_debian_version():
     out = getoutput("egrep -o '[0-9]{1,}' /etc/debian_version | head -n 1 2>/dev/null || echo 0")
     return str_to_nr(out[0], True)
 
 
+@cached(ttl=300, tags=['packages'])
 def get_firefox_version():
     return str_to_nr(getoutput("firefox --version 2>/dev/null | egrep -o '[0-9]{2,}' || echo 0")[0], True)
 
@@ -515,12 +627,8 @@ def get_backports(exclude_disabled=True):
 
 
 def has_newer_in_backports(package_name, backports_repository):
-    try:
-        out = getoutput("apt-cache madison %s | grep %s" % (package_name, backports_repository))[0]
-        if out != '':
-            return True
-    except:
-        return False
+    origins = get_package_versions([package_name])[package_name]['origins']
+    return any(backports_repository in origin for origin in origins)
 
 
 # Comment or uncomment a line with given pattern in a file
@@ -533,37 +641,41 @@ def comment_line(file_path, pattern, comment=True):
         shell_exec(cmd)
 
 
-def get_nr_files_in_dir(path, recursive=True):
+def get_nr_files_in_dir(path, recursive=True, excludes=[]):
     total = 0
     if isdir(path):
         #return str_to_nr(getoutput("find %s -type f | wc -l" % path)[0], True)
         if recursive:
-            for root, directories, filenames in walk(path):
-                total += len(filenames)
+            from treestats import get_tree_stats
+            total = get_tree_stats(path, excludes)['files']
         else:
             total = len(listdir(path))
     return total
 
 
+@cached()
 def get_logged_user():
     return getoutput("logname")[0]
 
 
+# Release of the running kernel (uname -r)
+def get_kernel_release():
+    return os.uname().release
+
+
 def get_user_home():
     return expanduser("~%s" % get_logged_user())
     
     
 def has_grub(path):
-    cmd = "dd bs=512 count=1 if=%s 2>/dev/null | strings" % path
-    out = ' '.join(getoutput(cmd)).upper()
-    if "GRUB" in out:
+    if get_bootloader(path) == 'grub':
         print(("Grub installed on %s" % path))
         return True
     return False
     
     
 def get_uuid(partition_path):
-    return getoutput("blkid -o value -s UUID {}".format(partition_path))[0]
+    return block_index.get_value(partition_path, 'UUID')
 
 
 def get_mount_points(partition_path):
@@ -571,23 +683,25 @@ def get_mount_points(partition_path):
     return out if out[0] else []
 
 def get_filesystem(partition_path):
-    return getoutput("blkid -o value -s TYPE %s" % partition_path)[0]
+    return block_index.get_value(partition_path, 'TYPE')
 
 
 def get_device_from_uuid(uuid):
     uuid = uuid.replace('UUID=', '')
-    return getoutput("blkid -U {}".format(uuid))[0]
+    return block_index.find('UUID', uuid)
 
 
 def get_label(partition_path):
-    return getoutput("sudo blkid -o value -s LABEL %s" % partition_path)[0]
+    return block_index.get_value(partition_path, 'LABEL')
 
 
 def get_swap_device():
-    return getoutput("grep '/' /proc/swaps | awk '{print $1}'")[0]
+    devices = facts.get_swap_devices()
+    return devices[0] if devices else ''
 
 
 # Class to run commands in a thread and return the output in a queue
+# commandList: a shell command or a list of shell commands and/or argument lists
 class ExecuteThreadedCommands(threading.Thread):
     def __init__(self, commandList, queue=None, return_output=False):
         threading.Thread.__init__(self)
@@ -595,8 +709,11 @@ class ExecuteThreadedCommands(threading.Thread):
         self._commands = commandList
         self._queue = queue
         self._return_output = return_output
+        self._caller = get_process_caller() if process_hooks else ''
 
     def run(self):
+        # Report the processes for the function that created this thread
+        _process_context.caller = self._caller
         if isinstance(self._commands, (list, tuple)):
             for cmd in self._commands:
                 self.exec_cmd(cmd)
@@ -604,7 +721,13 @@ class ExecuteThreadedCommands(threading.Thread):
             self.exec_cmd(self._commands)
 
     def exec_cmd(self, cmd):
-        if self._return_output:
+        if isinstance(cmd, (list, tuple)):
+            # Argument list: run without a shell
+            result = run_process(cmd)
+            if result.returncode != 0:
+                print(("Error: %s: %s" % (' '.join(result.args), result.stderr.strip())))
+            ret = result.lines if self._return_output else result.returncode
+        elif self._return_output:
             ret = getoutput(cmd)
         else:
             ret = shell_exec(cmd)